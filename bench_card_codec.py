@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+import time
+import zlib
+
+from card_codec import compress, decompress, train_dictionary
+from card_snapshot import (
+    CardSnapshot,
+    dictionary_path,
+    snapshot_files,
+    snapshot_path,
+    write_snapshot,
+)
+
+# 共有辞書つき圧縮の効果と、カード1枚あたりの展開時間を計測する
+# 使い方: python bench_card_codec.py [sharousi_data.json | ap_siken_data.json]
+
+SAVE_FILE = sys.argv[1] if len(sys.argv) > 1 else "sharousi_data.json"
+
+if os.path.exists(SAVE_FILE):
+    with open(SAVE_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    texts = [c.get("front", "") for c in data] + [c.get("back", "") for c in data]
+    raw_size = sum(len(t.encode("utf-8")) for t in texts)
+    print(f"Cards: {len(data)}")
+    print(f"Raw text: {raw_size / 1024:.1f} KB")
+
+    t0 = time.perf_counter()
+    zdict = train_dictionary(texts)
+    print(f"Dictionary: {len(zdict) / 1024:.1f} KB ({time.perf_counter() - t0:.2f} s)")
+
+    plain_size = sum(len(zlib.compress(t.encode("utf-8"), 9)) for t in texts)
+    blobs = [compress(t, zdict) for t in texts]
+    dict_size = sum(len(b) for b in blobs)
+    print(f"zlib (項目ごと, 辞書なし): {plain_size / 1024:.1f} KB")
+    print(f"zlib (項目ごと, 共有辞書): {dict_size / 1024:.1f} KB")
+
+    # 展開時間 (1項目ずつ)
+    t0 = time.perf_counter()
+    for b in blobs:
+        decompress(b, zdict)
+    per_item = (time.perf_counter() - t0) / max(1, len(blobs))
+    print(f"展開時間 (1項目あたり): {per_item * 1e6:.1f} us")
+
+    # スナップショット経由でのカード1枚の展開時間 (表面 + 裏面)
+    out_path = snapshot_path(SAVE_FILE) + ".bench"
+    write_snapshot(data, out_path, retrain=True)
+    snap = CardSnapshot(out_path)
+    t0 = time.perf_counter()
+    for i in range(len(snap)):
+        snap.text(i, "front")
+        snap.text(i, "back")
+    per_card = (time.perf_counter() - t0) / max(1, len(snap))
+    print(f"スナップショット: {os.path.getsize(snap.path) / 1024:.1f} KB")
+    print(f"展開時間 (カード1枚あたり): {per_card * 1e3:.3f} ms")
+    if per_card >= 0.001:
+        print("警告: 1ミリ秒を超えています")
+    snap.close()
+    # 書き出したスナップショットと、一緒に保存された共有辞書を消す
+    for _, name in snapshot_files(out_path):
+        os.remove(name)
+    if os.path.exists(dictionary_path(out_path)):
+        os.remove(dictionary_path(out_path))
+else:
+    print(f"{SAVE_FILE} not found.")
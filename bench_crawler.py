@@ -0,0 +1,104 @@
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from crawler_core import Crawler
+
+# 取得エンジン (crawler_core) をローカルの代役サーバーに対して動かし、
+# 速度の上限を守っているかと、どれだけ上限に近い速さで取得できるかを確かめる
+# 使い方: python bench_crawler.py [1秒あたりのリクエスト数] [同時に処理する件数] [プロセス数]
+# プロセス数を2以上にすると、各プロセスが上限を共有して (shared_dir) 同じサーバーから取得する
+
+RATE = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+PROCESSES = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+BURST = 2
+PAGES = 40
+# 代役サーバーの応答にかかる時間 (秒) と、1件あたりの解析時間 (秒)
+LATENCY = 0.3
+PARSE_TIME = 0.1
+
+arrivals = []
+arrivals_lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with arrivals_lock:
+            arrivals.append(time.monotonic())
+        time.sleep(LATENCY)
+        body = f"<html><title>{self.path}</title></html>".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def work(url):
+    resp = crawler.get(url)
+    time.sleep(PARSE_TIME)  # 解析の代わり
+    return resp.status_code
+
+
+def crawl(urls, shared_dir, statuses):
+    global crawler
+    with Crawler(
+        rate=RATE,
+        burst=BURST,
+        jitter=0,
+        concurrency=CONCURRENCY,
+        shared_dir=shared_dir,
+    ) as crawler:
+        for _, status, error in crawler.map(work, urls):
+            statuses.put(status)
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/q/{i}" for i in range(PAGES)]
+
+    queue = multiprocessing.Queue()
+    t0 = time.monotonic()
+    with tempfile.TemporaryDirectory() as shared_dir:
+        workers = [
+            multiprocessing.Process(
+                target=crawl, args=(urls[n::PROCESSES], shared_dir, queue)
+            )
+            for n in range(PROCESSES)
+        ]
+        for w in workers:
+            w.start()
+        statuses = [queue.get() for _ in range(PAGES)]
+        for w in workers:
+            w.join()
+    elapsed = time.monotonic() - t0
+    server.shutdown()
+
+    # どの時間幅で数えても burst + rate * 幅 を超えていないか
+    worst = 0.0
+    for i, start in enumerate(arrivals):
+        for j in range(i, len(arrivals)):
+            window = arrivals[j] - start
+            allowed = BURST + RATE * window
+            worst = max(worst, (j - i + 1) - allowed)
+
+    print(f"取得: {statuses.count(200)} / {PAGES} 件, {elapsed:.2f} 秒")
+    print(
+        f"実際の速さ: {PAGES / elapsed:.2f} 件/秒 "
+        f"(上限 {RATE} 件/秒, バースト {BURST}, {PROCESSES} プロセス)"
+    )
+    # サーバー側で数えるので、通信時間のばらつき分 (1件未満) はずれることがある
+    exceeded = "なし" if worst < 0.5 else f"{worst:.2f} 件"
+    print(f"上限の超過: {exceeded} (最大 {worst:+.2f} 件)")
+    # 従来の「待ってから取得・解析」を1件ずつ行った場合の見積もり
+    sequential = PAGES * (1 / RATE + LATENCY + PARSE_TIME)
+    print(f"参考: 1件ずつ待機してから取得した場合の見積もり {sequential:.2f} 秒")
@@ -0,0 +1,377 @@
+import hashlib
+import html
+import json
+import os
+import re
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+import zipfile
+from array import array
+
+from card_export import export_dir, export_key, prune_exports
+from card_render import render_card
+from file_lock import atomic_write
+
+# Anki のデッキファイル (.apkg) のエクスポート
+# .apkg は Anki のコレクション (SQLite、collection.anki2) とメディアの一覧 (media) を
+# まとめた zip ファイル。CSV と違い、タグやノートの GUID を持てるので、
+# 同じカードを再エクスポートしてインポートすると重複せずに更新される。
+# GUID は source (問題ページのURL) から作るので、何度エクスポートしても同じになる。
+# Anki のフィールドは HTML なので、本文は card_render で HTML にしてから入れる
+# (カードデッキのコンポーネント・静的バンドルと同じ表示になる)。
+
+# 一度に挿入するノートの数
+INSERT_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null,
+    tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null
+);
+CREATE TABLE graves (
+    usn integer not null, oid integer not null, type integer not null
+);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+CSS = """.card {
+    font-family: sans-serif;
+    font-size: 18px;
+    text-align: left;
+    color: black;
+    background-color: white;
+}"""
+
+BASE91 = string.ascii_letters + string.digits + "!#$%&()*+,-./:;<=>?@[]^_`{|}~"
+
+_TAG = re.compile(r"<[^>]+>")
+
+
+def _hash_int(text, digits=15):
+    """テキストから決まる整数 (ID・GUID 用)"""
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:digits], 16)
+
+
+def guid_for(card):
+    """ノートの GUID (source から作るので、再エクスポートしても変わらない)"""
+    n = _hash_int(card.get("source") or card.get("front", ""), 16)
+    guid = ""
+    while n:
+        n, r = divmod(n, 91)
+        guid = BASE91[r] + guid
+    return guid or BASE91[0]
+
+
+def tags_for(card):
+    """科目・難易度・年度をタグにする (Anki のタグは空白を含められない)"""
+    tags = []
+    for key in ["subject", "level", "period"]:
+        value = card.get(key)
+        if value and value != "不明":
+            tags.append(re.sub(r"\s+", "_", str(value)))
+    return " " + " ".join(tags) + " " if tags else ""
+
+
+def _sort_field(field):
+    """ソート・重複チェック用のフィールド (HTML のタグを除いたテキスト)"""
+    return html.unescape(_TAG.sub("", field)).strip()
+
+
+def _collection(deck_name, model_id, deck_id, now):
+    model = {
+        "id": model_id,
+        "name": deck_name,
+        "type": 0,
+        "mod": now,
+        "usn": -1,
+        "sortf": 0,
+        "did": deck_id,
+        "tmpls": [
+            {
+                "name": "Card 1",
+                "ord": 0,
+                "qfmt": "{{表面}}",
+                "afmt": "{{FrontSide}}<hr id=answer>{{裏面}}",
+                "did": None,
+                "bqfmt": "",
+                "bafmt": "",
+            }
+        ],
+        "flds": [
+            {
+                "name": name,
+                "ord": i,
+                "sticky": False,
+                "rtl": False,
+                "font": "Arial",
+                "size": 20,
+                "media": [],
+            }
+            for i, name in enumerate(["表面", "裏面"])
+        ],
+        "css": CSS,
+        "latexPre": "",
+        "latexPost": "",
+        "latexsvg": False,
+        "req": [[0, "any", [0]]],
+        "tags": [],
+        "vers": [],
+    }
+    deck_common = {
+        "desc": "",
+        "mod": now,
+        "usn": -1,
+        "collapsed": False,
+        "newToday": [0, 0],
+        "revToday": [0, 0],
+        "lrnToday": [0, 0],
+        "timeToday": [0, 0],
+        "dyn": 0,
+        "conf": 1,
+        "extendNew": 10,
+        "extendRev": 50,
+    }
+    decks = {
+        "1": dict(deck_common, id=1, name="Default"),
+        str(deck_id): dict(deck_common, id=deck_id, name=deck_name),
+    }
+    dconf = {
+        "1": {
+            "id": 1,
+            "name": "Default",
+            "mod": 0,
+            "usn": 0,
+            "maxTaken": 60,
+            "autoplay": True,
+            "timer": 0,
+            "replayq": True,
+            "dyn": False,
+            "new": {
+                "delays": [1, 10],
+                "ints": [1, 4, 7],
+                "initialFactor": 2500,
+                "order": 1,
+                "perDay": 20,
+                "bury": True,
+                "separate": True,
+            },
+            "rev": {
+                "perDay": 200,
+                "ease4": 1.3,
+                "fuzz": 0.05,
+                "maxIvl": 36500,
+                "ivlFct": 1,
+                "bury": True,
+                "minSpace": 1,
+            },
+            "lapse": {
+                "delays": [10],
+                "mult": 0,
+                "minInt": 1,
+                "leechFails": 8,
+                "leechAction": 0,
+            },
+        }
+    }
+    conf = {
+        "activeDecks": [1],
+        "curDeck": 1,
+        "newSpread": 0,
+        "collapseTime": 1200,
+        "timeLim": 0,
+        "estTimes": True,
+        "dueCounts": True,
+        "curModel": str(model_id),
+        "nextPos": 1,
+        "sortType": "noteFld",
+        "sortBackwards": False,
+        "addToCur": True,
+    }
+    # id, crt, mod, scm, ver, dty, usn, ls, conf, models, decks, dconf, tags
+    return [
+        1,
+        now,
+        now * 1000,
+        now * 1000,
+        11,
+        0,
+        0,
+        0,
+        json.dumps(conf),
+        json.dumps({str(model_id): model}),
+        json.dumps(decks),
+        json.dumps(dconf),
+        "{}",
+    ]
+
+
+def write_apkg(cards, path, deck_name, progress=None):
+    """
+    カードを .apkg として書き出す
+    progress(件数) は INSERT_BATCH 件ごとに呼ばれる
+    戻り値: 書き出したノートの数
+    """
+    now = int(time.time())
+    model_id = _hash_int("model:" + deck_name, 12)
+    deck_id = _hash_int("deck:" + deck_name, 12)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, db_file = tempfile.mkstemp(suffix=".anki2", dir=directory)
+    os.close(fd)
+    count = 0
+    try:
+        conn = sqlite3.connect(db_file)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(SCHEMA)
+        conn.execute(
+            "INSERT INTO col VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _collection(deck_name, model_id, deck_id, now),
+        )
+
+        notes = []
+        used_ids = set()
+
+        def flush():
+            conn.executemany(
+                "INSERT INTO notes (id, guid, mid, mod, usn, tags, flds, sfld, csum, "
+                "flags, data) VALUES (?, ?, ?, ?, -1, ?, ?, ?, ?, 0, '')",
+                [n[0] for n in notes],
+            )
+            # 新規カード (type = queue = 0)、due は新規カードの出題順
+            conn.executemany(
+                "INSERT INTO cards (id, nid, did, ord, mod, usn, type, queue, due, "
+                "ivl, factor, reps, lapses, left, odue, odid, flags, data) "
+                "VALUES (?, ?, ?, 0, ?, -1, 0, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')",
+                [n[1] for n in notes],
+            )
+            notes.clear()
+            if progress is not None:
+                progress(count)
+
+        for card in cards:
+            guid = guid_for(card)
+            note_id = _hash_int(guid, 11)
+            while note_id in used_ids:
+                note_id += 1
+            used_ids.add(note_id)
+            rendered = render_card(card)
+            sort_field = _sort_field(rendered["front"])
+            csum = _hash_int(sort_field, 8)
+            fields = rendered["front"] + "\x1f" + rendered["back"]
+            note = (note_id, guid, model_id, now, tags_for(card), fields, sort_field, csum)
+            notes.append((note, (note_id, note_id, deck_id, now, count + 1)))
+            count += 1
+            if len(notes) >= INSERT_BATCH:
+                flush()
+        flush()
+        conn.commit()
+        conn.close()
+
+        def write(f):
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as z:
+                z.write(db_file, "collection.anki2")
+                # メディアの一覧 (画像などは使わないので空)
+                z.writestr("media", "{}")
+
+        atomic_write(path, write, mode="wb")
+    finally:
+        os.remove(db_file)
+    return count
+
+
+class ExportJob:
+    """バックグラウンドで実行中・実行済みのエクスポート"""
+
+    def __init__(self, path, total):
+        self.path = path
+        self.total = total
+        self.done = 0
+        self.error = None
+        self.finished = False
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def apkg_path(json_path, snapshot, positions):
+    name = f"deck_{export_key(snapshot, positions)}.apkg"
+    return os.path.join(export_dir(json_path), name)
+
+
+def apkg_job(json_path, snapshot, positions):
+    """この絞り込み結果のエクスポートの状態 (まだ始めていなければ None)"""
+    path = apkg_path(json_path, snapshot, positions)
+    with _jobs_lock:
+        job = _jobs.get(path)
+        if job is not None and job.finished and not os.path.exists(path):
+            # 古いファイルとして削除された
+            del _jobs[path]
+            job = None
+        if job is None and os.path.exists(path):
+            job = ExportJob(path, len(positions))
+            job.done = job.total
+            job.finished = True
+            _jobs[path] = job
+        return job
+
+
+def start_apkg_export(json_path, snapshot, positions, deck_name):
+    """
+    .apkg のエクスポートをバックグラウンドのスレッドで始める
+    (同じ絞り込み結果のエクスポートが実行中・完了済みならそれを返す)
+    """
+    path = apkg_path(json_path, snapshot, positions)
+    positions = array("I", positions)
+    with _jobs_lock:
+        job = _jobs.get(path)
+        if job is not None and job.error is None:
+            return job
+        job = ExportJob(path, len(positions))
+        _jobs[path] = job
+
+    def progress(done):
+        job.done = done
+
+    def run():
+        try:
+            write_apkg(map(snapshot.card, positions), path, deck_name, progress)
+            prune_exports(os.path.dirname(path))
+            job.finished = True
+        except Exception as e:
+            job.error = str(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return job
@@ -0,0 +1,30 @@
+import hashlib
+import re
+
+# カード表面のブロック分割 (内容アドレス方式)
+# generate_rewrite は【ポイント】【解説】【条文】を区切り線でつないで表面を作るため、
+# 同じ条文を引用するカードは同じブロックを持つ。ブロックは正規化したテキストの
+# ハッシュをIDとして一度だけ保存し、カードはIDの列で参照する。
+
+SEPARATOR = "\n\n---\n"
+
+
+def split_blocks(text):
+    """表面テキストをブロックに分割する (join_blocks で元に戻る)"""
+    return text.split(SEPARATOR)
+
+
+def join_blocks(blocks):
+    return SEPARATOR.join(blocks)
+
+
+def normalize_block(text):
+    """改行コードと行末の空白の違いを無視するための正規化"""
+    text = text.replace("\r\n", "\n")
+    return re.sub(r"[ \t]+\n", "\n", text).strip()
+
+
+def block_id(text):
+    """正規化したテキストのハッシュ (ブロックID)"""
+    digest = hashlib.sha1(normalize_block(text).encode("utf-8")).hexdigest()
+    return digest[:20]
@@ -0,0 +1,207 @@
+import gzip
+import hashlib
+import html
+import json
+import os
+import sys
+import zipfile
+
+from card_render import render_card
+from card_snapshot import open_shared_snapshot
+from file_lock import atomic_write
+
+# スマホでオフライン学習するための静的バンドル
+# カードを描画済みの HTML にして SHARD_SIZE 枚ずつ gzip 圧縮した JSON (シャード) に分け、
+# ビューアー (HTML/JS) とサービスワーカーと一緒に1つのフォルダに書き出す。
+# フォルダをそのまま静的ホスティング (GitHub Pages など、python -m http.server でも可)
+# に置けば、一度開いた端末では PC やトンネルがなくても学習できる。
+#
+# フォルダの構成
+#   index.html            ビューアー (絞り込み・めくる・移動・記録はすべて端末内)
+#   sw.js                 サービスワーカー (一度読んだファイルを端末に保存する)
+#   app.webmanifest       ホーム画面に追加するための設定
+#   manifest.json         カード数・シャードの一覧・カードごとの科目と難易度
+#   cards-0000-<hash>.json.gz  シャード (ファイル名に内容のハッシュを含む)
+#
+# シャードのファイル名は内容で決まるので、作り直しても変わっていないシャードは
+# 端末に保存済みのものがそのまま使われる。
+
+# 1シャードのカード枚数
+SHARD_SIZE = 200
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "card_bundle_template"
+)
+
+
+def bundle_dir(json_path):
+    return os.path.splitext(json_path)[0] + "_bundle"
+
+
+def _shard(cards):
+    """シャード1つ分の gzip 圧縮した JSON (同じ内容なら同じバイト列)"""
+    data = json.dumps(cards, ensure_ascii=False, separators=(",", ":"))
+    return gzip.compress(data.encode("utf-8"), mtime=0)
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_bundle(snapshot, out_dir, title, progress=None):
+    """
+    スナップショットのカードをバンドルとして out_dir に書き出す
+    progress(枚数) はシャードを1つ書くごとに呼ばれる
+    戻り値: manifest.json の内容
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    subjects = snapshot.values("subject")
+    levels = snapshot.values("level")
+    subject_ids = {s: i for i, s in enumerate(subjects)}
+    level_ids = {lv: i for i, lv in enumerate(levels)}
+
+    meta = []
+    shards = []
+    total = len(snapshot)
+    for number, start in enumerate(range(0, total, SHARD_SIZE)):
+        cards = []
+        for i in range(start, min(total, start + SHARD_SIZE)):
+            card = snapshot.card(i)
+            rendered = render_card(card)
+            subject = card.get("subject", "不明")
+            level = card.get("level", "-")
+            meta.append([subject_ids[subject], level_ids[level]])
+            cards.append(
+                {
+                    "id": card.get("source") or card.get("back", ""),
+                    "label": f"{subject} / ランク: {level}",
+                    "front": rendered["front"],
+                    "back": rendered["back"],
+                }
+            )
+        data = _shard(cards)
+        name = f"cards-{number:04d}-{hashlib.sha1(data).hexdigest()[:10]}.json.gz"
+        path = os.path.join(out_dir, name)
+        if not os.path.exists(path):
+            atomic_write(path, lambda f: f.write(data), mode="wb")
+        shards.append({"file": name, "count": len(cards)})
+        if progress is not None:
+            progress(start + len(cards))
+
+    version = hashlib.sha1(
+        json.dumps([title, shards, meta], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:12]
+    manifest = {
+        "title": title,
+        "version": version,
+        "key": list(snapshot.key),
+        "count": total,
+        "shard_size": SHARD_SIZE,
+        "shards": shards,
+        "subjects": subjects,
+        "levels": levels,
+        "meta": meta,
+    }
+
+    # ビューアーとサービスワーカー (版が変わると端末のキャッシュを作り直す)
+    for name in ["index.html", "sw.js"]:
+        with open(os.path.join(TEMPLATE_DIR, name), encoding="utf-8") as f:
+            text = f.read()
+        text = text.replace("__VERSION__", version)
+        text = text.replace("__TITLE__", html.escape(title))
+        atomic_write(os.path.join(out_dir, name), lambda f: f.write(text))
+    app_manifest = {
+        "name": title,
+        "short_name": title,
+        "start_url": ".",
+        "display": "standalone",
+        "background_color": "#ffffff",
+        "theme_color": "#4f46e5",
+    }
+    atomic_write(
+        os.path.join(out_dir, "app.webmanifest"),
+        lambda f: json.dump(app_manifest, f, ensure_ascii=False),
+    )
+
+    # manifest.json を最後に書くので、読み込み側が途中の状態を見ることはない
+    atomic_write(
+        os.path.join(out_dir, "manifest.json"),
+        lambda f: json.dump(manifest, f, ensure_ascii=False, separators=(",", ":")),
+    )
+
+    # 使われなくなったシャードを削除する
+    used = {s["file"] for s in shards}
+    for name in os.listdir(out_dir):
+        if name.startswith("cards-") and name not in used:
+            try:
+                os.remove(os.path.join(out_dir, name))
+            except OSError:
+                pass
+    return manifest
+
+
+def build_bundle(json_path, title, snapshot=None, progress=None):
+    """
+    データファイルのバンドルを作る (スナップショットが変わっていなければ作り直さない)
+    戻り値: バンドルのフォルダ
+    """
+    if snapshot is None:
+        snapshot = open_shared_snapshot(json_path)
+    out_dir = bundle_dir(json_path)
+    manifest = read_manifest(out_dir)
+    if manifest is None or manifest.get("key") != list(snapshot.key):
+        write_bundle(snapshot, out_dir, title, progress)
+    return out_dir
+
+
+def cached_bundle(json_path, snapshot):
+    """スナップショットと同じ版のバンドルの zip があればそのパス、なければ None"""
+    out_dir = bundle_dir(json_path)
+    manifest = read_manifest(out_dir)
+    path = out_dir + ".zip"
+    if manifest is None or manifest.get("key") != list(snapshot.key):
+        return None
+    if not os.path.exists(path):
+        return None
+    return path
+
+
+def zip_bundle(out_dir):
+    """バンドルのフォルダを zip にする (端末へのコピー・アップロード用)"""
+    path = out_dir.rstrip(os.sep) + ".zip"
+    manifest = read_manifest(out_dir)
+    if manifest is not None and os.path.exists(path):
+        # zip が同じ版のバンドルなら作り直さない
+        with zipfile.ZipFile(path) as z:
+            try:
+                version = json.loads(z.read("manifest.json"))["version"]
+            except (KeyError, ValueError):
+                version = None
+        if version == manifest["version"]:
+            return path
+
+    def write(f):
+        with zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as z:
+            # シャードは圧縮済みなので zip では圧縮しない
+            for name in sorted(os.listdir(out_dir)):
+                if name.endswith(".tmp"):
+                    continue
+                z.write(os.path.join(out_dir, name), name)
+
+    atomic_write(path, write, mode="wb")
+    return path
+
+
+if __name__ == "__main__":
+    # python card_bundle.py [データファイル] [タイトル]
+    json_path = sys.argv[1] if len(sys.argv) > 1 else "sharousi_data.json"
+    title = sys.argv[2] if len(sys.argv) > 2 else "社労士過去問"
+    out_dir = build_bundle(
+        json_path, title, progress=lambda n: print(f"\r{n} 枚", end="", flush=True)
+    )
+    print(f"\n{out_dir} に書き出しました")
+    print(f"確認: python -m http.server --directory {os.path.abspath(out_dir)}")
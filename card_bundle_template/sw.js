@@ -0,0 +1,83 @@
+// サービスワーカー (card_bundle.py が版を埋め込んで書き出す)
+// ビューアーとカードのシャードを端末に保存し、通信できないときも保存済みのものを返す。
+// シャードはファイル名に内容のハッシュを含むので、保存済みなら通信せずに返す。
+// manifest.json とビューアーは通信できればネットワークの新しいものを使う。
+var VERSION = "__VERSION__";
+var CACHE = "cards-" + VERSION;
+var SHELL = ["./", "index.html", "manifest.json", "app.webmanifest"];
+
+self.addEventListener("install", function (event) {
+    event.waitUntil(
+        caches.open(CACHE).then(function (cache) {
+            return cache.addAll(SHELL);
+        }).then(function () {
+            return self.skipWaiting();
+        })
+    );
+});
+
+self.addEventListener("activate", function (event) {
+    // 古い版のキャッシュから、今の版でも使うシャードを引き継いでから削除する
+    event.waitUntil(
+        caches.keys().then(function (names) {
+            return Promise.all(names.filter(function (name) {
+                return name !== CACHE && name.indexOf("cards-") === 0;
+            }).map(function (name) {
+                return caches.open(name).then(function (old) {
+                    return old.keys().then(function (requests) {
+                        return caches.open(CACHE).then(function (cache) {
+                            return Promise.all(requests.filter(function (request) {
+                                return /\/cards-[^/]+\.json\.gz$/.test(request.url);
+                            }).map(function (request) {
+                                return old.match(request).then(function (response) {
+                                    return cache.put(request, response);
+                                });
+                            }));
+                        });
+                    });
+                }).then(function () {
+                    return caches.delete(name);
+                });
+            }));
+        }).then(function () {
+            return self.clients.claim();
+        })
+    );
+});
+
+self.addEventListener("fetch", function (event) {
+    var request = event.request;
+    if (request.method !== "GET") {
+        return;
+    }
+    if (/\/cards-[^/]+\.json\.gz$/.test(request.url)) {
+        // シャード: 保存済みならそれを返し、なければ取得して保存する
+        event.respondWith(
+            caches.open(CACHE).then(function (cache) {
+                return cache.match(request).then(function (hit) {
+                    return hit || fetch(request).then(function (response) {
+                        if (response.ok) {
+                            cache.put(request, response.clone());
+                        }
+                        return response;
+                    });
+                });
+            })
+        );
+        return;
+    }
+    // それ以外: ネットワークを優先し、通信できなければ保存済みのものを返す
+    event.respondWith(
+        fetch(request).then(function (response) {
+            if (response.ok && new URL(request.url).origin === self.location.origin) {
+                var copy = response.clone();
+                caches.open(CACHE).then(function (cache) {
+                    cache.put(request, copy);
+                });
+            }
+            return response;
+        }).catch(function () {
+            return caches.match(request, { ignoreSearch: true });
+        })
+    );
+});
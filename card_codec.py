@@ -0,0 +1,71 @@
+import zlib
+from collections import Counter
+
+# 共有辞書つきの zlib 圧縮
+# カードのテキストは【解説】【条文】の見出し、:red[...] の記法、法令の決まり文句など
+# カードをまたいで同じ断片が多いため、コーパスから作った辞書 (zlib のプリセット辞書) を
+# 共有すると、1項目ずつ圧縮しても高い圧縮率になる。
+
+# zlib のプリセット辞書は最大 32KB
+DICT_SIZE = 32 * 1024
+
+# 辞書の候補にする断片の長さと間隔 (バイト、日本語1文字 = 3バイト)
+SEGMENT = 24
+STEP = 3
+
+# 辞書の学習に使う量の上限 (メモリを抑えるため)
+#   SAMPLE_BYTES   : 学習に使うテキストの合計 (バイト)
+#   TEXT_BYTES     : 1件のテキストから使う先頭の長さ (バイト)
+#   MAX_CANDIDATES : 数えている断片の種類がこれを超えたら、1件にしか現れていない断片を捨てる
+SAMPLE_BYTES = 2 * 1024 * 1024
+TEXT_BYTES = 4096
+MAX_CANDIDATES = 100_000
+
+
+def train_dictionary(texts, size=DICT_SIZE, sample_limit=2000):
+    """
+    多くのテキストに共通して現れる断片を集めて辞書を作る
+    texts が多い場合は等間隔に sample_limit 件だけ使う
+    使う量は SAMPLE_BYTES・TEXT_BYTES までで、数える断片の種類も MAX_CANDIDATES 程度に抑える
+    """
+    step = max(1, len(texts) // sample_limit)
+    counts = Counter()
+    sampled = 0
+    for text in texts[::step]:
+        data = text.encode("utf-8")[:TEXT_BYTES]
+        counts.update(
+            set(data[i : i + SEGMENT] for i in range(0, len(data) - SEGMENT, STEP))
+        )
+        if len(counts) > MAX_CANDIDATES:
+            # 1件にしか現れていない断片は辞書に選ばれないので捨てる
+            # (それでも多ければ、よく現れるものだけを残す)
+            counts = Counter({k: v for k, v in counts.items() if v >= 2})
+            if len(counts) > MAX_CANDIDATES // 2:
+                counts = Counter(dict(counts.most_common(MAX_CANDIDATES // 2)))
+        sampled += len(data)
+        if sampled >= SAMPLE_BYTES:
+            break
+
+    chosen = []
+    total = 0
+    for segment, doc_count in counts.most_common():
+        if doc_count < 2 or total + SEGMENT > size:
+            break
+        chosen.append(segment)
+        total += SEGMENT
+    # zlib は辞書の末尾ほど短い距離で参照できるので、よく使う断片を後ろに置く
+    return b"".join(reversed(chosen))
+
+
+def compress(text, zdict=b"", level=9):
+    if not zdict:
+        return zlib.compress(text.encode("utf-8"), level)
+    c = zlib.compressobj(level, zdict=zdict)
+    return c.compress(text.encode("utf-8")) + c.flush()
+
+
+def decompress(blob, zdict=b""):
+    if not zdict:
+        return zlib.decompress(blob).decode("utf-8")
+    d = zlib.decompressobj(zdict=zdict)
+    return (d.decompress(blob) + d.flush()).decode("utf-8")
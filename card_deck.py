@@ -0,0 +1,81 @@
+import os
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+from card_render import render_card
+
+# ブラウザ側で動くカードデッキ (カスタムコンポーネント)
+# 1ページ分のカードを HTML にして渡すと、めくる・前後の移動・キーボード・スワイプは
+# ブラウザの中だけで行われる (1枚ごとのサーバー往復がない)。
+# サーバーが再実行されるのは、次のページが必要なときと記録を受け取るときだけ。
+
+# 1ページに入れるカードの枚数
+PAGE_SIZE = 50
+
+# 覚えた / 要復習 の記録をこの件数ためてからサーバーに送る
+RESULT_BATCH = 10
+
+_component = components.declare_component(
+    "card_deck",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "card_deck_frontend"),
+)
+
+
+def deck_card(card, number, pos, label=""):
+    """コンポーネントに渡すカード1枚分 (number は全体の中での通し番号)"""
+    rendered = render_card(card)
+    return {
+        "pos": pos,
+        "number": number,
+        "label": label,
+        "front": rendered["front"],
+        "back": rendered["back"],
+    }
+
+
+def card_deck(load_page, total, token, key="card_deck"):
+    """
+    カードデッキを表示する
+    load_page(start, stop) は通し番号 start〜stop-1 のカード (deck_card の値) のリスト
+    token は表示するカードの並び (絞り込み結果) から決まる文字列
+    戻り値: 記録した結果の辞書 {カードの位置: 覚えたか}
+    """
+    state = st.session_state.setdefault(
+        key, {"token": None, "page": 0, "at": "first", "seq": None, "results": {}}
+    )
+    if state["token"] != token:
+        state.update(token=token, page=0, at="first")
+    pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+    page = min(state["page"], pages - 1)
+
+    start = page * PAGE_SIZE
+    cards = load_page(start, min(total, start + PAGE_SIZE))
+    marks = {
+        str(c["pos"]): state["results"][c["pos"]]
+        for c in cards
+        if c["pos"] in state["results"]
+    }
+    event = _component(
+        cards=cards,
+        page=page,
+        pages=pages,
+        total=total,
+        token=f"{token}:{page}",
+        at=state["at"],
+        batch=RESULT_BATCH,
+        marks=marks,
+        key=key + "_component",
+        default=None,
+    )
+
+    # 前回の再実行で処理した値がそのまま返ってくるので、通し番号で区別する
+    if event and event.get("seq") != state["seq"]:
+        state["seq"] = event["seq"]
+        for pos, correct in event.get("results", {}).items():
+            state["results"][int(pos)] = correct
+        if event.get("page") is not None and event["page"] != page:
+            state["page"] = event["page"]
+            state["at"] = event.get("at", "first")
+            st.rerun()
+    return state["results"]
@@ -0,0 +1,96 @@
+import codecs
+import hashlib
+import os
+import tempfile
+from array import array
+
+from file_lock import atomic_write
+
+# Anki 用 CSV のエクスポート
+# 同じスナップショット (ストアのバージョン) と同じ絞り込み結果の CSV は一度だけ作り、
+# ファイルとして残して使い回す。作成は数百枚ずつ書き出すので、
+# 大きなデッキでも CSV 全体の文字列をメモリ上に作らない。
+
+# 一度に書き出すカードの枚数
+CHUNK_CARDS = 500
+
+# 残しておくエクスポートファイルの数
+KEEP_FILES = 8
+
+
+def export_dir(json_path):
+    """エクスポートファイルを置くフォルダ (書き込めなければ一時フォルダ)"""
+    path = os.path.splitext(json_path)[0] + "_exports"
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        path = os.path.join(tempfile.gettempdir(), "card_exports")
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def csv_line(card):
+    """カード1枚を "Front","Back","Tag" の1行にする (改行は <br>、Anki仕様)"""
+    f_txt = card.get("front", "").replace("\n", "<br>").replace('"', '""')
+    b_txt = card.get("back", "").replace("\n", "<br>").replace('"', '""')
+    tag = f"{card.get('subject', '不明')} {card.get('level', '-')}"
+    return f'"{f_txt}","{b_txt}","{tag}"'
+
+
+def export_key(snapshot, positions, bom=False):
+    """スナップショットと絞り込み結果 (カードの位置と順序) から決まるキー"""
+    h = hashlib.sha1(repr((snapshot.key, bom)).encode("utf-8"))
+    h.update(array("I", positions).tobytes())
+    return h.hexdigest()[:20]
+
+
+def export_path(json_path, snapshot, positions, bom=False):
+    name = f"anki_{export_key(snapshot, positions, bom)}.csv"
+    return os.path.join(export_dir(json_path), name)
+
+
+def cached_csv(json_path, snapshot, positions, bom=False):
+    """作成済みの CSV があればそのパス、なければ None"""
+    path = export_path(json_path, snapshot, positions, bom)
+    return path if os.path.exists(path) else None
+
+
+def write_csv(f, snapshot, positions, bom=False):
+    """CSV を CHUNK_CARDS 枚ずつ書き出す (f はバイナリモード)"""
+    if bom:
+        f.write(codecs.BOM_UTF8)
+    for start in range(0, len(positions), CHUNK_CARDS):
+        chunk = positions[start : start + CHUNK_CARDS]
+        text = "\n".join(csv_line(snapshot.card(i)) for i in chunk)
+        f.write((("\n" if start else "") + text).encode("utf-8"))
+
+
+def build_csv(json_path, snapshot, positions, bom=False):
+    """CSV を作成して (作成済みならそのまま) パスを返す"""
+    path = export_path(json_path, snapshot, positions, bom)
+    if not os.path.exists(path):
+        atomic_write(
+            path, lambda f: write_csv(f, snapshot, positions, bom), mode="wb"
+        )
+        prune_exports(os.path.dirname(path))
+    return path
+
+
+def prune_exports(directory):
+    """古いエクスポートファイルを削除する (種類ごとに新しい KEEP_FILES 個だけ残す)"""
+    files = {}
+    for name in os.listdir(directory):
+        kind = os.path.splitext(name)[1]
+        if kind in (".csv", ".apkg"):
+            path = os.path.join(directory, name)
+            try:
+                files.setdefault(kind, []).append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    for paths in files.values():
+        paths.sort(reverse=True)
+        for _, path in paths[KEEP_FILES:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
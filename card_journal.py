@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+from file_lock import locked
+
+# 追記専用ジャーナル (1行 = 1レコードの JSON Lines)
+# スナップショット (sharousi_data.json) を毎回書き直す代わりに、
+# 新しいカードや修復したカードの差分はジャーナル末尾に追記し、
+# card_store.sync_journal (ストアを開くたびに実行) でまとめてDBへ反映する。
+#
+#   {"op": "add", "card": {...}}                       カードの追加
+#   {"op": "update", "source": url, "fields": {...}}   変更した項目だけの差分
+
+JOURNAL_SUFFIX = ".journal"
+
+
+def journal_path(snapshot_path):
+    """スナップショットに対応するジャーナルファイルのパス"""
+    return snapshot_path + JOURNAL_SUFFIX
+
+
+class JournalWriter:
+    """
+    ジャーナルへの追記を行うクラス
+    fsync は fsync_every 件ごと、または fsync_interval 秒ごとにまとめて行う
+    追記は共有ロック下で行うため、他プロセスの取り込み (排他ロック) と競合しない
+    """
+
+    def __init__(self, snapshot_path, fsync_every=20, fsync_interval=2.0):
+        self.snapshot_path = snapshot_path
+        self.path = journal_path(snapshot_path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, card):
+        """カードを1件追記する (O(1))"""
+        self._write({"op": "add", "card": card})
+
+    def update(self, source, fields):
+        """source のカードで変更した項目だけを差分として追記する"""
+        self._write({"op": "update", "source": source, "fields": fields})
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with locked(self.snapshot_path, exclusive=False):
+            self._f.write(line + "\n")
+            self._f.flush()
+        self._pending += 1
+        if (
+            self._pending >= self.fsync_every
+            or time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        """未同期の追記をディスクへ書き出す"""
+        if self._pending:
+            os.fsync(self._f.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._f.closed:
+            self.sync()
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_journal(snapshot_path):
+    """
+    ジャーナルのレコードを順に返す
+    書き込み途中で途切れた最終行は無視する
+    """
+    path = journal_path(snapshot_path)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def truncate_journal(snapshot_path):
+    """
+    取り込み済みのジャーナルを空にする
+    呼び出し側で排他ロックを取っておくこと
+    """
+    path = journal_path(snapshot_path)
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "w", encoding="utf-8"):
+            pass
@@ -0,0 +1,203 @@
+import html
+import re
+from collections import OrderedDict
+
+# カード本文 (Streamlit の Markdown 記法) を HTML に変換する
+# st.markdown を通さずにブラウザ側で表示するとき (カードデッキのコンポーネント、
+# 事前レンダリング、静的バンドル) に使う。parse_html_text が出力する記法だけを扱う:
+#   :red[...] などの色指定、**太字**、見出し (#)、区切り線 (---)、
+#   箇条書き (- / 1.)、表 (| a | b |)、改行、URL (リンクにする)
+
+COLORS = {
+    "red": "#d32f2f",
+    "green": "#2e7d32",
+    "blue": "#1565c0",
+    "orange": "#ef6c00",
+    "violet": "#6a1b9a",
+    "gray": "#757575",
+    "grey": "#757575",
+}
+
+# 1セッションで描画済みにしておくカードの数 (既定値)
+RENDER_CACHE_SIZE = 32
+
+# 表示中のカードの前後何枚を先に描画しておくか (既定値)
+PREFETCH_RADIUS = 3
+
+_COLOR = re.compile(r":(" + "|".join(COLORS) + r")\[([^\[\]]*)\]")
+_BOLD = re.compile(r"\*\*(.+?)\*\*")
+_HEADING = re.compile(r"(#{1,6})\s+(.*)")
+_LIST = re.compile(r"(?:[-*]|\d+\.)\s+(.*)")
+_RULE = re.compile(r"-{3,}|\*{3,}")
+_URL = re.compile(r"https?://[^\s\[\]<>\"]+")
+_TABLE_SEP = re.compile(r"\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?")
+
+
+def render_inline(text):
+    """1行分の記法 (色指定・太字) を HTML にする"""
+    text = html.escape(text, quote=False)
+    text = _URL.sub(r'<a href="\g<0>" target="_blank" rel="noopener">\g<0></a>', text)
+    # 入れ子の色指定は内側から置き換える
+    while True:
+        replaced = _COLOR.sub(
+            lambda m: f'<span style="color:{COLORS[m.group(1)]}">{m.group(2)}</span>',
+            text,
+        )
+        if replaced == text:
+            break
+        text = replaced
+    return _BOLD.sub(r"<strong>\1</strong>", text)
+
+
+def _cells(line):
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [c.strip() for c in line.split("|")]
+
+
+def _table(lines):
+    rows = [l for l in lines if not _TABLE_SEP.fullmatch(l.strip())]
+    has_header = len(lines) > 1 and _TABLE_SEP.fullmatch(lines[1].strip())
+    out = ["<table>"]
+    for n, line in enumerate(rows):
+        tag = "th" if has_header and n == 0 else "td"
+        cells = "".join(f"<{tag}>{render_inline(c)}</{tag}>" for c in _cells(line))
+        out.append(f"<tr>{cells}</tr>")
+    out.append("</table>")
+    return "".join(out)
+
+
+def render_markdown(text):
+    """カード本文を HTML にする"""
+    blocks = []
+    paragraph = []
+    items = []
+    table = []
+
+    def flush():
+        if paragraph:
+            blocks.append("<p>" + "<br>".join(paragraph) + "</p>")
+            paragraph.clear()
+        if items:
+            blocks.append("<ul>" + "".join(f"<li>{i}</li>" for i in items) + "</ul>")
+            items.clear()
+        if table:
+            blocks.append(_table(table))
+            table.clear()
+
+    for line in (text or "").replace("\r\n", "\n").split("\n"):
+        stripped = line.strip()
+        if stripped.startswith("|"):
+            if not table:
+                flush()
+            table.append(stripped)
+            continue
+        if table:
+            flush()
+        if not stripped:
+            flush()
+        elif _RULE.fullmatch(stripped):
+            flush()
+            blocks.append("<hr>")
+        elif _HEADING.fullmatch(stripped):
+            flush()
+            m = _HEADING.fullmatch(stripped)
+            level = len(m.group(1))
+            blocks.append(f"<h{level}>{render_inline(m.group(2))}</h{level}>")
+        elif _LIST.fullmatch(stripped):
+            if paragraph:
+                flush()
+            items.append(render_inline(_LIST.fullmatch(stripped).group(1)))
+        else:
+            if items:
+                flush()
+            paragraph.append(render_inline(stripped))
+    flush()
+    return "\n".join(blocks)
+
+
+def render_card(card):
+    """カードの表面・裏面を HTML にしたもの"""
+    return {
+        "front": render_markdown(card.get("front", "")),
+        "back": render_markdown(card.get("back", "")),
+    }
+
+
+class RenderCache:
+    """
+    描画済みのカードの LRU (セッションごとに1つ持つ)
+    キーはスナップショットのキーとカードの位置なので、データが更新されると
+    古い描画結果は使われず、そのうち押し出される
+    """
+
+    def __init__(self, size=RENDER_CACHE_SIZE, radius=PREFETCH_RADIUS):
+        self.size = size
+        self.radius = radius
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _render(self, snapshot, pos):
+        card = snapshot.card(pos)
+        value = render_card(card)
+        # 裏面 (ソースURL) はボタンやコード表示にそのまま使う
+        value["source"] = card.get("back", "")
+        self._items[(snapshot.key, pos)] = value
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+        return value
+
+    def get(self, snapshot, pos):
+        """カードの描画結果 (front・back の HTML と source)"""
+        key = (snapshot.key, pos)
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            return self._render(snapshot, pos)
+        self.hits += 1
+        self._items.move_to_end(key)
+        return value
+
+    def prefetch(self, snapshot, positions, index):
+        """
+        positions[index] の前後 radius 枚を描画しておく
+        表示し終わってから呼ぶと、次の「前へ」「次へ」では描画済みの結果を出すだけで済む
+        """
+        # キャッシュに入りきる範囲だけ先読みする
+        radius = min(self.radius, (self.size - 1) // 2)
+        # 近いカードほど後に触れて、押し出されにくくする
+        for offset in range(radius, 0, -1):
+            for i in (index + offset, index - offset):
+                if 0 <= i < len(positions):
+                    key = (snapshot.key, positions[i])
+                    if key in self._items:
+                        self._items.move_to_end(key)
+                    else:
+                        self._render(snapshot, positions[i])
+        if 0 <= index < len(positions):
+            key = (snapshot.key, positions[index])
+            if key in self._items:
+                self._items.move_to_end(key)
+
+    def resize(self, size, radius=None):
+        self.size = size
+        if radius is not None:
+            self.radius = radius
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def stats(self):
+        """表示用の状態 (件数・上限・ヒット数・ミス数)"""
+        return {
+            "count": len(self._items),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
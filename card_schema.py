@@ -0,0 +1,89 @@
+import re
+from urllib.parse import urlparse
+
+from card_blocks import split_blocks
+
+# カードレコードのスキーマ (バージョン付き)
+#
+# バージョン1 (schema キーなし): アプリごとに形の違う自由形式の dict
+#   scraper_sharousi_app.py : front / back / source / subject / level
+#   scraper_ap_siken_app.py : front / back / source / title / period
+#   app.py                  : front / back
+#
+# バージョン2:
+#   schema  : 2
+#   kind    : "sharousi" / "ap_siken" / "basic"
+#   front, back (必須、文字列)
+#   source, subject, level, period, title (ある場合のみ、前後の空白を除いた文字列)
+#   q_id    : 社労士の解説 API の問題ID (取得できたカードのみ、文字列)
+#   question: 社労士の問題文 (問題ページを取得したカードのみ)
+#   kaisetu_html, joubun_html, point_html: 社労士の解説 API の要素の HTML (修復で使う)
+#
+# question と解説 API の HTML は修復・再解析だけで使うので、ストアにだけ保存する
+# (JSON・バイナリスナップショットには書き出さない)。
+#
+# 古いレコードは upgrade() で1段ずつ最新版に変換する。
+
+SCHEMA_VERSION = 2
+
+TEXT_KEYS = ["source", "subject", "level", "period", "title"]
+
+# ストアにだけ保存する項目
+STORE_ONLY_KEYS = ["question", "kaisetu_html", "joubun_html", "point_html"]
+
+KIND_BY_HOST = {
+    "sharousi-kakomon.com": "sharousi",
+    "www.ap-siken.com": "ap_siken",
+}
+
+
+def schema_of(card):
+    return card.get("schema", 1)
+
+
+def _v1_to_v2(card):
+    card = dict(card)
+    card["front"] = str(card.get("front") or "")
+    card["back"] = str(card.get("back") or "")
+    for key in TEXT_KEYS:
+        if key in card:
+            if card[key] is None:
+                del card[key]
+            else:
+                card[key] = str(card[key]).strip()
+    host = urlparse(card.get("source", "")).netloc
+    card["kind"] = KIND_BY_HOST.get(host, "basic")
+    card["schema"] = 2
+    return card
+
+
+# バージョン n のレコードを n+1 に変換する関数
+MIGRATIONS = {
+    1: _v1_to_v2,
+}
+
+
+def upgrade(card):
+    """レコードを最新のスキーマに変換する (最新ならそのまま返す)"""
+    version = schema_of(card)
+    while version < SCHEMA_VERSION:
+        card = MIGRATIONS[version](card)
+        version = schema_of(card)
+    return card
+
+
+def card_sections(card):
+    """
+    表面を【見出し】ごとの dict に分解する
+    例: {"ポイント": "...", "解説": "...", "条文": "..."}
+    見出しのないブロックは "本文" として扱う
+    """
+    sections = {}
+    for block in split_blocks(card.get("front", "")):
+        m = re.match(r"\s*【([^】]+)】\n?", block)
+        if m:
+            sections[m.group(1)] = block[m.end() :]
+        else:
+            sections.setdefault("本文", block)
+    return sections
+
@@ -0,0 +1,324 @@
+import json
+import math
+import operator
+import os
+import re
+import struct
+import threading
+import unicodedata
+import zlib
+from array import array
+from collections import Counter
+
+from file_lock import atomic_write, locked
+
+# カード本文の全文検索 (文字 bigram の転置インデックス)
+#
+# 表面・裏面のテキストを正規化 (NFKC・小文字化・URL除去) し、連続する2文字ごとに
+# そのカードの位置 (バイナリスナップショット内の位置) と出現回数を記録する。
+# 日本語は単語の区切りがないため、形態素解析の代わりに2文字単位で引く。
+#
+# 検索索引ファイル (*.search)
+#   ヘッダー   : magic, version, 表の長さ
+#   表         : 索引済みのカード数・書き換えられたカード・bigram ごとの位置と件数
+#                (zlib圧縮JSON)
+#   位置の列   : bigram ごとの (カード位置 << 8 | 出現回数) (u32、回数は 255 まで)
+#
+# カードは登録順に並ぶので、クローラーが追加したカードは末尾に足すだけで済む。
+# 修復などで書き換えられたカードは新しい bigram を追加して stale に記録し、
+# 古い bigram による誤ヒットは検索時の本文照合で取り除く。
+# 検索では出現回数から見積もった関連度の高い候補から本文と照合して順位を付ける。
+
+MAGIC = b"CSRC"
+VERSION = 2
+HEADER = struct.Struct("<4sHI")
+
+# 位置の列の1件に入れる出現回数のビット数
+TF_BITS = 8
+TF_MAX = (1 << TF_BITS) - 1
+
+# 検索時に本文の出現回数で順位を付け直す候補の数
+VERIFY_LIMIT = 200
+
+# 書き換えられたカードがこの割合を超えたら作り直す
+STALE_RATIO = 0.25
+
+_URL = re.compile(r"https?://\S+")
+
+
+def search_path(json_path):
+    return os.path.splitext(json_path)[0] + ".search"
+
+
+def normalize(text):
+    """全角・半角や大文字・小文字の違いを無視するための正規化"""
+    return unicodedata.normalize("NFKC", _URL.sub(" ", text)).lower()
+
+
+def bigrams(text):
+    """正規化したテキストの2文字の組 (空白を含む組は除く)"""
+    return set(bigram_counts(text))
+
+
+def bigram_counts(text):
+    """正規化したテキストの2文字の組ごとの出現回数"""
+    counts = Counter()
+    for run in normalize(text).split():
+        counts.update(map(operator.add, run, run[1:]))
+    return counts
+
+
+def document_text(snapshot, i):
+    """索引を作る対象のテキスト (表面と裏面)"""
+    return snapshot.text(i, "front") + "\n" + snapshot.text(i, "back")
+
+
+class SearchIndex:
+    """
+    bigram → カード位置の転置インデックス
+    読み込んだ索引 (_blob) はそのまま持ち、追加分だけ _extra に array('I') で持つ
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.stale = set()
+        self.meta = {}
+        self._table = {}
+        self._blob = b""
+        self._extra = {}
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, table_len = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"対応していない検索索引です: {path}")
+        pos = HEADER.size
+        table = json.loads(zlib.decompress(data[pos : pos + table_len]))
+        index.count = table["count"]
+        index.stale = set(table["stale"])
+        index.meta = table["meta"]
+        index._table = {g: (offset, n) for g, offset, n in table["grams"]}
+        index._blob = data[pos + table_len :]
+        return index
+
+    def postings(self, gram):
+        """bigram を含むカードの (位置 << 8 | 出現回数) の列 (重複を含むことがある)"""
+        result = array("I")
+        if gram in self._table:
+            offset, n = self._table[gram]
+            result.frombytes(self._blob[offset * 4 : (offset + n) * 4])
+        if gram in self._extra:
+            result.extend(self._extra[gram])
+        return result
+
+    def frequencies(self, gram):
+        """bigram を含むカードの位置 -> 出現回数 (書き換えられたカードは新しい方)"""
+        return {v >> TF_BITS: v & TF_MAX for v in self.postings(gram)}
+
+    def grams(self):
+        return set(self._table) | set(self._extra)
+
+    def add(self, pos, text):
+        extra = self._extra
+        for gram, n in bigram_counts(text).items():
+            value = pos << TF_BITS | min(n, TF_MAX)
+            try:
+                extra[gram].append(value)
+            except KeyError:
+                extra[gram] = array("I", [value])
+        self.count = max(self.count, pos + 1)
+
+    def replace(self, pos, text):
+        """書き換えられたカードの新しい本文を登録する"""
+        self.add(pos, text)
+        self.stale.add(pos)
+
+    def needs_rebuild(self):
+        return len(self.stale) > max(100, self.count * STALE_RATIO)
+
+    def save(self, path):
+        grams = []
+        chunks = []
+        offset = 0
+        for gram in sorted(self.grams()):
+            positions = self.postings(gram)
+            grams.append([gram, offset, len(positions)])
+            chunks.append(positions.tobytes())
+            offset += len(positions)
+        table = zlib.compress(
+            json.dumps(
+                {
+                    "count": self.count,
+                    "stale": sorted(self.stale),
+                    "meta": self.meta,
+                    "grams": grams,
+                },
+                ensure_ascii=False,
+            ).encode("utf-8")
+        )
+
+        def write(f):
+            f.write(HEADER.pack(MAGIC, VERSION, len(table)))
+            f.write(table)
+            f.writelines(chunks)
+
+        atomic_write(path, write, mode="wb")
+
+    def _candidates(self, term):
+        """
+        語のすべての bigram を含むカードの位置 -> 語の出現回数の見積もり
+        (bigram の出現回数の最小値。1文字の語はその文字を含む bigram の回数の合計)
+        """
+        grams = bigrams(term)
+        if not grams:
+            ch = normalize(term).strip()
+            if not ch:
+                return None
+            result = Counter()
+            for gram in self.grams():
+                if ch in gram:
+                    result.update(self.frequencies(gram))
+            return result
+        lists = sorted((self.frequencies(g) for g in grams), key=len)
+        result = lists[0]
+        for counts in lists[1:]:
+            if not result:
+                break
+            result = {p: min(n, counts[p]) for p, n in result.items() if p in counts}
+        return result
+
+    def search(self, query, snapshot, positions=None, limit=50):
+        """
+        query (空白区切りの語) を含むカードの位置を関連度の高い順に返す
+        多くの語を含み、珍しい語をよく含むカードほど上位になる
+        positions を渡すとその中 (絞り込み結果) だけを検索する
+        戻り値: (位置のリスト, 語を含むカードの数)
+        """
+        terms = [normalize(t) for t in query.split()]
+        scores = {}
+        matched = {}
+        total = max(1, self.count)
+        allowed = set(positions) if positions is not None else None
+        for term in terms:
+            candidates = self._candidates(term)
+            if not candidates:
+                continue
+            if allowed is not None:
+                candidates = {p: n for p, n in candidates.items() if p in allowed}
+            idf = math.log(1 + total / max(1, len(candidates)))
+            # bigram が1つ以下の語は、索引に載っていれば本文にも必ず含まれる
+            exact = len(bigrams(term)) <= 1
+            for pos, tf in candidates.items():
+                scores[pos] = scores.get(pos, 0.0) + idf * (1 + math.log(tf))
+                matched.setdefault(pos, []).append((term, idf, exact))
+
+        # 見積もった関連度の高い順に本文と照合し、上位は本文の出現回数で順位を付け直す
+        # それ以外の候補も、索引だけでは含むと言い切れないもの (書き換えられたカード、
+        # 3文字以上の語) は本文で確かめてから件数に数える
+        ranked = sorted(scores, key=lambda p: (-scores[p], p))
+        results = []
+        hits = 0
+        for rank, pos in enumerate(ranked):
+            if pos >= len(snapshot):
+                continue
+            terms_of = matched[pos]
+            if rank >= VERIFY_LIMIT and pos not in self.stale:
+                if all(exact for _, _, exact in terms_of):
+                    hits += 1
+                    continue
+            text = normalize(document_text(snapshot, pos))
+            score = 0.0
+            for term, idf, _ in terms_of:
+                tf = text.count(term)
+                if tf:
+                    score += idf * (1 + math.log(tf))
+            if score:
+                hits += 1
+                if rank < VERIFY_LIMIT:
+                    results.append((score, pos))
+        results.sort(key=lambda r: (-r[0], r[1]))
+        return [pos for _, pos in results[:limit]], hits
+
+
+def update_from_snapshot(index, snapshot):
+    """スナップショットの末尾に追加されたカードを索引に加える"""
+    for i in range(index.count, len(snapshot)):
+        index.add(i, document_text(snapshot, i))
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def open_search_index(json_path, snapshot, changes=None, meta=None):
+    """
+    スナップショットに対応する検索索引を開く (プロセス内で共有する)
+    追加されたカードだけを索引に加えて保存する
+    changes(meta) は書き換えられたカードの位置のリストを返す関数 (ストアがある場合)
+    None を返したときは作り直す。meta は保存時に索引に記録する値 (記録済みの値に上書きする)
+    """
+    path = search_path(json_path)
+    with _shared_lock:
+        key = _file_key(path)
+        entry = _shared.get(path)
+        index = entry[1] if entry is not None and entry[0] == key else None
+        if index is None and key is not None:
+            try:
+                index = SearchIndex.load(path)
+            except (OSError, ValueError, struct.error):
+                index = None
+        if index is None:
+            index = SearchIndex()
+
+        changed = []
+        if changes is not None and index.count:
+            changed = changes(index.meta)
+        if changed is None or index.count > len(snapshot) or index.needs_rebuild():
+            index = SearchIndex()
+            changed = []
+
+        modified = False
+        for pos in changed:
+            if pos < index.count:
+                index.replace(pos, document_text(snapshot, pos))
+                modified = True
+        if index.count < len(snapshot):
+            update_from_snapshot(index, snapshot)
+            modified = True
+        if meta is not None and any(index.meta.get(k) != v for k, v in meta.items()):
+            index.meta = dict(index.meta, **meta)
+            modified = True
+
+        if modified:
+            try:
+                with locked(json_path):
+                    index.save(path)
+            except OSError:
+                # 読み取り専用の環境 (Streamlit Cloud など) ではメモリ上の索引だけ使う
+                pass
+        _shared[path] = (_file_key(path), index)
+        return index
+
+
+def open_snapshot_search_index(json_path, snapshot):
+    """
+    ストアを使わない場合 (ビューアー) の検索索引
+    索引に記録したスナップショットの key と違えば (古い JSON から作った索引なら) 作り直す
+    """
+    key = list(snapshot.key)
+
+    def changes(meta):
+        return [] if meta.get("snapshot") == key else None
+
+    return open_search_index(json_path, snapshot, changes, {"snapshot": key})
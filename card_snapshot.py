@@ -0,0 +1,541 @@
+import glob
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from array import array
+from collections import Counter
+
+from card_blocks import block_id, join_blocks, split_blocks
+from card_codec import SAMPLE_BYTES, compress, decompress, train_dictionary
+from card_schema import STORE_ONLY_KEYS
+from file_lock import atomic_write
+from json_stream import iter_json_array
+
+# ビューアー向けのコンパクトなバイナリスナップショット (*.cards)
+#
+#   ヘッダー    : magic, version, カード数, ストアのバージョン, 文字列表の長さ,
+#                 辞書の長さ, ブロック数, ブロック参照数
+#   文字列表    : 科目・難易度・年度ごとの文字列リスト (zlib圧縮JSON)
+#   辞書        : テキスト領域の圧縮に使う共有辞書 (card_codec.train_dictionary)
+#                 一度学習した辞書は <名前>.zdict に保存し、次からの書き出しで使い回す
+#   インデックス : カードごとの固定長レコード
+#                 (カードID, 科目コード, 難易度コード, 年度コード,
+#                  表面のブロック参照の開始位置と個数,
+#                  裏面・その他の項目それぞれのテキスト領域内の位置と長さ)
+#   ブロック表  : 表面のブロックごとのテキスト領域内の位置と長さ
+#   ブロック参照: カードの表面を構成するブロック番号の列 (u32)
+#   テキスト領域: 項目・ブロックごとに共有辞書つきで zlib 圧縮したテキスト
+#
+# 書き出しのたびに世代番号つきの別ファイル (<名前>.<世代>.cards) に書き、読み込み側は
+# 最新の世代を mmap で開く。開いているファイルを置き換えないので Windows でも書き出せる。
+# 古い世代は書き出しのたびに削除を試み、どのセッションも開いていなければ削除される
+# (Windows では開いている間は削除できないので、次の書き出しで再び試す)。
+# 世代番号のない <名前>.cards (配置用に置いたもの) も、世代つきのものがなければ読む。
+# ビューアーは mmap で開き、絞り込みはインデックスのコード列だけで行う。
+# テキストは表示するカードの表面・裏面だけを必要になった時点で切り出して展開する。
+# 表面は同じ内容のブロック (条文など) を一度だけ保存し、表示時に組み立てる。
+# Streamlit のセッション (再実行) ごとに開き直さないよう、shared_snapshot で
+# プロセス内の全セッションが1つの読み取り専用オブジェクトを共有する。
+
+MAGIC = b"CSNP"
+VERSION = 4
+HEADER = struct.Struct("<4sHIQIIII")
+RECORD = struct.Struct("<IBBBxIHxxQIQI")
+SPAN = struct.Struct("<QI")
+
+# インデックスに持つ列 (それぞれ 255 種類まで)
+META_COLUMNS = ["subject", "level", "period"]
+META_OFFSETS = {"subject": 4, "level": 5, "period": 6}
+
+# テキストとして持つ項目 (その他のキーは extra に JSON でまとめる)
+TEXT_FIELDS = ["front", "back"]
+
+UNKNOWN = "不明"
+
+# 絞り込み結果を覚えておく条件の数 (スナップショットごと)
+FILTER_CACHE_SIZE = 32
+
+
+def snapshot_path(json_path):
+    """JSONスナップショットに対応するバイナリスナップショットのパス"""
+    return os.path.splitext(json_path)[0] + ".cards"
+
+
+def versioned_path(path, generation):
+    """世代つきのスナップショットのパス (例: data.cards -> data.3.cards)"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{generation}{ext}"
+
+
+def snapshot_files(path):
+    """
+    path のスナップショットのファイルを (世代, パス) の古い順のリストで返す
+    世代番号のない path 自体は世代 0 として扱う
+    """
+    root, ext = os.path.splitext(path)
+    files = [(0, path)] if os.path.exists(path) else []
+    prefix = root + "."
+    for name in glob.glob(glob.escape(prefix) + "*" + glob.escape(ext)):
+        generation = name[len(prefix) : len(name) - len(ext)]
+        if generation.isdigit():
+            files.append((int(generation), name))
+    return sorted(files)
+
+
+def latest_snapshot(path):
+    """最新の世代のスナップショットのファイル (なければ None)"""
+    files = snapshot_files(path)
+    return files[-1][1] if files else None
+
+
+def _remove_old_snapshots(path, keep):
+    """keep より古い世代を削除する (開かれていて削除できないものは次の機会に回す)"""
+    for _, name in snapshot_files(path):
+        if name == keep:
+            break
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+def dictionary_path(path):
+    """スナップショットの共有辞書を保存しておくファイル"""
+    return os.path.splitext(path)[0] + ".zdict"
+
+
+def read_dictionary(path):
+    """保存してある共有辞書 (なければ None)"""
+    try:
+        with open(dictionary_path(path), "rb") as f:
+            return f.read() or None
+    except OSError:
+        return None
+
+
+class _TextHeap:
+    """
+    テキスト領域を一時ファイルへ書きながら作る
+    共有辞書がまだなければ、SAMPLE_BYTES までのテキストを溜めて辞書を学習してから圧縮する
+    (全テキストをメモリに載せない)
+    """
+
+    def __init__(self, f, zdict):
+        self.f = f
+        self.zdict = zdict
+        self.spans = []
+        self.pending = []
+        self.pending_bytes = 0
+        self.offset = 0
+
+    def add(self, text):
+        """テキストを追加し、その番号を返す"""
+        n = len(self.spans) + len(self.pending)
+        if self.zdict is None:
+            self.pending.append(text)
+            self.pending_bytes += len(text.encode("utf-8"))
+            if self.pending_bytes >= SAMPLE_BYTES:
+                self.flush()
+        else:
+            self._write(text)
+        return n
+
+    def flush(self):
+        if self.zdict is None:
+            self.zdict = train_dictionary(self.pending)
+        for text in self.pending:
+            self._write(text)
+        self.pending = []
+
+    def _write(self, text):
+        blob = compress(text, self.zdict)
+        self.f.write(blob)
+        self.spans.append((self.offset, len(blob)))
+        self.offset += len(blob)
+
+
+def write_snapshot(cards, path, store_version=0, retrain=False):
+    """
+    カード一覧をバイナリスナップショットとして書き出す (新しい世代のファイルに書く)
+    cards は1件ずつ読み込むイテレーターでよい (テキストは圧縮して一時ファイルに書く)
+    retrain=True の場合は保存してある共有辞書を使わずに学習し直す
+    戻り値: 書き出したファイルのパス
+    """
+    strings = {c: [] for c in META_COLUMNS}
+    string_ids = {c: {} for c in META_COLUMNS}
+
+    def intern(column, value):
+        ids = string_ids[column]
+        if value not in ids:
+            if len(ids) >= 255:
+                raise ValueError(f"{column} の種類が多すぎます")
+            ids[value] = len(strings[column])
+            strings[column].append(value)
+        return ids[value]
+
+    directory = os.path.dirname(os.path.abspath(path))
+    zdict = None if retrain else read_dictionary(path)
+    with tempfile.TemporaryFile(dir=directory) as heap_file:
+        # 1. テキストを圧縮してテキスト領域に書く (表面のブロックは重複を除く)
+        heap = _TextHeap(heap_file, zdict)
+        block_ids = {}
+        block_texts = []
+        refs = array("I")
+        rows = []
+        for card_id, card in enumerate(cards):
+            codes = [intern(c, card.get(c, UNKNOWN)) for c in META_COLUMNS]
+            # 修復用の項目 (古い JSON から作る場合) はビューアーでは使わないので除く
+            extra = {
+                k: v
+                for k, v in card.items()
+                if k not in META_COLUMNS + TEXT_FIELDS and k not in STORE_ONLY_KEYS
+            }
+
+            refs_start = len(refs)
+            blocks = split_blocks(card.get("front", ""))
+            for block in blocks:
+                key = block_id(block)
+                if key not in block_ids:
+                    block_ids[key] = len(block_texts)
+                    block_texts.append(heap.add(block))
+                refs.append(block_ids[key])
+
+            back_n = heap.add(card.get("back", ""))
+            heap.add(json.dumps(extra, ensure_ascii=False))
+            rows.append((card_id, codes, refs_start, len(blocks), back_n))
+        heap.flush()
+        spans = heap.spans
+        zdict = heap.zdict
+
+        block_spans = [SPAN.pack(*spans[n]) for n in block_texts]
+        records = []
+        for card_id, codes, refs_start, block_count, back_n in rows:
+            records.append(
+                RECORD.pack(
+                    card_id,
+                    *codes,
+                    refs_start,
+                    block_count,
+                    *spans[back_n],
+                    *spans[back_n + 1],
+                )
+            )
+
+        strtab = zlib.compress(
+            json.dumps(strings, ensure_ascii=False).encode("utf-8")
+        )
+
+        def write(f):
+            f.write(
+                HEADER.pack(
+                    MAGIC,
+                    VERSION,
+                    len(records),
+                    store_version,
+                    len(strtab),
+                    len(zdict),
+                    len(block_spans),
+                    len(refs),
+                )
+            )
+            f.write(strtab)
+            f.write(zdict)
+            f.writelines(records)
+            f.writelines(block_spans)
+            f.write(refs.tobytes())
+            heap_file.seek(0)
+            shutil.copyfileobj(heap_file, f)
+
+        files = snapshot_files(path)
+        generation = files[-1][0] + 1 if files else 1
+        target = versioned_path(path, generation)
+        while os.path.exists(target):
+            generation += 1
+            target = versioned_path(path, generation)
+        atomic_write(target, write, mode="wb")
+
+    # 学習した辞書は次の書き出しでも使う
+    if zdict and zdict != read_dictionary(path):
+        atomic_write(dictionary_path(path), lambda f: f.write(zdict), mode="wb")
+    _remove_old_snapshots(path, target)
+    return target
+
+
+def read_store_version(path):
+    """最新のスナップショットを作成した時点のストアのバージョン (読めなければ None)"""
+    latest = latest_snapshot(path)
+    if latest is None:
+        return None
+    try:
+        with open(latest, "rb") as f:
+            magic, version, _, store_version, *_ = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC or version != VERSION:
+        return None
+    return store_version
+
+
+class CardSnapshot:
+    """
+    バイナリスナップショットを mmap で開いたもの
+    カードごとの Python オブジェクトは作らず、インデックスとテキストは mmap から直接読む
+    path には最新の世代を開くスナップショットのパスか、世代つきのファイルを渡す
+    """
+
+    def __init__(self, path):
+        self.path = latest_snapshot(path) or path
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            # このスナップショットを識別する値 (新しい世代が書き出されると変わる)
+            self.key = (st.st_mtime_ns, st.st_size, st.st_ino)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            version,
+            count,
+            store_version,
+            strtab_len,
+            dict_len,
+            block_count,
+            ref_count,
+        ) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"対応していないスナップショットです: {path}")
+        self.count = count
+        self.store_version = store_version
+
+        pos = HEADER.size
+        self.strings = json.loads(zlib.decompress(self._mm[pos : pos + strtab_len]))
+        pos += strtab_len
+        self._zdict = self._mm[pos : pos + dict_len]
+        self._index_base = pos + dict_len
+        self._blocks_base = self._index_base + RECORD.size * count
+        self._refs_base = self._blocks_base + SPAN.size * block_count
+        self._heap_base = self._refs_base + 4 * ref_count
+        self._index = memoryview(self._mm)[self._index_base : self._blocks_base]
+        self._facets = None
+        self._bitmap_cache = {}
+        self._filter_cache = {}
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        return RECORD.unpack_from(self._mm, self._index_base + RECORD.size * i)
+
+    def _column(self, column):
+        """列のコードを1カード1バイトの bytes として取り出す"""
+        return bytes(self._index[META_OFFSETS[column] :: RECORD.size])
+
+    def _text(self, offset, length):
+        start = self._heap_base + offset
+        return decompress(self._mm[start : start + length], self._zdict)
+
+    def meta(self, i):
+        """i 番目のカードの (科目, 難易度, 年度)"""
+        rec = self._record(i)
+        return tuple(
+            self.strings[c][code] for c, code in zip(META_COLUMNS, rec[1:4])
+        )
+
+    def _front(self, rec):
+        """ブロック参照から表面を組み立てる"""
+        refs_start, refs_count = rec[4], rec[5]
+        blocks = []
+        for n in range(refs_count):
+            (block,) = struct.unpack_from(
+                "<I", self._mm, self._refs_base + 4 * (refs_start + n)
+            )
+            offset, length = SPAN.unpack_from(
+                self._mm, self._blocks_base + SPAN.size * block
+            )
+            blocks.append(self._text(offset, length))
+        return join_blocks(blocks)
+
+    def text(self, i, field):
+        """i 番目のカードの表面 (front) または裏面 (back) だけを展開する"""
+        rec = self._record(i)
+        if field == "front":
+            return self._front(rec)
+        return self._text(rec[6], rec[7])
+
+    def card(self, i):
+        """i 番目のカードをすべて展開して dict で返す"""
+        rec = self._record(i)
+        card = json.loads(self._text(rec[8], rec[9]))
+        for column, code in zip(META_COLUMNS, rec[1:4]):
+            card[column] = self.strings[column][code]
+        card["front"] = self._front(rec)
+        card["back"] = self._text(rec[6], rec[7])
+        return card
+
+    def _facet_table(self):
+        """
+        (科目, 難易度, 年度) のコードの組み合わせごとの件数
+        スナップショットは書き換えないので、最初に1回だけ数えて以後は使い回す
+        """
+        if self._facets is None:
+            self._facets = Counter(zip(*(self._column(c) for c in META_COLUMNS)))
+        return self._facets
+
+    def facet_counts(self, column, subjects=None, levels=None, periods=None):
+        """
+        列の値ごとの件数 (他の列の条件で絞り込んだ上での件数)
+        カード数ではなく組み合わせの数に比例する時間で返す
+        """
+        n = META_COLUMNS.index(column)
+        conditions = [
+            (k, set(values))
+            for k, values in enumerate([subjects, levels, periods])
+            if values is not None
+        ]
+        counts = {}
+        for codes, count in self._facet_table().items():
+            if all(
+                self.strings[META_COLUMNS[k]][codes[k]] in values
+                for k, values in conditions
+            ):
+                value = self.strings[column][codes[n]]
+                counts[value] = counts.get(value, 0) + count
+        return dict(sorted(counts.items()))
+
+    def cross_counts(self, row_column, col_column):
+        """2つの列のクロス集計 {行の値: {列の値: 件数}}"""
+        r = META_COLUMNS.index(row_column)
+        c = META_COLUMNS.index(col_column)
+        table = {}
+        for codes, count in self._facet_table().items():
+            row = table.setdefault(self.strings[row_column][codes[r]], {})
+            value = self.strings[col_column][codes[c]]
+            row[value] = row.get(value, 0) + count
+        return {k: dict(sorted(v.items())) for k, v in sorted(table.items())}
+
+    def count_by(self, column):
+        """列の値ごとの件数"""
+        return self.facet_counts(column)
+
+    def values(self, column):
+        return list(self.count_by(column).keys())
+
+    def _bitmaps(self, column):
+        """
+        列の値ごとのビットマップ {コード: int}
+        カード1枚を1バイト (0 または 1) で表した列を int にしたもので、
+        複数の値の OR・列どうしの AND を int の演算1回で行える
+        スナップショットは書き換えないので、列ごとに最初に1回だけ作る
+        """
+        bitmaps = self._bitmap_cache.get(column)
+        if bitmaps is None:
+            col = self._column(column)
+            bitmaps = {}
+            for code in range(len(self.strings[column])):
+                table = bytearray(256)
+                table[code] = 1
+                bitmaps[code] = int.from_bytes(col.translate(table), "little")
+            self._bitmap_cache[column] = bitmaps
+        return bitmaps
+
+    def _mask(self, column, values):
+        """列の値が values に含まれるカードのビットマップ (OR)"""
+        mask = 0
+        for code, bitmap in self._bitmaps(column).items():
+            if self.strings[column][code] in values:
+                mask |= bitmap
+        return mask
+
+    def filter(self, subjects=None, levels=None, periods=None):
+        """
+        条件に一致するカードの位置 (None の条件は絞り込まない)
+        列ごとに値のビットマップの OR を取り、列どうしは AND で組み合わせる
+        結果は array('I') で返すので、絞り込み後の k 番目のカードは O(1) で引ける
+        同じ条件の結果は使い回す (前へ・次へ・スライダーでの再実行では絞り込み直さない)
+        """
+        conditions = [subjects, levels, periods]
+        key = tuple(None if v is None else frozenset(v) for v in conditions)
+        positions = self._filter_cache.get(key)
+        if positions is not None:
+            return positions
+
+        mask = None
+        for column, values in zip(META_COLUMNS, conditions):
+            if values is None:
+                continue
+            m = self._mask(column, set(values))
+            mask = m if mask is None else mask & m
+        if mask is None:
+            positions = array("I", range(self.count))
+        else:
+            bits = mask.to_bytes(self.count, "little")
+            positions = array("I", (m.start() for m in re.finditer(b"\x01", bits)))
+
+        if len(self._filter_cache) >= FILTER_CACHE_SIZE:
+            self._filter_cache.pop(next(iter(self._filter_cache)), None)
+        self._filter_cache[key] = positions
+        return positions
+
+    def close(self):
+        self._index.release()
+        self._mm.close()
+
+
+def ensure_snapshot(json_path):
+    """
+    バイナリスナップショットが無いか JSON より古ければ作り直し、そのパスを返す
+    (Streamlit Cloud には JSON と *.cards のどちらか一方を置けばよい)
+    """
+    path = snapshot_path(json_path)
+    if not os.path.exists(json_path):
+        return path
+    latest = latest_snapshot(path)
+    if (
+        read_store_version(path) is None
+        or os.path.getmtime(latest) < os.path.getmtime(json_path)
+    ):
+        write_snapshot(iter_json_array(json_path), path)
+    return path
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_snapshot(path):
+    """
+    プロセス内で共有するスナップショット (最新の世代)
+    新しい世代が書き出されていない間は同じオブジェクトを返す
+    他のセッションも使っているので close() しないこと
+    (新しい世代ができたら古いオブジェクトは共有をやめ、どこからも参照されなくなった
+    時点で閉じられる。その後の書き出しで古い世代のファイルが削除される)
+    """
+    with _shared_lock:
+        entry = _shared.get(path)
+        for _ in range(3):
+            latest = latest_snapshot(path)
+            if latest is None:
+                raise FileNotFoundError(path)
+            try:
+                st = os.stat(latest)
+                key = (latest, st.st_mtime_ns, st.st_size, st.st_ino)
+                if entry is not None and entry[0] == key:
+                    return entry[1]
+                entry = (key, CardSnapshot(latest))
+                break
+            except FileNotFoundError:
+                # 開く直後に他プロセスが新しい世代を書き出して削除した
+                continue
+        else:
+            raise FileNotFoundError(path)
+        _shared[path] = entry
+        return entry[1]
+
+
+def open_shared_snapshot(json_path):
+    return shared_snapshot(ensure_snapshot(json_path))
@@ -0,0 +1,78 @@
+import json
+import os
+
+from file_lock import atomic_write_json
+from json_stream import iter_json_array
+
+# サイドバー用の集計 (総カード数と科目・難易度・年度ごとの件数) のサイドカー (*.stats.json)
+#
+#   {
+#     "json":  {"key": [JSONの更新時刻(ns), サイズ], "total": ..., "subject": {...}, ...},
+#     "store": {"version": ストアのバージョン, "total": ..., "subject": {...}, ...}
+#   }
+#
+# "json" は JSON スナップショットの集計 (ビューアー用)、"store" はカードストアの集計
+# (スクレイパー用)。それぞれの key / version が一致する間は、サイドバーはこのファイルを
+# 読むだけで済み、カード数に関係なくほぼ一定の時間で表示できる。
+# 一致しない場合は JSON を先頭から1件ずつ読んで数え直す (全件をメモリに載せない)。
+
+FACETS = ["subject", "level", "period"]
+
+UNKNOWN = "不明"
+
+
+def stats_path(json_path):
+    return os.path.splitext(json_path)[0] + ".stats.json"
+
+
+def collect_stats(cards):
+    """カードを1件ずつ数えて集計する (本文は使わない)"""
+    stats = {"total": 0}
+    for facet in FACETS:
+        stats[facet] = {}
+    for card in cards:
+        stats["total"] += 1
+        for facet in FACETS:
+            value = card.get(facet) or UNKNOWN
+            stats[facet][value] = stats[facet].get(value, 0) + 1
+    for facet in FACETS:
+        stats[facet] = dict(sorted(stats[facet].items()))
+    return stats
+
+
+def file_key(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def read_sidecar(json_path):
+    try:
+        with open(stats_path(json_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_sidecar(json_path, **sections):
+    """サイドカーの一部 (json / store) を書き換える"""
+    sidecar = read_sidecar(json_path)
+    sidecar.update(sections)
+    atomic_write_json(stats_path(json_path), sidecar, indent=None)
+
+
+def json_stats(json_path):
+    """
+    JSON スナップショットの集計
+    サイドカーが JSON と一致していればそれを返し、古ければストリーミングで数え直して保存する
+    """
+    key = file_key(json_path)
+    section = read_sidecar(json_path).get("json")
+    if section and section.get("key") == key:
+        return section
+    section = dict(collect_stats(iter_json_array(json_path)), key=key)
+    try:
+        update_sidecar(json_path, json=section)
+    except OSError:
+        # 読み取り専用の環境 (Streamlit Cloud など) では保存せずに返す
+        pass
+    return section
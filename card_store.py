@@ -0,0 +1,837 @@
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from card_blocks import block_id, join_blocks, split_blocks
+from card_journal import journal_path, read_journal, truncate_journal
+from card_search import open_search_index, search_path
+from card_schema import SCHEMA_VERSION, STORE_ONLY_KEYS, upgrade
+from card_snapshot import (
+    read_store_version,
+    shared_snapshot,
+    snapshot_path,
+    write_snapshot,
+)
+from card_stats import file_key, read_sidecar, update_sidecar
+from file_lock import atomic_write, locked
+from json_stream import iter_json_array, write_json_array
+
+# SQLite によるカードストア
+# JSON ファイル (sharousi_data.json など) はビューアー向けのスナップショットとして残し、
+# 読み書き・絞り込み・重複チェックはこのストアに対して行う。
+# 複数プロセスからの同時利用は SQLite (WAL) とロックファイルで調停する。
+# 表面 (front) はブロックに分割し、同じ内容のブロック (条文など) は blocks に一度だけ保存する。
+# 修復用の項目 (STORE_ONLY_KEYS: 解説 API の HTML など) も1項目を1ブロックとして blocks に
+# 保存し、fragment_blocks に {項目: ブロックID} で参照する。スナップショットには書き出さない。
+# カードは card_schema の最新スキーマに変換してから保存する (古い行は読み込み時に変換し、
+# migrate_store でまとめて書き換える)。DB自体の構造は PRAGMA user_version で管理する。
+# 科目・難易度・年度の組み合わせごとの件数は facet_counts にトリガーで書き込み時に集計し、
+# 総数と列ごとの件数 (サイドバーの集計・件数表示) はカード数ではなく組み合わせの数に
+# 比例する時間で返す。アプリの絞り込みはスナップショット側 (CardSnapshot) で行う。
+
+# 列として持つキー (それ以外のキーは extra に JSON で保存する)
+CARD_COLUMNS = ["source", "subject", "level", "period", "title", "front", "back"]
+
+# 絞り込みに使う列
+FACET_COLUMNS = ["subject", "level", "period"]
+
+UNKNOWN = "不明"
+
+# 一度に読み書きする行数 (スナップショットの書き出しや移行で使う)
+BATCH_SIZE = 500
+
+# バックグラウンドでスナップショットを書き出し直す最短の間隔 (秒)
+SNAPSHOT_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT UNIQUE,
+    subject TEXT,
+    level TEXT,
+    period TEXT,
+    title TEXT,
+    front TEXT,
+    back TEXT,
+    extra TEXT,
+    front_blocks TEXT,
+    fragment_blocks TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cards_subject ON cards(subject);
+CREATE INDEX IF NOT EXISTS idx_cards_level ON cards(level);
+CREATE INDEX IF NOT EXISTS idx_cards_period ON cards(period);
+CREATE TABLE IF NOT EXISTS blocks (
+    id TEXT PRIMARY KEY,
+    text TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 組み合わせごとの件数 (未設定の値は「不明」として数える)
+FACET_SCHEMA = """
+CREATE TABLE IF NOT EXISTS facet_counts (
+    subject TEXT NOT NULL,
+    level TEXT NOT NULL,
+    period TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (subject, level, period)
+);
+CREATE TRIGGER IF NOT EXISTS cards_facet_insert AFTER INSERT ON cards BEGIN
+    INSERT INTO facet_counts (subject, level, period, n)
+    VALUES (IFNULL(NEW.subject, '不明'), IFNULL(NEW.level, '不明'),
+            IFNULL(NEW.period, '不明'), 1)
+    ON CONFLICT(subject, level, period) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS cards_facet_delete AFTER DELETE ON cards BEGIN
+    UPDATE facet_counts SET n = n - 1
+    WHERE subject = IFNULL(OLD.subject, '不明') AND level = IFNULL(OLD.level, '不明')
+      AND period = IFNULL(OLD.period, '不明');
+    DELETE FROM facet_counts WHERE n <= 0;
+END;
+CREATE TRIGGER IF NOT EXISTS cards_facet_update
+AFTER UPDATE OF subject, level, period ON cards BEGIN
+    UPDATE facet_counts SET n = n - 1
+    WHERE subject = IFNULL(OLD.subject, '不明') AND level = IFNULL(OLD.level, '不明')
+      AND period = IFNULL(OLD.period, '不明');
+    INSERT INTO facet_counts (subject, level, period, n)
+    VALUES (IFNULL(NEW.subject, '不明'), IFNULL(NEW.level, '不明'),
+            IFNULL(NEW.period, '不明'), 1)
+    ON CONFLICT(subject, level, period) DO UPDATE SET n = n + 1;
+    DELETE FROM facet_counts WHERE n <= 0;
+END;
+"""
+
+
+# 本文が書き換えられたカードの記録 (検索索引の差分更新に使う)
+SEARCH_LOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    card_id INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS cards_search_update
+AFTER UPDATE OF front, back, front_blocks ON cards BEGIN
+    INSERT INTO search_log (card_id) VALUES (NEW.id);
+END;
+"""
+
+
+def _add_front_blocks(conn):
+    columns = [r["name"] for r in conn.execute("PRAGMA table_info(cards)")]
+    if "front_blocks" not in columns:
+        conn.execute("ALTER TABLE cards ADD COLUMN front_blocks TEXT")
+
+
+def _add_fragment_blocks(conn):
+    """fragment_blocks 列を追加し、extra にある修復用の項目をブロックへ移す"""
+    columns = [r["name"] for r in conn.execute("PRAGMA table_info(cards)")]
+    if "fragment_blocks" not in columns:
+        conn.execute("ALTER TABLE cards ADD COLUMN fragment_blocks TEXT")
+    found = " OR ".join(
+        f"json_type(extra, '$.{k}') IS NOT NULL" for k in STORE_ONLY_KEYS
+    )
+    rows = conn.execute(
+        f"SELECT id, extra FROM cards WHERE extra IS NOT NULL AND ({found})"
+    ).fetchall()
+    for row in rows:
+        extra = json.loads(row["extra"])
+        fragments = {k: extra.pop(k) for k in STORE_ONLY_KEYS if k in extra}
+        conn.execute(
+            "UPDATE cards SET extra = ?, fragment_blocks = ? WHERE id = ?",
+            (
+                json.dumps(extra, ensure_ascii=False) if extra else None,
+                json.dumps(_store_fragments(conn, fragments)),
+                row["id"],
+            ),
+        )
+    if rows:
+        # スナップショットから修復用の項目を除くため書き出し直させる
+        _bump_version(conn)
+
+
+def _add_facet_counts(conn):
+    conn.executescript(FACET_SCHEMA)
+    conn.execute("DELETE FROM facet_counts")
+    conn.execute(
+        "INSERT INTO facet_counts (subject, level, period, n) "
+        "SELECT IFNULL(subject, '不明'), IFNULL(level, '不明'), IFNULL(period, '不明'), "
+        "COUNT(*) FROM cards GROUP BY 1, 2, 3"
+    )
+
+
+# DBの構造の移行 (user_version が n のDBを n+1 にする関数)
+DB_MIGRATIONS = [
+    lambda conn: conn.executescript(SCHEMA),
+    _add_front_blocks,
+    _add_facet_counts,
+    lambda conn: conn.executescript(SEARCH_LOG_SCHEMA),
+    _add_fragment_blocks,
+]
+
+
+def _migrate_db(conn):
+    """DBの構造を最新にする (user_version で適用済みの段階を記録する)"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for n in range(version, len(DB_MIGRATIONS)):
+        DB_MIGRATIONS[n](conn)
+        conn.execute(f"PRAGMA user_version = {n + 1}")
+        conn.commit()
+
+
+def db_path(json_path):
+    """JSONスナップショットに対応するDBファイルのパス"""
+    return os.path.splitext(json_path)[0] + ".db"
+
+
+def open_store(json_path):
+    """
+    ストアを開く
+    初回は既存のJSONを取り込み、未反映のジャーナルがあればDBへ畳み込む
+    (他プロセスが追記したカードも、開いた時点で必ず見える)
+    """
+    conn = sqlite3.connect(db_path(json_path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] < len(DB_MIGRATIONS):
+        with locked(json_path):
+            _migrate_db(conn)
+
+    if get_meta(conn, "imported_json") is None:
+        with locked(json_path):
+            if get_meta(conn, "imported_json") is None:
+                if os.path.exists(json_path):
+                    batch = []
+                    for card in iter_json_array(json_path):
+                        batch.append(card)
+                        if len(batch) >= BATCH_SIZE:
+                            upsert_cards(conn, batch)
+                            batch = []
+                    upsert_cards(conn, batch)
+                set_meta(conn, "imported_json", "1")
+
+    sync_journal(conn, json_path)
+    return conn
+
+
+def get_meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn, key, value):
+    with conn:
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+
+def store_version(conn):
+    """書き込みのたびに増えるストアのバージョン"""
+    return int(get_meta(conn, "version") or 0)
+
+
+def _bump_version(conn):
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('version', '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+    )
+
+
+def _store_blocks(conn, text):
+    """表面をブロックに分割して保存し、ブロックIDの列 (JSON) を返す"""
+    blocks = split_blocks(text)
+    ids = [block_id(b) for b in blocks]
+    conn.executemany(
+        "INSERT OR IGNORE INTO blocks (id, text) VALUES (?, ?)", zip(ids, blocks)
+    )
+    return json.dumps(ids)
+
+
+def _store_fragments(conn, fragments):
+    """修復用の項目をそれぞれ1ブロックとして保存し、{項目: ブロックID} を返す"""
+    ids = {k: block_id(v) for k, v in fragments.items() if v is not None}
+    conn.executemany(
+        "INSERT OR IGNORE INTO blocks (id, text) VALUES (?, ?)",
+        [(ids[k], fragments[k]) for k in ids],
+    )
+    return ids
+
+
+def card_to_row(conn, card):
+    card = upgrade(card)
+    row = [card.get(c) for c in CARD_COLUMNS]
+    extra = {
+        k: v
+        for k, v in card.items()
+        if k not in CARD_COLUMNS and k not in STORE_ONLY_KEYS
+    }
+    row.append(json.dumps(extra, ensure_ascii=False) if extra else None)
+    front_blocks = None
+    if card.get("front") is not None:
+        front_blocks = _store_blocks(conn, card["front"])
+        row[CARD_COLUMNS.index("front")] = None
+    row.append(front_blocks)
+    fragments = {k: card[k] for k in STORE_ONLY_KEYS if k in card}
+    row.append(json.dumps(_store_fragments(conn, fragments)) if fragments else None)
+    return row
+
+
+def _block_texts(conn, rows, fragments=True):
+    """rows が参照するブロックのテキストをまとめて取得する"""
+    ids = set()
+    for row in rows:
+        if row["front_blocks"]:
+            ids.update(json.loads(row["front_blocks"]))
+        if fragments and row["fragment_blocks"]:
+            ids.update(json.loads(row["fragment_blocks"]).values())
+    ids = list(ids)
+    texts = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i : i + 500]
+        marks = ", ".join(["?"] * len(chunk))
+        for r in conn.execute(
+            f"SELECT id, text FROM blocks WHERE id IN ({marks})", chunk
+        ):
+            texts[r[0]] = r[1]
+    return texts
+
+
+def row_to_card(row, blocks, fragments=True):
+    """fragments=False の場合は修復用の項目を読まない (スナップショットの書き出し用)"""
+    card = {}
+    for c in CARD_COLUMNS:
+        if c == "front" and row["front_blocks"]:
+            card[c] = join_blocks(blocks[b] for b in json.loads(row["front_blocks"]))
+        elif row[c] is not None:
+            card[c] = row[c]
+    if row["extra"]:
+        card.update(json.loads(row["extra"]))
+    if fragments and row["fragment_blocks"]:
+        for k, b in json.loads(row["fragment_blocks"]).items():
+            card[k] = blocks[b]
+    return upgrade(card)
+
+
+def _rows_to_cards(conn, rows, fragments=True):
+    blocks = _block_texts(conn, rows, fragments)
+    return [row_to_card(r, blocks, fragments) for r in rows]
+
+
+# 書き込む列 (card_to_row の並び)
+ROW_COLUMNS = CARD_COLUMNS + ["extra", "front_blocks", "fragment_blocks"]
+
+
+def _upsert_rows(conn, cards):
+    names = ROW_COLUMNS
+    cols = ", ".join(names)
+    marks = ", ".join(["?"] * len(names))
+    updates = ", ".join(f"{c} = excluded.{c}" for c in names[1:])
+    sql = (
+        f"INSERT INTO cards ({cols}) VALUES ({marks}) "
+        f"ON CONFLICT(source) DO UPDATE SET {updates}"
+    )
+    conn.executemany(sql, [card_to_row(conn, c) for c in cards])
+
+
+def _update_row(conn, source, fields):
+    """source のカードの指定した項目だけを書き換える"""
+    columns = {k: v for k, v in fields.items() if k in CARD_COLUMNS}
+    fragments = {k: v for k, v in fields.items() if k in STORE_ONLY_KEYS}
+    extra_fields = {
+        k: v
+        for k, v in fields.items()
+        if k not in CARD_COLUMNS and k not in STORE_ONLY_KEYS
+    }
+    if "front" in columns:
+        columns["front_blocks"] = _store_blocks(conn, columns["front"])
+        columns["front"] = None
+    if columns:
+        sets = ", ".join(f"{c} = ?" for c in columns)
+        conn.execute(
+            f"UPDATE cards SET {sets} WHERE source = ?", [*columns.values(), source]
+        )
+    if extra_fields:
+        row = conn.execute(
+            "SELECT extra FROM cards WHERE source = ?", (source,)
+        ).fetchone()
+        if row is not None:
+            extra = json.loads(row[0]) if row[0] else {}
+            extra.update(extra_fields)
+            conn.execute(
+                "UPDATE cards SET extra = ? WHERE source = ?",
+                (json.dumps(extra, ensure_ascii=False), source),
+            )
+    if fragments:
+        row = conn.execute(
+            "SELECT fragment_blocks FROM cards WHERE source = ?", (source,)
+        ).fetchone()
+        if row is not None:
+            ids = json.loads(row[0]) if row[0] else {}
+            for k in fragments:
+                ids.pop(k, None)
+            ids.update(_store_fragments(conn, fragments))
+            conn.execute(
+                "UPDATE cards SET fragment_blocks = ? WHERE source = ?",
+                (json.dumps(ids), source),
+            )
+
+
+def upsert_cards(conn, cards):
+    """
+    カードを追加・更新する (source が同じカードは上書き)
+    """
+    with conn:
+        _upsert_rows(conn, cards)
+        _bump_version(conn)
+
+
+def upsert_card(conn, card):
+    upsert_cards(conn, [card])
+
+
+def _where(subjects=None, levels=None, periods=None):
+    """絞り込み条件のWHERE句を組み立てる (未設定の値は「不明」として扱う)"""
+    clauses = []
+    params = []
+    for column, values in zip(FACET_COLUMNS, [subjects, levels, periods]):
+        if values is None:
+            continue
+        values = list(values)
+        parts = []
+        known = [v for v in values if v != UNKNOWN]
+        if known:
+            parts.append(f"{column} IN ({', '.join(['?'] * len(known))})")
+            params.extend(known)
+        if UNKNOWN in values:
+            parts.append(f"{column} IS NULL")
+        clauses.append("(" + " OR ".join(parts) + ")" if parts else "0")
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+
+def load_cards(conn, subjects=None, levels=None, periods=None, limit=None):
+    """条件に一致するカードを登録順に返す (None の条件は絞り込まない)"""
+    where, params = _where(subjects, levels, periods)
+    sql = f"SELECT * FROM cards{where} ORDER BY id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return _rows_to_cards(conn, conn.execute(sql, params).fetchall())
+
+
+def iter_cards(conn, batch=BATCH_SIZE, fragments=True):
+    """
+    全カードを登録順に少しずつ読み込んで返す (全件をメモリに載せない)
+    fragments=False の場合は修復用の項目 (STORE_ONLY_KEYS) を含めない
+    """
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT * FROM cards WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch)
+        ).fetchall()
+        if not rows:
+            return
+        yield from _rows_to_cards(conn, rows, fragments)
+        last_id = rows[-1]["id"]
+
+
+def recent_cards(conn, limit):
+    """直近に追加されたカードを古い順に返す"""
+    rows = conn.execute(
+        "SELECT * FROM cards ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return _rows_to_cards(conn, list(reversed(rows)))
+
+
+def _facet_where(subjects=None, levels=None, periods=None):
+    """facet_counts 用の WHERE 句 (「不明」もそのまま文字列として比較できる)"""
+    clauses = []
+    params = []
+    for column, values in zip(FACET_COLUMNS, [subjects, levels, periods]):
+        if values is None:
+            continue
+        values = list(values)
+        clauses.append(f"{column} IN ({', '.join(['?'] * len(values))})")
+        params.extend(values)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+
+def _check_facet(column):
+    if column not in FACET_COLUMNS:
+        raise ValueError(f"集計できない列です: {column}")
+
+
+def count_cards(conn, subjects=None, levels=None, periods=None):
+    where, params = _facet_where(subjects, levels, periods)
+    row = conn.execute(f"SELECT SUM(n) FROM facet_counts{where}", params).fetchone()
+    return row[0] or 0
+
+
+def facet_counts(conn, column, subjects=None, levels=None, periods=None):
+    """
+    列の値ごとの件数 (他の列の条件で絞り込んだ上での件数)
+    例: facet_counts(conn, "level", subjects=["労働基準法"]) → 労働基準法の難易度別の枚数
+    """
+    _check_facet(column)
+    where, params = _facet_where(subjects, levels, periods)
+    rows = conn.execute(
+        f"SELECT {column}, SUM(n) FROM facet_counts{where} "
+        f"GROUP BY {column} ORDER BY {column}",
+        params,
+    )
+    return {r[0]: r[1] for r in rows}
+
+
+def count_by(conn, column):
+    """列の値ごとの件数 (例: 科目別の枚数)"""
+    return facet_counts(conn, column)
+
+
+def _stats_section(conn):
+    section = {"version": store_version(conn), "total": count_cards(conn)}
+    for column in FACET_COLUMNS:
+        section[column] = count_by(conn, column)
+    return section
+
+
+def store_stats(conn, json_path):
+    """
+    サイドバー用の集計 (総数と列ごとの件数)
+    サイドカー (*.stats.json) がストアのバージョンと一致していればそれを返す
+    """
+    section = read_sidecar(json_path).get("store")
+    if section and section.get("version") == store_version(conn):
+        return section
+    with locked(json_path):
+        section = _stats_section(conn)
+        update_sidecar(json_path, store=section)
+    return section
+
+
+def has_source(conn, source):
+    row = conn.execute("SELECT 1 FROM cards WHERE source = ?", (source,)).fetchone()
+    return row is not None
+
+
+def clear_cards(conn):
+    with conn:
+        conn.execute("DELETE FROM cards")
+        conn.execute("DELETE FROM blocks")
+        conn.execute("DELETE FROM search_log")
+        _bump_version(conn)
+
+
+def update_block(conn, block, text):
+    """
+    ブロックのテキストを書き換える (1回の書き込みで、参照するすべてのカードに反映される)
+    条文の改正などに使う
+    """
+    with conn:
+        conn.execute("UPDATE blocks SET text = ? WHERE id = ?", (text, block))
+        conn.execute(
+            "INSERT INTO search_log (card_id) "
+            "SELECT cards.id FROM cards, json_each(cards.front_blocks) AS j "
+            "WHERE j.value = ?",
+            (block,),
+        )
+        _bump_version(conn)
+
+
+def prune_blocks(conn):
+    """どのカードからも参照されなくなったブロックを削除する"""
+    with conn:
+        cur = conn.execute(
+            "DELETE FROM blocks WHERE id NOT IN ("
+            "SELECT j.value FROM cards, json_each(cards.front_blocks) AS j "
+            "UNION ALL "
+            "SELECT j.value FROM cards, json_each(cards.fragment_blocks) AS j"
+            ")"
+        )
+    return cur.rowcount
+
+
+def _outdated_where():
+    return (
+        "(extra IS NULL OR json_extract(extra, '$.schema') IS NULL "
+        f"OR json_extract(extra, '$.schema') < {SCHEMA_VERSION})"
+    )
+
+
+def migrate_store(conn, batch=BATCH_SIZE):
+    """
+    古いスキーマのカードを最新のスキーマに書き換える
+    ID順に batch 件ずつ、それぞれ短いトランザクションで行うので、
+    他プロセスの書き込みを長く止めない (途中で止めても次回続きから再開できる)
+    戻り値: 書き換えたカードの数
+    """
+    names = ROW_COLUMNS
+    sets = ", ".join(f"{c} = ?" for c in names)
+    total = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            f"SELECT * FROM cards WHERE id > ? AND {_outdated_where()} "
+            "ORDER BY id LIMIT ?",
+            (last_id, batch),
+        ).fetchall()
+        if not rows:
+            break
+        cards = _rows_to_cards(conn, rows)
+        with conn:
+            for row, card in zip(rows, cards):
+                conn.execute(
+                    f"UPDATE cards SET {sets} WHERE id = ?",
+                    [*card_to_row(conn, card), row["id"]],
+                )
+            # スナップショット・集計に書き換えを反映させる
+            _bump_version(conn)
+        total += len(rows)
+        last_id = rows[-1]["id"]
+    return total
+
+
+_migration_started = set()
+_migration_lock = threading.Lock()
+
+
+def start_background_migration(json_path):
+    """
+    古いスキーマのカードの書き換えをバックグラウンドのスレッドで始める
+    (プロセスごと・ファイルごとに1回だけ。書き換え中もストアは普通に使える)
+    """
+    with _migration_lock:
+        if json_path in _migration_started:
+            return
+        _migration_started.add(json_path)
+
+    def run():
+        conn = open_store(json_path)
+        try:
+            migrate_store(conn)
+        except sqlite3.Error:
+            # 他プロセスの書き込みと競合した場合は、次回の起動時に続きから行う
+            with _migration_lock:
+                _migration_started.discard(json_path)
+        finally:
+            conn.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def sync_journal(conn, json_path):
+    """
+    ジャーナル (カードの追加と項目ごとの差分) を順にDBへ反映し、ジャーナルを空にする
+    (チェックポイント。書き込み量は前回からの変更分に比例する)
+    反映と切り詰めの間に他プロセスが追記しないよう、排他ロック下で行う
+    戻り値: 反映したレコード数
+    """
+    path = journal_path(json_path)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    count = 0
+    with locked(json_path):
+        with conn:
+            for record in read_journal(json_path):
+                if record.get("op") == "add":
+                    _upsert_rows(conn, [record["card"]])
+                elif record.get("op") == "update":
+                    _update_row(conn, record["source"], record["fields"])
+                count += 1
+            if count:
+                _bump_version(conn)
+        truncate_journal(json_path)
+        if count:
+            update_sidecar(json_path, store=_stats_section(conn))
+    return count
+
+
+def checkpoint(json_path):
+    """
+    ジャーナルの内容をDBへ反映する (スナップショットは書き出さない)
+    途中で止まっても、ジャーナルに残った差分は次にストアを開いたときに反映される
+    """
+    conn = open_store(json_path)
+    conn.close()
+
+
+def export_snapshot(conn, json_path, retrain=False):
+    """
+    ビューアー向けのJSONスナップショットとバイナリスナップショットを書き出す
+    (修復用の項目はストアにだけ残し、どちらにも書き出さない)
+    一時ファイル + os.replace で置き換えるので、読み込み側が壊れたJSONを見ることはない
+    retrain=True の場合はバイナリスナップショットの共有辞書を学習し直す
+    """
+    count = 0
+
+    def write(f):
+        nonlocal count
+        count = write_json_array(f, iter_cards(conn, fragments=False))
+
+    with locked(json_path):
+        atomic_write(json_path, write)
+        write_snapshot(
+            iter_cards(conn, fragments=False),
+            snapshot_path(json_path),
+            store_version(conn),
+            retrain,
+        )
+        # 書き出した JSON はストアと同じ内容なので、集計も共通
+        section = _stats_section(conn)
+        json_section = dict(section, key=file_key(json_path))
+        del json_section["version"]
+        update_sidecar(json_path, store=section, json=json_section)
+    return count
+
+
+def open_card_index(conn, json_path):
+    """
+    ストアの内容をバイナリスナップショット (mmap インデックス) として開く
+    スナップショットがストアより古い場合はバックグラウンドで書き出し直し、
+    書き出し終わるまでは今のスナップショットを返す (画面の再実行ごとに全カードを
+    圧縮し直さない)。スナップショットがまだなければその場で書き出す
+    戻り値はプロセス内で共有されるので close() しないこと
+    """
+    path = snapshot_path(json_path)
+    current = read_store_version(path)
+    if current is None:
+        with locked(json_path):
+            if read_store_version(path) is None:
+                write_snapshot(
+                    iter_cards(conn, fragments=False), path, store_version(conn)
+                )
+    elif current != store_version(conn):
+        start_background_snapshot(json_path)
+    return shared_snapshot(path)
+
+
+_snapshot_running = set()
+_snapshot_finished = {}
+_snapshot_lock = threading.Lock()
+
+
+def start_background_snapshot(json_path):
+    """
+    スナップショットの書き出しをバックグラウンドのスレッドで始める
+    (プロセスごと・ファイルごとに1つだけ。前回から SNAPSHOT_INTERVAL 秒は間を空ける)
+    """
+    with _snapshot_lock:
+        if json_path in _snapshot_running:
+            return
+        finished = _snapshot_finished.get(json_path)
+        if finished is not None and time.monotonic() - finished < SNAPSHOT_INTERVAL:
+            return
+        _snapshot_running.add(json_path)
+
+    def run():
+        try:
+            conn = open_store(json_path)
+            try:
+                path = snapshot_path(json_path)
+                with locked(json_path):
+                    version = store_version(conn)
+                    if read_store_version(path) != version:
+                        write_snapshot(
+                            iter_cards(conn, fragments=False), path, version
+                        )
+            finally:
+                conn.close()
+        except (OSError, sqlite3.Error):
+            # 次に開いたときに書き出し直す
+            pass
+        finally:
+            with _snapshot_lock:
+                _snapshot_running.discard(json_path)
+                _snapshot_finished[json_path] = time.monotonic()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def refresh_search_index(conn, json_path):
+    """
+    ストアの最新の内容に合わせた検索索引 (card_search.SearchIndex) を返す
+    追加されたカードは末尾に足し、書き換えられたカード (修復・条文の更新) は
+    search_log に記録された分だけ反映する。リセット後は作り直す
+    """
+    snapshot = open_card_index(conn, json_path)
+    if snapshot.store_version != store_version(conn):
+        # スナップショットを書き出し直している間は、今のスナップショットにある分だけ
+        # 索引に加え、書き換えの記録は新しいスナップショットのために残しておく
+        return snapshot, open_search_index(json_path, snapshot)
+    first_id = conn.execute("SELECT MIN(id) FROM cards").fetchone()[0]
+    log_id = conn.execute("SELECT MAX(id) FROM search_log").fetchone()[0] or 0
+
+    def changes(meta):
+        if meta.get("first_id") != first_id:
+            return None
+        card_ids = [
+            r[0]
+            for r in conn.execute(
+                "SELECT DISTINCT card_id FROM search_log WHERE id > ?",
+                (meta.get("log_id", 0),),
+            )
+        ]
+        if not card_ids:
+            return []
+        # 位置 = ID順での順番 (スナップショットは登録順に並ぶ)
+        ids = [r[0] for r in conn.execute("SELECT id FROM cards ORDER BY id")]
+        return [bisect.bisect_left(ids, i) for i in card_ids]
+
+    meta = {"first_id": first_id, "log_id": log_id, "snapshot": list(snapshot.key)}
+    index = open_search_index(json_path, snapshot, changes, meta)
+    with conn:
+        conn.execute("DELETE FROM search_log WHERE id <= ?", (log_id,))
+    return snapshot, index
+
+
+def reset(json_path):
+    """全カードとジャーナルを消去し、空のスナップショットを書き出す"""
+    conn = open_store(json_path)
+    try:
+        with locked(json_path):
+            clear_cards(conn)
+            truncate_journal(json_path)
+        export_snapshot(conn, json_path)
+    finally:
+        conn.close()
+
+
+def compact(json_path):
+    """ジャーナルをDBへ畳み込み、JSONスナップショットを更新する"""
+    conn = open_store(json_path)
+    try:
+        prune_blocks(conn)
+        count = export_snapshot(conn, json_path)
+        # 検索を使ったことがあれば、追加・修復したカードを索引に反映しておく
+        if os.path.exists(search_path(json_path)):
+            refresh_search_index(conn, json_path)
+        return count
+    finally:
+        conn.close()
+
+
+def compact_store(json_path):
+    """
+    ストアを最適な形に作り直す
+    ジャーナルの畳み込み → 古いスキーマのカードの書き換え → 不要なブロックの削除
+    → VACUUM → スナップショットの書き出し (共有辞書も学習し直す) の順に行う
+    いずれの段階もカードを少しずつ読み書きし、全件をメモリに載せない
+    戻り値: 各段階の結果 (dict)
+    """
+    conn = open_store(json_path)
+    try:
+        migrated = migrate_store(conn)
+        pruned = prune_blocks(conn)
+        with locked(json_path):
+            conn.execute("VACUUM")
+        exported = export_snapshot(conn, json_path, retrain=True)
+    finally:
+        conn.close()
+    return {"migrated": migrated, "pruned_blocks": pruned, "cards": exported}
@@ -0,0 +1,300 @@
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from file_lock import locked
+
+# スクレイパー共通の取得エンジン
+#
+# これまでは1件ごとに time.sleep(random.uniform(...)) してから requests を呼んでいたため、
+# 通信と解析にかかった時間が待機時間に上乗せされ、許されている速度よりかなり遅かった。
+# ここではホストごとのトークンバケットで間隔を管理する:
+#   - トークンは rate (1秒あたりのリクエスト数) の速さでたまり、最大 burst 個まで持てる
+#   - リクエストの前にトークンを1個使う。なければたまるまで待つ
+#   - 通信や解析をしている間もトークンはたまるので、その時間は待ち時間から差し引かれる
+#   - Bot 回避のため、待ち時間に 0〜jitter 秒のゆらぎを足す
+# 待機とリクエストの順番はバックグラウンドの asyncio のイベントループで決め、
+# 実際の通信 (requests) と解析はワーカースレッド (asyncio.to_thread) で行う。
+# Streamlit のスクリプトは同期のまま、get / post / map を呼ぶだけでよい。
+#
+# shared_dir を指定すると、トークンバケットの状態をそのフォルダのファイルに置き、
+# 同じフォルダを指定した他のプロセス (ポート8501/8502 のアプリなど) やスレッドと共有する。
+# 一括取得と修復を別々のアプリで同時に動かしても、ホストへの合計の速さが上限を超えない。
+#
+# archive (http_archive.HttpArchive) を指定すると、受け取った応答をすべて保存する。
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+# 既定値 (1秒あたりのリクエスト数・連続で送れる数・ゆらぎの秒数・同時に処理する件数)
+DEFAULT_RATE = 0.3
+DEFAULT_BURST = 2
+DEFAULT_JITTER = 1.0
+DEFAULT_CONCURRENCY = 3
+
+_DONE = object()
+
+
+class TokenBucket:
+    """
+    1つのホストへのリクエストの間隔を決めるトークンバケット
+    reserve() はトークンを1個予約し、使えるようになるまでの秒数を返す
+    (同時に待っているリクエストには順番に間隔をあけた時刻が割り当てられる)
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def reserve(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class SharedTokenBucket:
+    """
+    複数のプロセスで共有するトークンバケット (TokenBucket と同じ使い方)
+    状態 (残りのトークン数と更新時刻) を path のファイルに置き、ロックを取って読み書きする
+    プロセス間で比べられるように時刻は time.time() を使う
+    プロセスごとに rate が違う場合、合計の速さは一番大きい rate を超えない
+    """
+
+    def __init__(self, path, rate, burst=1, clock=time.time):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            return float(state["tokens"]), float(state["updated"])
+        except (OSError, ValueError, KeyError, TypeError):
+            # まだ誰も使っていない (または壊れている) 場合は満タンから始める
+            return self.burst, self.clock()
+
+    def reserve(self):
+        with locked(self.path):
+            tokens, updated = self._read()
+            now = self.clock()
+            # 時計が戻った場合は補充しない
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            tokens -= 1
+            # 書き込みはロックの中だけで行うので、一時ファイルを経由しなくてよい
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"tokens": tokens, "updated": now}, f)
+        if tokens >= 0:
+            return 0.0
+        return -tokens / self.rate
+
+
+def shared_bucket_path(shared_dir, host):
+    """ホストごとの共有バケットの状態ファイル"""
+    name = "".join(c if c.isalnum() or c in ".-" else "_" for c in host)
+    return os.path.join(shared_dir, name + ".crawl")
+
+
+class Crawler:
+    """
+    ホストごとに間隔を守りながら取得するエンジン
+    get / post はどのスレッドから呼んでもよく (requests.Session と同じ引数)、
+    map は work(item) を最大 concurrency 件ずつ並行に実行する
+    shared_dir を指定すると、速さの上限を同じフォルダを使う他のプロセスと共有する
+    archive を指定すると、応答をすべてアーカイブに保存する
+    使い終わったら close() する (with 文でも使える)
+    """
+
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        burst=DEFAULT_BURST,
+        jitter=DEFAULT_JITTER,
+        concurrency=DEFAULT_CONCURRENCY,
+        headers=None,
+        timeout=15,
+        shared_dir=None,
+        archive=None,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self.concurrency = max(1, concurrency)
+        self.headers = {"User-Agent": USER_AGENT}
+        self.headers.update(headers or {})
+        self.timeout = timeout
+        self.shared_dir = shared_dir
+        self.archive = archive
+        self.requests = 0
+        self.waited = 0.0
+        self.started = time.monotonic()
+        self._buckets = {}
+        self._runs = []
+        self._local = threading.local()
+        self._loop = asyncio.new_event_loop()
+        # 通信・解析はこのスレッドプールで行う (同時に処理する件数 + 呼び出し元の分)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency + 1
+        )
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        # 実行中の map は、処理中の件が終わるのを待ってから止める
+        for stop, future in self._runs:
+            stop.set()
+            try:
+                future.result()
+            except Exception:
+                pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=False)
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            if self.shared_dir is None:
+                bucket = TokenBucket(self.rate, self.burst)
+            else:
+                path = shared_bucket_path(self.shared_dir, host)
+                bucket = SharedTokenBucket(path, self.rate, self.burst)
+            self._buckets[host] = bucket
+        return bucket
+
+    async def acquire(self, url):
+        """url のホストに送ってよい時刻まで待つ (イベントループ上で呼ぶ)"""
+        delay = self.bucket(url).reserve()
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        self.requests += 1
+        if delay > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def _session(self):
+        # requests.Session はスレッド間で共有しない
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
+
+    def _send(self, method, url, kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        resp = self._session().request(method, url, **kwargs)
+        if self.archive is not None:
+            self.archive.record(method, url, resp, kwargs.get("data"))
+        return resp
+
+    async def fetch(self, method, url, **kwargs):
+        """イベントループ上で使う取得 (通信はワーカースレッドで行う)"""
+        await self.acquire(url)
+        return await asyncio.to_thread(self._send, method, url, kwargs)
+
+    def request(self, method, url, **kwargs):
+        """同期の取得 (イベントループで順番を待ってから、呼び出したスレッドで通信する)"""
+        asyncio.run_coroutine_threadsafe(self.acquire(url), self._loop).result()
+        return self._send(method, url, kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def map(self, work, items, ordered=False):
+        """
+        work(item) をワーカースレッドで最大 concurrency 件ずつ並行に実行し、
+        終わった順 (ordered=True なら items の順) に (item, 戻り値, 例外) を返すジェネレーター
+        work の中では get / post を使う (Streamlit の表示は呼び出し側で行う)
+        途中で break すると、実行中の件が終わったところで止まる
+        """
+        results = queue.Queue()
+        stop = threading.Event()
+        it = iter(items)
+        it_lock = threading.Lock()
+
+        counter = itertools.count()
+
+        def take():
+            # items がジェネレーターで、中で get を呼んでもよいようにワーカースレッドで進める
+            with it_lock:
+                item = next(it, _DONE)
+                return item, None if item is _DONE else next(counter)
+
+        async def worker():
+            while not stop.is_set():
+                item, n = await asyncio.to_thread(take)
+                if item is _DONE:
+                    return
+                try:
+                    value = await asyncio.to_thread(work, item)
+                    results.put((n, (item, value, None)))
+                except Exception as e:
+                    results.put((n, (item, None, e)))
+
+        async def run():
+            try:
+                await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+            finally:
+                results.put(_DONE)
+
+        future = asyncio.run_coroutine_threadsafe(run(), self._loop)
+        self._runs.append((stop, future))
+        try:
+            # ordered=True の場合、先に終わった件は前の件が届くまで取っておく
+            pending = {}
+            expected = 0
+            while True:
+                entry = results.get()
+                if entry is _DONE:
+                    break
+                if not ordered:
+                    yield entry[1]
+                    continue
+                pending[entry[0]] = entry[1]
+                while expected in pending:
+                    yield pending.pop(expected)
+                    expected += 1
+        finally:
+            stop.set()
+        future.result()
+        self._runs.remove((stop, future))
+
+    def stats(self):
+        """表示用の状態 (リクエスト数・実際の速さ・待った秒数)"""
+        elapsed = max(1e-9, time.monotonic() - self.started)
+        return {
+            "requests": self.requests,
+            "rate": self.requests / elapsed,
+            "waited": self.waited,
+        }
@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+# 複数プロセス (ポート8501/8502 のアプリ、ビューアー) で同じデータを扱うための
+# アドバイザリロックとアトミックな書き込み
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def lock_path(path):
+    return path + ".lock"
+
+
+@contextmanager
+def locked(path, exclusive=True):
+    """
+    path に対応するロックファイルでロックを取る (取れるまで待つ)
+    exclusive=False の場合は共有ロック (Windows では常に排他ロック)
+    """
+    f = open(lock_path(path), "a+")
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK は約10秒で諦めるので取れるまで繰り返す
+                    continue
+        yield
+    finally:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+
+
+def atomic_write(path, write_func, mode="w"):
+    """
+    同じフォルダの一時ファイルに書き込んでから os.replace で置き換える
+    読み込み側が書きかけのファイルを見ることはない
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        encoding = None if "b" in mode else "utf-8"
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            write_func(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path, obj, indent=2):
+    atomic_write(
+        path, lambda f: json.dump(obj, f, ensure_ascii=False, indent=indent)
+    )
@@ -0,0 +1,198 @@
+import gzip
+import json
+import os
+import time
+from urllib.parse import urlencode
+
+from file_lock import locked
+
+# 取得した HTTP の応答を保存するアーカイブ (WARC に似た形式)
+#
+# 解析の仕方 (parse_html_text など) を変えたときに、サイトから取り直さずに
+# 保存した応答から作り直せるようにする。
+#
+#   <名前>.warc.gz   応答を1件ずつ gzip のメンバーにして追記したもの
+#                    (全体を gzip として続けて読むこともできる)
+#                    1件 = ヘッダー (JSON 1行) + 改行 + 本文のバイト列
+#   <名前>.warc.idx  索引 (JSON Lines): キー・URL・ステータス・位置・長さ・時刻
+#
+# 1件ずつ別の gzip メンバーなので、索引の位置から1件だけを読み出せる。
+# 追記はロックを取って行うので、複数のプロセス・スレッドから同時に書いてもよい。
+# 同じキーの応答が複数あるときは後のものを使う。ただし成功 (200) した応答は、
+# その後の失敗 (404 や 500) では隠さない (再解析で使えるように残す)。
+#
+# アーカイブが max_bytes を超えたら <名前>.1.warc.gz (と .idx) に移して新しく始め、
+# backups 世代より古いものは削除する (ディスクを使い続けないように)。
+# 読み出しは古い世代も含めて探す。
+
+# 1ファイルの上限と残す古い世代の数
+MAX_BYTES = 256 * 1024 * 1024
+BACKUPS = 2
+
+
+def archive_path(json_path):
+    return os.path.splitext(json_path)[0] + ".warc.gz"
+
+
+def index_path(path):
+    return path[: -len(".gz")] + ".idx" if path.endswith(".gz") else path + ".idx"
+
+
+def rotated_path(path, n):
+    """n 世代前のアーカイブのパス (例: data.warc.gz -> data.1.warc.gz)"""
+    if path.endswith(".warc.gz"):
+        return f"{path[: -len('.warc.gz')]}.{n}.warc.gz"
+    return f"{path}.{n}"
+
+
+def record_key(method, url, data=None):
+    """応答を引くためのキー (POST の場合は送ったデータを含める)"""
+    key = f"{method.upper()} {url}"
+    if data:
+        key += " " + urlencode(sorted(data.items()))
+    return key
+
+
+class HttpArchive:
+    """
+    応答のアーカイブ
+    record() で保存し、get() でキーに対応する最新の応答を読み出す
+    max_bytes を超えたら古い世代に移す (backups 世代まで残す)
+    """
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = path
+        self.index_path = index_path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._index = None
+        self._index_size = 0
+        self._index_ino = None
+
+    def record(self, method, url, response, data=None):
+        """requests の応答を1件追記する"""
+        header = {
+            "key": record_key(method, url, data),
+            "method": method.upper(),
+            "url": url,
+            "data": data or None,
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", ""),
+            # resp.text と同じ文字コードで読めるようにする
+            "encoding": response.encoding or response.apparent_encoding,
+            "time": time.time(),
+        }
+        member = gzip.compress(
+            json.dumps(header, ensure_ascii=False).encode("utf-8")
+            + b"\n"
+            + response.content,
+            mtime=0,
+        )
+        with locked(self.path):
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                size = 0
+            if size and size + len(member) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(member)
+            entry = {
+                "key": header["key"],
+                "url": url,
+                "status": header["status"],
+                "offset": offset,
+                "length": len(member),
+                "time": header["time"],
+            }
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _rotate(self):
+        """今のアーカイブを1世代前に移す (ロックを取って呼ぶ)"""
+        for n in range(self.backups, 0, -1):
+            old = rotated_path(self.path, n - 1) if n > 1 else self.path
+            new = rotated_path(self.path, n)
+            for src, dst in [(old, new), (index_path(old), index_path(new))]:
+                if os.path.exists(src):
+                    os.replace(src, dst)
+        if self.backups == 0:
+            for name in [self.path, self.index_path]:
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def _read_index(self, f, path):
+        """索引ファイルの続きを読み、読んだバイト数を返す"""
+        size = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                # 書きかけの行は次に読む
+                break
+            size += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entry["path"] = path
+            old = self._index.get(entry["key"])
+            if old is not None and old["status"] == 200 and entry["status"] != 200:
+                continue
+            self._index[entry["key"]] = entry
+        return size
+
+    def index(self):
+        """
+        キー -> 索引の項目 (同じキーは後のもの、ただし 200 の後の失敗は除く)
+        追記された分だけ読み足す
+        (世代が移っていたら古い世代から読み直す)
+        """
+        try:
+            f = open(self.index_path, "rb")
+        except OSError:
+            f = None
+        try:
+            ino = os.fstat(f.fileno()).st_ino if f is not None else None
+            if self._index is None or ino != self._index_ino:
+                self._index = {}
+                self._index_size = 0
+                self._index_ino = ino
+                for n in range(self.backups, 0, -1):
+                    old = rotated_path(self.path, n)
+                    try:
+                        with open(index_path(old), "rb") as g:
+                            self._read_index(g, old)
+                    except OSError:
+                        pass
+            if f is not None:
+                f.seek(self._index_size)
+                self._index_size += self._read_index(f, self.path)
+        finally:
+            if f is not None:
+                f.close()
+        return self._index
+
+    def read(self, entry):
+        """索引の項目から (ヘッダー, 本文のテキスト) を読み出す"""
+        path = entry.get("path", self.path)
+        return read_record(path, entry["offset"], entry["length"])
+
+    def get(self, method, url, data=None):
+        """キーに対応する最新の (ヘッダー, 本文のテキスト)、なければ None"""
+        entry = self.index().get(record_key(method, url, data))
+        if entry is None:
+            return None
+        return self.read(entry)
+
+    def __len__(self):
+        return len(self.index())
+
+
+def read_record(path, offset, length):
+    """アーカイブの offset から1件を読み出す: (ヘッダー, 本文のテキスト)"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length))
+    head, _, body = data.partition(b"\n")
+    header = json.loads(head)
+    return header, body.decode(header.get("encoding") or "utf-8", errors="replace")
@@ -1,11 +1,12 @@
-import json
 import os
 
+from card_schema import card_sections, upgrade
+from json_stream import iter_json_array
+
 SAVE_FILE = "sharousi_data.json"
 
 if os.path.exists(SAVE_FILE):
-    with open(SAVE_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = [upgrade(c) for c in iter_json_array(SAVE_FILE)]
 
     print(f"Total items: {len(data)}")
 
@@ -17,10 +18,10 @@ if os.path.exists(SAVE_FILE):
         print(f"Front: {c.get('front')}")
         print("-" * 20)
 
+    sections = [card_sections(c) for c in data]
+
     # Check for items without '【解説】'
-    no_kaisetsu = [
-        (i, c) for i, c in enumerate(data) if "【解説】" not in c.get("front", "")
-    ]
+    no_kaisetsu = [(i, c) for i, c in enumerate(data) if "解説" not in sections[i]]
     print(f"Items missing 【解説】: {len(no_kaisetsu)}")
     for i, c in no_kaisetsu[:5]:
         print(f"Index: {i}")
@@ -28,26 +29,15 @@ if os.path.exists(SAVE_FILE):
         print("-" * 20)
 
     # Check for empty "【解説】" content
-    # Look for 【解説】 followed immediately by 【条文】 or end of string, possibly with whitespace
     empty_kaisetsu = []
     for i, c in enumerate(data):
-        front = c.get("front", "")
-        if "【解説】" in front:
-            parts = front.split("【解説】")
-            if len(parts) > 1:
-                after_kaisetsu = parts[1]
-                # Check if the next section starts immediately
-                # Usually 【条文】 follows
-                if "【条文】" in after_kaisetsu:
-                    content = after_kaisetsu.split("【条文】")[0].strip()
-                else:
-                    content = after_kaisetsu.strip()
-
-                if (
-                    len(content) < 5
-                    or content == "（公式に解説情報がありませんでした）"
-                ):  # "（公式に解説情報がありませんでした）" matches known pattern
-                    empty_kaisetsu.append((i, c, content))
+        if "解説" in sections[i]:
+            content = sections[i]["解説"].strip()
+            if (
+                len(content) < 5
+                or content == "（公式に解説情報がありませんでした）"
+            ):  # "（公式に解説情報がありませんでした）" matches known pattern
+                empty_kaisetsu.append((i, c, content))
 
     print(f"Items with empty/short kaisetsu: {len(empty_kaisetsu)}")
     for i, c, content in empty_kaisetsu[:5]:
@@ -56,5 +46,11 @@ if os.path.exists(SAVE_FILE):
         print(f"Front start: {c.get('front')[:50]}...")
         print("-" * 20)
 
+    # Check schema / kind
+    kinds = {}
+    for c in data:
+        kinds[c["kind"]] = kinds.get(c["kind"], 0) + 1
+    print(f"Kinds: {kinds}")
+
 else:
     print(f"{SAVE_FILE} not found.")
@@ -0,0 +1,74 @@
+import json
+
+# 大きな JSON 配列 (sharousi_data.json など) を少しずつ読み込むための関数
+# ファイル全体をメモリに載せずに、要素を1つずつ取り出す。
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(path, chunk_size=CHUNK_SIZE):
+    """JSON 配列ファイルの要素を先頭から順に返す"""
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip(chars):
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in chars:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        fill()
+        skip(" \t\r\n﻿")
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError(f"JSON 配列ではありません: {path}")
+        pos += 1
+
+        while True:
+            skip(" \t\r\n,")
+            if pos >= len(buf):
+                raise ValueError(f"JSON 配列が途中で終わっています: {path}")
+            if buf[pos] == "]":
+                return
+            try:
+                obj, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buf) and not eof:
+                # 数値などが読み込みの切れ目で途切れている可能性がある
+                fill()
+                continue
+            pos = end
+            yield obj
+
+
+def write_json_array(f, items, indent=2):
+    """要素を1つずつ JSON 配列として書き出す (json.dump(list) と同じ形式)"""
+    count = 0
+    f.write("[")
+    for item in items:
+        f.write(",\n" if count else "\n")
+        text = json.dumps(item, ensure_ascii=False, indent=indent)
+        if indent:
+            text = "\n".join(" " * indent + line for line in text.split("\n"))
+        f.write(text)
+        count += 1
+    f.write("\n]" if count else "]")
+    return count
@@ -1,13 +1,11 @@
 import streamlit as st
-import requests
 from bs4 import BeautifulSoup
-import time
-import random
-import json
-import os
 import re
 from urllib.parse import urljoin
 
+import card_store
+from crawler_core import DEFAULT_BURST, DEFAULT_CONCURRENCY, DEFAULT_JITTER, Crawler
+
 # page config
 st.set_page_config(
     page_title="応用情報技術者 過去問スクレイパー & 学習", page_icon="💻", layout="wide"
@@ -36,6 +34,8 @@ if link_url:
 
 # 定数定義
 SAVE_FILE = "ap_siken_data.json"
+# キーワード検索で表示する件数
+SEARCH_LIMIT = 100
 BASE_URL = "https://www.ap-siken.com"
 
 # 年度リスト (新しい順)
@@ -77,21 +77,6 @@ EXAM_PERIODS = [
 ]
 
 
-def load_data():
-    if os.path.exists(SAVE_FILE):
-        try:
-            with open(SAVE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-
-def save_data(data):
-    with open(SAVE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-
 # スクレイピング関数
 def parse_question_page(url, session):
     try:
@@ -190,15 +175,15 @@ def parse_question_page(url, session):
 
 
 # Sidebar: データ状況と設定
-data = load_data()
+store = card_store.open_store(SAVE_FILE)
+card_count = card_store.count_cards(store)
 st.sidebar.header("📊 データ状況")
-st.sidebar.metric("保存済みカード数", f"{len(data)} 枚")
+st.sidebar.metric("保存済みカード数", f"{card_count} 枚")
 
 if st.sidebar.button("データをリセット"):
-    if os.path.exists(SAVE_FILE):
-        os.remove(SAVE_FILE)
-        st.success("削除しました")
-        st.rerun()
+    card_store.reset(SAVE_FILE)
+    st.success("削除しました")
+    st.rerun()
 
 st.sidebar.markdown("---")
 
@@ -208,7 +193,7 @@ tab1, tab2 = st.tabs(["📚 学習モード", "🕷️ スクレイピング"])
 
 # Tab 1: 学習モード
 with tab1:
-    if not data:
+    if not card_count:
         st.info(
             "データがありません。「スクレイピング」タブでデータを取得してください。"
         )
@@ -217,12 +202,33 @@ with tab1:
 
         # フィルタリング
         st.markdown("##### フィルタ設定")
-        periods = sorted(
-            list(set([d.get("period", "不明") for d in data])), reverse=True
+        # 全セッションで共有する mmap インデックス (ストアが更新されるまで開き直さない)
+        card_index = card_store.open_card_index(store, SAVE_FILE)
+        period_counts = card_index.facet_counts("period")
+        periods = sorted(period_counts, reverse=True)
+        selected_periods = st.multiselect(
+            "年度で絞り込み",
+            periods,
+            default=periods,
+            format_func=lambda p: f"{p} ({period_counts[p]})",
         )
-        selected_periods = st.multiselect("年度で絞り込み", periods, default=periods)
 
-        filtered_data = [d for d in data if d.get("period") in selected_periods]
+        filtered_data = card_index.filter(periods=selected_periods)
+
+        # キーワード検索 (問題文・選択肢・解説の全文、関連度順)
+        query = st.text_input("🔎 キーワード検索", placeholder="例: 公開鍵")
+        if query != st.session_state.get("search_query", ""):
+            st.session_state.search_query = query
+            st.session_state.card_idx = 0
+            st.session_state.is_flipped = False
+        if query.strip():
+            card_index, search_index = card_store.refresh_search_index(
+                store, SAVE_FILE
+            )
+            filtered_data, hit_count = search_index.search(
+                query, card_index, positions=filtered_data, limit=SEARCH_LIMIT
+            )
+            st.caption(f"「{query}」: 候補 {hit_count} 件中、上位 {len(filtered_data)} 件")
 
         if not filtered_data:
             st.warning("条件に一致するカードがありません。")
@@ -237,7 +243,7 @@ with tab1:
             if st.session_state.card_idx >= len(filtered_data):
                 st.session_state.card_idx = 0
 
-            current_card = filtered_data[st.session_state.card_idx]
+            current_card = card_index.card(filtered_data[st.session_state.card_idx])
 
             # UI
             st.markdown(
@@ -339,9 +345,18 @@ with tab2:
 
     with c2:
         st.markdown("##### 待機設定 (Safety)")
-        st.caption("サーバー負荷軽減とBot検知回避のため、ランダムに待機します。")
-        s_min = st.slider("待機時間(最小)", 1.0, 5.0, 2.0, key="s_min")
-        s_max = st.slider("待機時間(最大)", 3.0, 10.0, 5.0, key="s_max")
+        st.caption(
+            "サーバー負荷軽減のため1秒あたりのリクエスト数の上限を守り、"
+            "Bot検知回避のためランダムなゆらぎを加えます。"
+        )
+        rate = st.slider(
+            "1秒あたりのリクエスト数 (上限)", 0.05, 1.0, 0.3, 0.05, key="rate"
+        )
+        burst = st.slider("連続で送れる数 (バースト)", 1, 5, DEFAULT_BURST, key="burst")
+        jitter = st.slider("ゆらぎ (秒)", 0.0, 5.0, DEFAULT_JITTER, key="jitter")
+        concurrency = st.slider(
+            "同時に処理する件数", 1, 8, DEFAULT_CONCURRENCY, key="concurrency"
+        )
 
     # 対象期間抽出
     target_periods = []
@@ -362,18 +377,15 @@ with tab2:
     # 実行
     st.markdown("---")
     if st.button("🚀 スクレイピング開始", type="primary"):
-        session = requests.Session()
-        session.headers.update(
-            {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
+        # 間隔の管理と User-Agent はエンジン側で行う
+        crawler = Crawler(
+            rate=rate, burst=burst, jitter=jitter, concurrency=concurrency, timeout=10
         )
 
         progress_bar = st.progress(0)
         status_text = st.empty()
         stop_btn = st.button("⛔ 中断")
 
-        existing_urls = set([d.get("source") for d in data])
         new_data_count = 0
         total_periods = len(target_periods)
 
@@ -383,7 +395,7 @@ with tab2:
 
                 index_url = f"{BASE_URL}/kakomon/{code}/"
                 try:
-                    r = session.get(index_url, timeout=10)
+                    r = crawler.get(index_url)
                     if r.status_code != 200:
                         st.error(f"取得失敗: {label}")
                         continue
@@ -403,30 +415,36 @@ with tab2:
                         links.append(urljoin(index_url, a.get("href")))
 
                     links = sorted(list(set(links)))
-
-                    for l_idx, link in enumerate(links):
+                    # 取得済みの問題は飛ばす (ストアはこのスレッドでだけ使う)
+                    links = [
+                        link for link in links if not card_store.has_source(store, link)
+                    ]
+
+                    # 問題ページは並行に取得・解析し、一覧の順に保存する
+                    results = crawler.map(
+                        lambda link: parse_question_page(link, crawler),
+                        links,
+                        ordered=True,
+                    )
+                    for l_idx, (link, result, error) in enumerate(results):
                         if stop_btn:
                             raise KeyboardInterrupt("Stop")
 
-                        if link in existing_urls:
-                            continue
-
-                        # Random Wait
-                        time.sleep(random.uniform(s_min, s_max))
+                        if error is None:
+                            card_data, msg = result
+                        else:
+                            card_data, msg = None, f"エラー: {error}"
 
                         status_text.write(
-                            f"📝 [{label}] {l_idx + 1}/{len(links)}: {link}"
+                            f"📝 [{label}] {l_idx + 1}/{len(links)}: {link} "
+                            f"(実際の速さ {crawler.stats()['rate']:.2f} 件/秒)"
                         )
 
-                        card_data, msg = parse_question_page(link, session)
-
                         if card_data:
                             card_data["period"] = label
-                            data.append(card_data)
-                            existing_urls.add(link)
+                            # 1件ずつ追加 (ファイル全体は書き直さない)
+                            card_store.upsert_card(store, card_data)
                             new_data_count += 1
-                            if new_data_count % 5 == 0:
-                                save_data(data)
                         else:
                             st.warning(f"Error: {link} - {msg}")
 
@@ -441,17 +459,19 @@ with tab2:
 
         except KeyboardInterrupt:
             st.warning("中断しました")
+        finally:
+            crawler.close()
 
-        save_data(data)
+        card_store.export_snapshot(store, SAVE_FILE)
         st.success(f"完了: {new_data_count} 件追加")
         st.rerun()
 
     # Preview
     st.markdown("---")
     st.caption("直近取得した20件")
-    if data:
+    if card_count:
         preview_list = []
-        for d in data[-20:]:
+        for d in card_store.recent_cards(store, 20):
             preview_list.append(
                 {
                     "年度": d.get("period", ""),
@@ -1,11 +1,15 @@
 import streamlit as st
-import requests
 from bs4 import BeautifulSoup
 import pandas as pd
-import time
-import random
 import os
 
+from crawler_core import (
+    DEFAULT_BURST,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_JITTER,
+    Crawler,
+)
+
 # ページ設定
 st.set_page_config(page_title="セーフティ・スクレイパー", page_icon="🕷️", layout="wide")
 
@@ -57,9 +61,51 @@ selector_title = st.sidebar.text_input("タイトル/質問", "h2.title")
 selector_content = st.sidebar.text_input("内容/答え", "div.content")
 
 # 3. 待機設定（重要）
+# ホストごとに「1秒あたりのリクエスト数」の上限を守る (通信・解析の時間も間隔に数える)
 st.sidebar.subheader("⏱️ 待機設定 (Safety)")
-min_sleep = st.sidebar.slider("最小待機時間 (秒)", 1.0, 10.0, 3.0)
-max_sleep = st.sidebar.slider("最大待機時間 (秒)", 5.0, 30.0, 10.0)
+rate = st.sidebar.slider("1秒あたりのリクエスト数 (上限)", 0.02, 1.0, 0.15, 0.01)
+burst = st.sidebar.slider("連続で送れる数 (バースト)", 1, 5, DEFAULT_BURST)
+jitter = st.sidebar.slider("ゆらぎ (秒, Bot回避用)", 0.0, 10.0, DEFAULT_JITTER)
+concurrency = st.sidebar.slider("同時に処理する件数", 1, 8, DEFAULT_CONCURRENCY)
+
+
+def scrape_page(crawler, url):
+    """1ページを取得して抽出した行のリストを返す (ワーカースレッドで実行)"""
+    response = crawler.get(url, timeout=10)
+    response.raise_for_status()  # エラーなら例外発生
+
+    soup = BeautifulSoup(response.content, "html.parser")
+
+    # コンテナ単位で探すか、単一ページから探すか
+    containers = soup.select(selector_container)
+
+    rows = []
+    if containers:
+        for item in containers:
+            title_elm = item.select_one(selector_title)
+            content_elm = item.select_one(selector_content)
+
+            title_text = title_elm.get_text(strip=True) if title_elm else "N/A"
+            content_text = content_elm.get_text(strip=True) if content_elm else "N/A"
+
+            rows.append({"URL": url, "Title": title_text, "Content": content_text})
+    else:
+        # コンテナが見つからない場合、ページ全体から1つ探す（詳細ページなどの場合）
+        title_elm = soup.select_one(selector_title)
+        content_elm = soup.select_one(selector_content)
+
+        if title_elm or content_elm:
+            rows.append(
+                {
+                    "URL": url,
+                    "Title": title_elm.get_text(strip=True) if title_elm else "N/A",
+                    "Content": content_elm.get_text(strip=True)
+                    if content_elm
+                    else "N/A",
+                }
+            )
+    return rows
+
 
 # --- メイン処理 ---
 
@@ -71,76 +117,38 @@ if st.button("スクレイピング開始", type="primary"):
         progress_bar = st.progress(0)
         status_text = st.empty()
 
-        # User-Agentの設定（重要）
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-
         stop_button = st.button("中断")
 
-        for i, url in enumerate(target_urls):
-            if stop_button:
-                st.warning("処理を中断しました。")
-                break
-
-            # 1. ランダムWait (初回以外)
-            if i > 0:
-                sleep_time = random.uniform(min_sleep, max_sleep)
-                status_text.write(f"⏳ 待機中... ({sleep_time:.2f}秒)")
-                time.sleep(sleep_time)
-
-            # 2. アクセス
-            try:
-                status_text.write(f"🔄 アクセス中 ({i + 1}/{len(target_urls)}): {url}")
-                response = requests.get(url, headers=headers, timeout=10)
-                response.raise_for_status()  # エラーなら例外発生
-
-                # 3. 解析
-                soup = BeautifulSoup(response.content, "html.parser")
-
-                # コンテナ単位で探すか、単一ページから探すか
-                containers = soup.select(selector_container)
-
-                if containers:
-                    for item in containers:
-                        title_elm = item.select_one(selector_title)
-                        content_elm = item.select_one(selector_content)
-
-                        title_text = (
-                            title_elm.get_text(strip=True) if title_elm else "N/A"
-                        )
-                        content_text = (
-                            content_elm.get_text(strip=True) if content_elm else "N/A"
-                        )
-
-                        results.append(
-                            {"URL": url, "Title": title_text, "Content": content_text}
-                        )
+        # User-Agent はエンジン側で設定する（重要）
+        crawler = Crawler(
+            rate=rate, burst=burst, jitter=jitter, concurrency=concurrency
+        )
+        try:
+            done = 0
+            for url, rows, error in crawler.map(
+                lambda u: scrape_page(crawler, u), target_urls, ordered=True
+            ):
+                if stop_button:
+                    st.warning("処理を中断しました。")
+                    break
+
+                done += 1
+                if error is not None:
+                    st.error(f"エラー発生 ({url}): {error}")
+                elif rows:
+                    results.extend(rows)
                 else:
-                    # コンテナが見つからない場合、ページ全体から1つ探す（詳細ページなどの場合）
-                    title_elm = soup.select_one(selector_title)
-                    content_elm = soup.select_one(selector_content)
-
-                    if title_elm or content_elm:
-                        results.append(
-                            {
-                                "URL": url,
-                                "Title": title_elm.get_text(strip=True)
-                                if title_elm
-                                else "N/A",
-                                "Content": content_elm.get_text(strip=True)
-                                if content_elm
-                                else "N/A",
-                            }
-                        )
-                    else:
-                        st.warning(f"データが見つかりませんでした: {url}")
-
-            except Exception as e:
-                st.error(f"エラー発生 ({url}): {e}")
-
-            # プログレスバー更新
-            progress_bar.progress((i + 1) / len(target_urls))
+                    st.warning(f"データが見つかりませんでした: {url}")
+
+                info = crawler.stats()
+                status_text.write(
+                    f"🔄 取得中 ({done}/{len(target_urls)}): {url} "
+                    f"(実際の速さ {info['rate']:.2f} 件/秒)"
+                )
+                # プログレスバー更新
+                progress_bar.progress(done / len(target_urls))
+        finally:
+            crawler.close()
 
         status_text.text("✅ 完了しました！")
 
@@ -165,6 +173,7 @@ with st.expander("使い方"):
     1. **URL入力**: スクレイピングしたいURLを指定します。連番の場合は `https://site.com/page/{}` のように `{}` を使います。
     2. **セレクタ設定**: Chromeの検証ツール(F12)などで、取得したい要素のCSSセレクタを調べます。
        - `div.class_name` や `#id_name` など
-    3. **待機設定**: サイトの負荷を考え、デフォルト(3~10秒)以上の時間を設定することをお勧めします。
+    3. **待機設定**: サイトの負荷を考え、1秒あたりのリクエスト数はデフォルト(0.15件)以下にすることをお勧めします。
+       通信や解析にかかった時間も間隔に含めるので、上限いっぱいの速さで取得できます。
     4. **実行**: 開始ボタンを押すと、ゆっくりとデータを収集します。
     """)
@@ -1,16 +1,33 @@
 import streamlit as st
-import requests
 from bs4 import BeautifulSoup
 import time
-import random
 import re
 import json
 import os
 
-import concurrent.futures
 import socket
 from urllib.parse import urljoin
 
+import card_apkg
+import card_bundle
+import card_export
+import card_store
+from card_deck import card_deck, deck_card
+from card_journal import JournalWriter
+from card_render import PREFETCH_RADIUS, RENDER_CACHE_SIZE, RenderCache
+from card_schema import card_sections
+from crawler_core import DEFAULT_BURST, DEFAULT_CONCURRENCY, DEFAULT_JITTER, Crawler
+from file_lock import atomic_write_json
+from http_archive import BACKUPS, MAX_BYTES, HttpArchive, archive_path
+from sharousi_site import (
+    fetch_question,
+    generate_rewrite,
+    has_fragments,
+    render_fragments,
+    reparse,
+    scrape_card,
+)
+
 try:
     from pyngrok import ngrok  # 外部アクセス用
 except ImportError:
@@ -26,36 +43,42 @@ st.markdown(
 
 # 定数定義
 SAVE_FILE = "sharousi_data.json"
+# 修復・強制更新で差分をDBへ反映する間隔 (件)
+CHECKPOINT_EVERY = 50
+# キーワード検索で表示する件数
+SEARCH_LIMIT = 100
+# Anki デッキの名前
+DECK_NAME = "社労士過去問"
+# 取得の速さの上限を共有するフォルダ (8501/8502 で同時に動かしても合計で上限を守る)
+CRAWL_STATE_DIR = os.path.dirname(os.path.abspath(SAVE_FILE))
 
 
-def load_data_with_retry(filepath, retries=3, delay=0.5):
+def load_data(filepath):
     """
-    ファイルを読み込む際、競合エラーが発生したらリトライする関数
+    全カードを読み込む (カードストアの薄いラッパー)
+    他プロセスが追記したばかりのカードも含めて返すので、リトライは不要
     """
-    for i in range(retries):
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, OSError, PermissionError):
-            if i < retries - 1:
-                time.sleep(delay)
-            else:
-                return []
-    return []
+    conn = card_store.open_store(filepath)
+    try:
+        return card_store.load_cards(conn)
+    finally:
+        conn.close()
 
 
 # Sidebar
 st.sidebar.markdown("## 📊 収集状況")
-if os.path.exists(SAVE_FILE):
+if os.path.exists(SAVE_FILE) or os.path.exists(card_store.db_path(SAVE_FILE)):
     try:
-        d = load_data_with_retry(SAVE_FILE)
-        st.sidebar.metric("総カード数", f"{len(d)} 枚")
+        store = card_store.open_store(SAVE_FILE)
+        # 集計はサイドカー (*.stats.json) から読む (ストアに書き込みがあった時だけ数え直す)
+        stats = card_store.store_stats(store, SAVE_FILE)
+        st.sidebar.metric("総カード数", f"{stats['total']} 枚")
+        # 古い形式のカードがあれば裏で最新の形式へ書き換える (プロセスごとに1回)
+        card_store.start_background_migration(SAVE_FILE)
 
         # Breakdown
-        subjects = {}
-        for x in d:
-            s = x.get("subject", "不明")
-            subjects[s] = subjects.get(s, 0) + 1
+        subjects = stats["subject"]
+        store.close()
 
         if subjects:
             st.sidebar.markdown("### 科目別")
@@ -167,135 +190,120 @@ max_count = st.sidebar.slider(
     10,
     help="「作成開始」ボタンでの実行時のみ適用されます。全自動クローラーでは無視されます（無制限）。",
 )
-sleep_min = st.sidebar.slider("待機時間(最小)", 2.0, 5.0, 3.0)
-sleep_max = st.sidebar.slider("待機時間(最大)", 5.0, 15.0, 6.0)
+# アクセス間隔: 1秒あたりのリクエスト数の上限を守る (通信・解析の時間も間隔に数える)
+# 上限は同じフォルダで動いている他のアプリ (8501/8502) とも共有する
+crawl_rate = st.sidebar.slider(
+    "1秒あたりのリクエスト数 (上限)",
+    0.05,
+    1.0,
+    0.3,
+    0.05,
+    help="同時に動かしている他のアプリ (8501/8502) の取得と合わせた上限です。",
+)
+crawl_burst = st.sidebar.slider("連続で送れる数 (バースト)", 1, 5, DEFAULT_BURST)
+crawl_jitter = st.sidebar.slider("ゆらぎ (秒, Bot回避用)", 0.0, 5.0, DEFAULT_JITTER)
+crawl_concurrency = st.sidebar.slider("同時に処理する件数", 1, 8, DEFAULT_CONCURRENCY)
+direct_api = st.sidebar.checkbox(
+    "問題ページを取得せずに解説を取得する",
+    value=True,
+    help="問題の URL から問題IDを求めて解説 API だけを呼びます (1件あたりのリクエストが半分)。"
+    "求めた ID が合わないときは問題ページを取得します。",
+)
+save_archive = st.sidebar.checkbox(
+    "取得した応答を保存する (再解析用)",
+    value=True,
+    help=f"{archive_path(SAVE_FILE)} に保存し、解析の仕方を変えたときに"
+    "通信せずにカードを作り直せるようにします。"
+    f"{MAX_BYTES // (1024 * 1024)}MB を超えたら古い世代に移し、"
+    f"{BACKUPS} 世代より古いものは削除します。",
+)
+crawl_archive = HttpArchive(archive_path(SAVE_FILE)) if save_archive else None
 
 
-def parse_html_text(element):
+@st.fragment
+def card_viewer(card_index, saved_data, render_cache):
     """
-    HTML要素からテキストを抽出し、赤文字・緑文字をStreamlitのMarkdown記法に変換する
+    カードモードの表示部分 (1枚ずつ)
+    前へ・次へ・裏返し・スライダーの操作では、この関数だけを再実行する
+    (サイドバーの集計、接続情報、スクレイピングのタブなどは再実行しない)
+    card_index と saved_data は最後にページ全体を実行したときのものを使う
+    本文は render_cache (前後のカードを先読みした描画済みの HTML) から出す
     """
-    if not element:
-        return ""
-
-    text = ""
-    for child in element.contents:
-        if child.name is None:  # Text Node
-            text += child.string if child.string else ""
-        elif child.name == "br":
-            text += "\n"
+    # --- Session State 初期化 ---
+    if "card_idx" not in st.session_state:
+        st.session_state.card_idx = 0
+    if "is_flipped" not in st.session_state:
+        st.session_state.is_flipped = False
+
+    # 範囲チェック
+    if st.session_state.card_idx >= len(saved_data):
+        st.session_state.card_idx = 0
+
+    # --- 画面レイアウト ---
+    # ヘッダー (スライダーの値を反映してから書き込む)
+    header = st.container()
+
+    new_index = st.slider(
+        "カード移動",
+        min_value=1,
+        max_value=len(saved_data),
+        value=st.session_state.card_idx + 1,
+        label_visibility="collapsed",
+    )
+    # スライダー操作でインデックス変更
+    if new_index - 1 != st.session_state.card_idx:
+        st.session_state.card_idx = new_index - 1
+        st.session_state.is_flipped = False
+
+    # 現在のカードの位置 (本文は表示する面だけ展開する)
+    card_pos = saved_data[st.session_state.card_idx]
+
+    # メタデータ取得
+    subject_info, level_info, _ = card_index.meta(card_pos)
+
+    # ヘッダーに科目とレベルを表示
+    with header:
+        st.markdown(f"#### 🏷️ {subject_info} / ランク: {level_info}")
+        st.markdown(f"**No. {st.session_state.card_idx + 1} / {len(saved_data)}**")
+
+    # カード表示エリア (先読み済みなら描画済みの HTML を出すだけ)
+    rendered = render_cache.get(card_index, card_pos)
+    card_container = st.container(border=True)
+    with card_container:
+        if st.session_state.is_flipped:
+            back_text = rendered["source"]
+            st.markdown("### 💡 ソースURL (裏面)")
+            st.code(back_text, language=None)
+            st.link_button("元サイトを開く", back_text)
         else:
-            # Recursive parse
-            inner_text = parse_html_text(child)
-
-            # Check color
-            color = ""
-            cls = child.get("class", [])
-            if isinstance(cls, str):
-                cls = [cls]
-
-            style = child.get("style", "").lower()
-
-            # 赤・緑の判定 (クラス名やスタイル)
-            # 判明しているクラス: clr2 -> 赤
-            styles_str = style.lower()
-            classes_set = set([c.lower() for c in cls])
-
-            if (
-                "clr2" in classes_set
-                or any("red" in c for c in classes_set)
-                or "color:red" in styles_str
-                or "color: red" in styles_str
-                or "#ff0000" in styles_str
-            ):
-                color = "red"
-            elif (
-                any("green" in c for c in classes_set)
-                or "color:green" in styles_str
-                or "color: green" in styles_str
-            ):
-                color = "green"
-
-            # テーブルが含まれている場合（Markdownのセパレータ等で判定）、色指定で囲むと崩れるのでスキップ
-            if "| --- |" in inner_text or "\n| " in inner_text:
-                color = ""  # 強制的に無効化
-
-            if color:
-                text += f":{color}[{inner_text}]"
-            else:
-                text += inner_text
-
-    return text
-
-
-def get_explanation(session, q_id, referer_url):
-    """APIを叩いて解説を取得する"""
-    api_url = "https://sharousi-kakomon.com/q/check_q_a.php"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
-        "X-Requested-With": "XMLHttpRequest",
-        "Origin": "https://sharousi-kakomon.com",
-        "Referer": referer_url,
-    }
-    data = {"q": q_id, "a": "1"}  # 1=Maru, 0=Batsu (Either returns explanation)
-
-    try:
-        # タイムアウト延長
-        resp = session.post(api_url, headers=headers, data=data, timeout=15)
-        if resp.status_code == 200:
-            # Response is HTML snippet
-            soup = BeautifulSoup(resp.text, "html.parser")
-            kaisetsu_div = soup.find("div", class_="kaisetu")
-            joubun_div = soup.find("div", class_="joubun")
-            point_div = soup.find("div", class_="point")
-
-            # 何も取得できなかった場合は、APIレスポンス不正の可能性がある
-            if not kaisetsu_div and not joubun_div and not point_div:
-                # レスポンスが極端に短い場合はエラー扱い
-                if len(resp.text) < 50:
-                    return "APIエラー: レスポンス不正(Empty)", "", ""
-                # 十分な長さがあるなら「解説なし」かもしれないが、念のため
-
-            kaisetsu_text = (
-                parse_html_text(kaisetsu_div).strip()
-                if kaisetsu_div
-                else "解説が見つかりませんでした"
+            st.markdown("### 📝 カード内容 (表面)")
+            st.markdown(rendered["front"], unsafe_allow_html=True)
+
+    # 操作ボタン (3カラム)
+    col_prev, col_flip, col_next = st.columns([1, 2, 1])
+
+    with col_prev:
+        if st.button("⬅️ 前へ"):
+            st.session_state.card_idx = max(0, st.session_state.card_idx - 1)
+            st.session_state.is_flipped = False
+            st.rerun(scope="fragment")
+
+    with col_flip:
+        button_label = "答えを見る / 戻る 🔄"
+        if st.button(button_label, use_container_width=True):
+            st.session_state.is_flipped = not st.session_state.is_flipped
+            st.rerun(scope="fragment")
+
+    with col_next:
+        if st.button("次へ ➡️"):
+            st.session_state.card_idx = min(
+                len(saved_data) - 1, st.session_state.card_idx + 1
             )
-            joubun_text = parse_html_text(joubun_div).strip() if joubun_div else ""
-            point_text = parse_html_text(point_div).strip() if point_div else ""
-
-            return kaisetsu_text, joubun_text, point_text
-        else:
-            return f"APIエラー: {resp.status_code}", "", ""
-    except Exception as e:
-        return f"通信エラー: {e}", "", ""
+            st.session_state.is_flipped = False
+            st.rerun(scope="fragment")
 
-
-def generate_rewrite(question, explanation, article="", point=""):
-    """
-    ユーザー要望:
-    表面: ポイント + 解説 + 条文 (要約なし)
-    裏面: ソースURL (呼び出し元で設定)
-    """
-
-    # AIを使用せず、そのまま結合して返す
-    components = []
-
-    # ポイント
-    if point:
-        components.append(f"【ポイント】\n{point}")
-
-    # 解説
-    components.append(f"【解説】\n{explanation}")
-
-    # 条文
-    if article:
-        components.append(f"【条文】\n{article}")
-
-    front_text = "\n\n---\n".join(components)
-
-    return front_text, explanation
+    # 表示し終わってから前後のカードを描画しておく
+    render_cache.prefetch(card_index, saved_data, st.session_state.card_idx)
 
 
 # --- メイン処理 ---
@@ -331,9 +339,11 @@ with tab3:
         start_subject = st.number_input("開始科目ID (1-10)", 1, 10, default_subject)
         start_page = st.number_input("開始ページ", 1, 100, default_page)
     with col2:
-        # ランダム待機の幅設定
-        wait_min = st.number_input("待機(最小)秒", 3.0, 10.0, 5.0)
-        wait_max = st.number_input("待機(最大)秒", 5.0, 30.0, 10.0)
+        # 全自動は長時間動かすので、通常より低い上限にする
+        # (バースト・ゆらぎ・同時に処理する件数はサイドバーの設定を使う)
+        bulk_rate = st.number_input(
+            "1秒あたりのリクエスト数 (上限)", 0.02, 1.0, 0.15, step=0.01
+        )
 
     # オプション
     stop_every_subject = st.checkbox("1科目完了ごとに一時停止する (推奨)", value=True)
@@ -352,8 +362,7 @@ with tab3:
             "「全データを削除」を押すと、これまでに保存したカードデータと進捗がすべて消えます。"
         )
         if st.button("🗑️ 全データを削除してリセット"):
-            if os.path.exists(SAVE_FILE):
-                os.remove(SAVE_FILE)
+            card_store.reset(SAVE_FILE)
             if os.path.exists(bulk_progress_file):
                 os.remove(bulk_progress_file)
 
@@ -362,29 +371,39 @@ with tab3:
             time.sleep(1)
             st.rerun()
 
+    # ストアの最適化
+    st.markdown("---")
+    with st.expander("🧹 ストアの最適化（古い形式の変換・不要データの削除）"):
+        st.info(
+            "古い形式のカードを最新の形式に変換し、使われなくなったデータを削除してファイルを詰め直します。"
+        )
+        if st.button("🧹 最適化を実行"):
+            with st.spinner("最適化しています..."):
+                result = card_store.compact_store(SAVE_FILE)
+            st.success(
+                f"完了: {result['cards']} 枚 "
+                f"(形式を変換: {result['migrated']} 枚, "
+                f"削除したブロック: {result['pruned_blocks']} 件)"
+            )
+
     # データ修復ボタン
     st.markdown("---")
     with st.expander("🛠️ データ修復（解説取得失敗などをリトライ）"):
         st.info(
-            "AI生成エラーなどで表面が正しく保存されなかったカードを、再度サイトから問題文を取得して修正します。"
+            "AI生成エラーなどで表面が正しく保存されなかったカードを修正します。"
+            "解説の HTML を保存してあるカードは通信せずに作り直し、"
+            "それ以外は解説を取得し直します。"
         )
         if st.button("🔧 データの修復を開始"):
             if os.path.exists(SAVE_FILE):
                 try:
-                    data = load_data_with_retry(SAVE_FILE)
+                    data = load_data(SAVE_FILE)
 
                     count_fixed = 0
                     count_unfixable = 0
                     repair_bar = st.progress(0)
                     status_repair = st.empty()
 
-                    session_repair = requests.Session()
-                    session_repair.headers.update(
-                        {
-                            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-                        }
-                    )
-
                     # 修復が必要かどうかを判定する関数
                     def is_broken(card):
                         front = card.get("front", "")
@@ -403,25 +422,13 @@ with tab3:
                             return True
 
                         # 2. 解説ヘッダーがない
-                        if "【解説】" not in front:
+                        sections = card_sections(card)
+                        if "解説" not in sections:
                             return True
 
                         # 3. 解説の中身が空（【解説】の直後に【条文】が来る、または末尾）
-                        try:
-                            parts = front.split("【解説】")
-                            if len(parts) > 1:
-                                after_kaisetsu = parts[1]
-                                # 【条文】があればそこまで、なければ最後まで
-                                if "【条文】" in after_kaisetsu:
-                                    content = after_kaisetsu.split("【条文】")[0]
-                                else:
-                                    content = after_kaisetsu
-
-                                # 空白を除いて空っぽならアウト
-                                if not content.strip():
-                                    return True
-                        except Exception:
-                            pass
+                        if not sections["解説"].strip():
+                            return True
 
                         return False
 
@@ -432,7 +439,8 @@ with tab3:
                         st.success("修復が必要なデータは見つかりませんでした。")
                     else:
                         st.info(
-                            f"{len(targets)} 件のデータを並列修復しています... (最大5並列)"
+                            f"{len(targets)} 件のデータを並列修復しています... "
+                            f"(最大{crawl_concurrency}並列)"
                         )
 
                         repair_bar = st.progress(0)
@@ -442,115 +450,113 @@ with tab3:
                         count_unfixable = 0
                         count_processed = 0
                         total_targets = len(targets)
+                        # 修復したカードは変更した項目だけをジャーナルへ記録する
+                        journal = JournalWriter(SAVE_FILE)
+
+                        def rebuild_front(explanation_text, article_text, point_text):
+                            """解説から表面を作り直す: (表面, 解説なしか)"""
+                            is_missing_msg = (
+                                "解説が見つかりませんでした" in explanation_text
+                                or "解説情報がありませんでした" in explanation_text
+                                or "解説取得失敗" in explanation_text
+                            )
+                            has_sub_info = bool(article_text or point_text)
+
+                            final_exp = explanation_text
+                            if is_missing_msg and not has_sub_info:
+                                final_exp = "（公式に解説情報がありませんでした）"
+
+                            new_front, _ = generate_rewrite(
+                                "", final_exp, article_text, point_text
+                            )
+                            return new_front, is_missing_msg and not has_sub_info
 
                         def repair_single_card(target_info):
-                            """並列実行用関数"""
+                            """並列実行用関数: (番号, 更新項目, メッセージ, 成功, 解説なし)"""
                             idx, card = target_info
                             url = card.get("source")
+
+                            # 解説APIの HTML を保存してあれば、通信せずに作り直す
+                            # (作り直しても壊れたままなら、API だけを呼び直す)
+                            if has_fragments(card):
+                                new_front, is_unfixable = rebuild_front(
+                                    *render_fragments(card)
+                                )
+                                if is_unfixable or not is_broken({"front": new_front}):
+                                    return (
+                                        idx,
+                                        {"front": new_front},
+                                        f"再作成: {url}",
+                                        True,
+                                        is_unfixable,
+                                    )
+
                             if not url:
                                 return idx, None, "URLなし", False, False
 
-                            local_session = requests.Session()
-                            local_session.headers.update(
-                                {
-                                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-                                }
-                            )
-
                             max_retries = 5
                             for attempt in range(max_retries):
                                 try:
-                                    time.sleep(random.uniform(2.0, 5.0))
-                                    r = local_session.get(url, timeout=15)
-                                    if r.status_code == 200:
-                                        soup_r = BeautifulSoup(r.text, "html.parser")
-                                        q_div = soup_r.find("div", class_="q_body")
-                                        question_text = (
-                                            q_div.get_text(strip=True) if q_div else ""
+                                    (
+                                        status,
+                                        fields,
+                                        explanation_text,
+                                        article_text,
+                                        point_text,
+                                    ) = fetch_question(
+                                        crawler, url, card.get("q_id"), direct_api
+                                    )
+                                    # q_id が見つからなければ (解説取得失敗) 再試行する
+                                    if status == 200 and explanation_text != "解説取得失敗":
+                                        if (
+                                            "APIエラー" in explanation_text
+                                            or "通信エラー" in explanation_text
+                                        ):
+                                            continue
+
+                                        new_front, is_unfixable = rebuild_front(
+                                            explanation_text, article_text, point_text
+                                        )
+                                        # 問題IDと解説APIの HTML も保存する (次回は通信なしで直せる)
+                                        fields["front"] = new_front
+                                        return (
+                                            idx,
+                                            fields,
+                                            f"完了: {url}",
+                                            True,
+                                            is_unfixable,
+                                        )
+                                    elif status == 404:
+                                        front = card["front"] + "\n(ページが削除されています)"
+                                        return (
+                                            idx,
+                                            {"front": front},
+                                            "404 Not Found",
+                                            True,
+                                            True,
                                         )
-
-                                        q_id = None
-                                        inputs = soup_r.find_all("input", onclick=True)
-                                        for inp in inputs:
-                                            match = re.search(
-                                                r"answer\((\d+),", inp["onclick"]
-                                            )
-                                            if match:
-                                                q_id = match.group(1)
-                                                break
-
-                                        if q_id:
-                                            (
-                                                explanation_text,
-                                                article_text,
-                                                point_text,
-                                            ) = get_explanation(
-                                                local_session, q_id, url
-                                            )
-
-                                            if (
-                                                "APIエラー" in explanation_text
-                                                or "通信エラー" in explanation_text
-                                            ):
-                                                continue
-
-                                            is_missing_msg = (
-                                                "解説が見つかりませんでした"
-                                                in explanation_text
-                                                or "解説情報がありませんでした"
-                                                in explanation_text
-                                                or "解説取得失敗" in explanation_text
-                                            )
-                                            has_sub_info = bool(
-                                                article_text or point_text
-                                            )
-
-                                            final_exp = explanation_text
-                                            if is_missing_msg and not has_sub_info:
-                                                final_exp = "（公式に解説情報がありませんでした）"
-
-                                            new_front, _ = generate_rewrite(
-                                                question_text,
-                                                final_exp,
-                                                article_text,
-                                                point_text,
-                                            )
-                                            card["front"] = new_front
-
-                                            is_unfixable = (
-                                                is_missing_msg and not has_sub_info
-                                            )
-                                            return (
-                                                idx,
-                                                card,
-                                                f"完了: {url}",
-                                                True,
-                                                is_unfixable,
-                                            )
-                                        else:
-                                            pass
-                                    elif r.status_code == 404:
-                                        card["front"] += "\n(ページが削除されています)"
-                                        return idx, card, "404 Not Found", True, True
 
                                 except Exception:
                                     time.sleep(1)
 
                             return idx, None, f"失敗: {url}", False, False
 
-                        with concurrent.futures.ThreadPoolExecutor(
-                            max_workers=5
-                        ) as executor:
-                            target_infos = [(i, data[i].copy()) for i in targets]
-                            future_to_idx = {
-                                executor.submit(repair_single_card, info): info[0]
-                                for info in target_infos
-                            }
-
-                            for future in concurrent.futures.as_completed(
-                                future_to_idx
+                        # 取得の間隔はエンジンが守る (並列数を増やしても上限は超えない)
+                        with Crawler(
+                            rate=crawl_rate,
+                            burst=crawl_burst,
+                            jitter=crawl_jitter,
+                            concurrency=crawl_concurrency,
+                            shared_dir=CRAWL_STATE_DIR,
+                            archive=crawl_archive,
+                        ) as crawler:
+                            target_infos = [(i, data[i]) for i in targets]
+                            for _, result, error in crawler.map(
+                                repair_single_card, target_infos
                             ):
-                                idx, new_card, msg, success, unfixable = future.result()
+                                if error is not None:
+                                    result = (None, None, str(error), False, False)
+                                idx, fields, msg, success, unfixable = result
                                 count_processed += 1
                                 repair_bar.progress(count_processed / total_targets)
                                 status_repair.write(
@@ -558,26 +564,24 @@ with tab3:
                                 )
 
                                 if success:
-                                    if new_card:
-                                        data[idx] = new_card
+                                    if fields:
+                                        data[idx].update(fields)
+                                        journal.update(data[idx]["source"], fields)
                                     if unfixable:
                                         count_unfixable += 1
                                     else:
                                         count_fixed += 1
 
-                                if count_processed % 10 == 0:
+                                # 定期的にジャーナルをDBへ反映 (チェックポイント)
+                                if count_processed % CHECKPOINT_EVERY == 0:
                                     try:
-                                        with open(
-                                            SAVE_FILE, "w", encoding="utf-8"
-                                        ) as f:
-                                            json.dump(
-                                                data, f, ensure_ascii=False, indent=2
-                                            )
+                                        journal.sync()
+                                        card_store.checkpoint(SAVE_FILE)
                                     except Exception:
                                         pass
 
-                        with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                            json.dump(data, f, ensure_ascii=False, indent=2)
+                        journal.close()
+                        card_store.compact(SAVE_FILE)
 
                         st.success(
                             f"修復完了！ {count_fixed} 件を修正、{count_unfixable} 件を解説なしとしてマークしました。"
@@ -596,99 +600,87 @@ with tab3:
         st.warning(
             "すべてのデータを再取得して上書きします。完了まで非常に時間がかかります。途中で止める場合はブラウザを閉じてください。"
         )
+        st.info("解析の仕方を変えただけなら、下の「保存した応答から再解析」で足ります。")
         if st.button("🚨 全データを再取得・更新する"):
             if os.path.exists(SAVE_FILE):
                 try:
-                    data = load_data_with_retry(SAVE_FILE)
+                    data = load_data(SAVE_FILE)
 
                     # 全件対象
                     targets = list(range(len(data)))
 
                     count_updated = 0
+                    journal = JournalWriter(SAVE_FILE)
                     update_bar = st.progress(0)
                     status_update = st.empty()
 
-                    session_update = requests.Session()
-                    session_update.headers.update(
-                        {
-                            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-                        }
-                    )
-
-                    for idx, i in enumerate(targets):
-                        card = data[i]
-                        url = card.get("source")
-                        if url:
+                    def update_single_card(i):
+                        """並列実行用関数: 更新する項目 (取得できなければ None)"""
+                        url = data[i].get("source")
+                        if not url:
+                            return None
+                        # リトライロジック
+                        max_retries = 3
+                        for attempt in range(max_retries):
+                            try:
+                                (
+                                    status,
+                                    fields,
+                                    explanation_text,
+                                    article_text,
+                                    point_text,
+                                ) = fetch_question(
+                                    crawler, url, data[i].get("q_id"), direct_api
+                                )
+                                if status == 404:
+                                    return None
+                                # 成功したら更新 (ここで新しいMarkdown変換が適用される)
+                                if status == 200 and "解説取得失敗" not in explanation_text:
+                                    front, _ = generate_rewrite(
+                                        "",
+                                        explanation_text,  # Markdown変換済み
+                                        article_text,
+                                        point_text,
+                                    )
+                                    fields["front"] = front
+                                    return fields
+                            except Exception:
+                                time.sleep(1)
+                        return None
+
+                    with Crawler(
+                        rate=crawl_rate,
+                        burst=crawl_burst,
+                        jitter=crawl_jitter,
+                        concurrency=crawl_concurrency,
+                        shared_dir=CRAWL_STATE_DIR,
+                        archive=crawl_archive,
+                        timeout=10,
+                    ) as crawler:
+                        results = crawler.map(update_single_card, targets)
+                        for idx, (i, fields, error) in enumerate(results):
+                            url = data[i].get("source")
                             status_update.write(
                                 f"更新中 ({idx + 1}/{len(targets)}): {url}"
                             )
-                            # リトライロジック
-                            max_retries = 3
-                            for attempt in range(max_retries):
-                                try:
-                                    r = session_update.get(url, timeout=10)
-                                    if r.status_code == 200:
-                                        soup_r = BeautifulSoup(r.text, "html.parser")
-                                        q_div = soup_r.find("div", class_="q_body")
-                                        question_text = (
-                                            q_div.get_text(strip=True) if q_div else ""
-                                        )
+                            if error is None and fields is not None:
+                                data[i].update(fields)
+                                journal.update(url, fields)
+                                count_updated += 1
 
-                                        # q_id を取得
-                                        q_id = None
-                                        inputs = soup_r.find_all("input", onclick=True)
-                                        for inp in inputs:
-                                            match = re.search(
-                                                r"answer\((\d+),", inp["onclick"]
-                                            )
-                                            if match:
-                                                q_id = match.group(1)
-                                                break
-
-                                        if q_id:
-                                            # 解説を再取得 (ここで新しいMarkdown変換が適用される)
-                                            (
-                                                explanation_text,
-                                                article_text,
-                                                point_text,
-                                            ) = get_explanation(
-                                                session_update, q_id, url
-                                            )
-
-                                            # 成功したら更新
-                                            if "解説取得失敗" not in explanation_text:
-                                                front, _ = generate_rewrite(
-                                                    question_text,
-                                                    explanation_text,  # Markdown変換済み
-                                                    article_text,
-                                                    point_text,
-                                                )
-                                                data[i]["front"] = front
-                                                count_updated += 1
-                                                break
-
-                                    elif r.status_code == 404:
-                                        break
+                            update_bar.progress((idx + 1) / len(targets))
 
+                            # 定期的にジャーナルをDBへ反映 (チェックポイント)
+                            if (idx + 1) % CHECKPOINT_EVERY == 0:
+                                try:
+                                    journal.sync()
+                                    card_store.checkpoint(SAVE_FILE)
                                 except Exception:
-                                    # print(f"Error attempt {attempt}: {e}")
-                                    time.sleep(1)
-
-                        update_bar.progress((idx + 1) / len(targets))
-
-                        # 中間保存 (10件ごと)
-                        if (idx + 1) % 10 == 0:
-                            try:
-                                with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                                    json.dump(data, f, ensure_ascii=False, indent=2)
-                            except Exception:
-                                pass
-
-                        time.sleep(0.5)  # 負荷軽減
+                                    pass
 
                     # 最終保存
-                    with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2)
+                    journal.close()
+                    card_store.compact(SAVE_FILE)
 
                     st.success(
                         f"全データの更新が完了しました！ ({count_updated} 件更新)"
@@ -701,26 +693,59 @@ with tab3:
             else:
                 st.warning("データファイルがありません。")
 
-    if st.button("全自動スクレイピング開始", key="bulk_start"):
-        session = requests.Session()
-        session.headers.update(
-            {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
+    # 保存した応答からの再解析 (サイトには接続しない)
+    st.markdown("---")
+    with st.expander("♻️ 保存した応答から再解析 (通信なし)"):
+        st.info(
+            "取得時に保存した応答 (問題ページ・解説API) から全カードを作り直します。"
+            "保存していないカードはそのままです。"
+        )
+        reparse_processes = st.number_input(
+            "同時に解析するプロセス数",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=os.cpu_count() or 1,
         )
+        if st.button("♻️ 再解析を開始"):
+            if not os.path.exists(archive_path(SAVE_FILE)):
+                st.warning("保存した応答がありません。")
+            else:
+                reparse_bar = st.progress(0)
+                t0 = time.monotonic()
+                try:
+                    result = reparse(
+                        SAVE_FILE,
+                        int(reparse_processes),
+                        progress=lambda n, total: reparse_bar.progress(n / total),
+                    )
+                    st.success(
+                        f"再解析が完了しました ({time.monotonic() - t0:.1f} 秒): "
+                        f"{result['cards']} 枚中 {result['updated']} 枚を更新、"
+                        f"応答が保存されていないカード {result['missing']} 枚"
+                    )
+                except Exception as e:
+                    st.error(f"再解析中にエラーが発生しました: {e}")
 
-        # 既存データ読み込み
-        all_cards = []
-        if os.path.exists(SAVE_FILE):
-            try:
-                all_cards = load_data_with_retry(SAVE_FILE)
-            except Exception:
-                pass
+    if st.button("全自動スクレイピング開始", key="bulk_start"):
+        # 取得の間隔はエンジンが守る (全自動は専用の上限を使う)
+        crawler = Crawler(
+            rate=bulk_rate,
+            burst=crawl_burst,
+            jitter=crawl_jitter,
+            concurrency=crawl_concurrency,
+            shared_dir=CRAWL_STATE_DIR,
+            archive=crawl_archive,
+        )
 
-        existing_urls = set([c.get("source") for c in all_cards])
+        # 既存データの重複チェック用 (source の索引で判定)
+        store = card_store.open_store(SAVE_FILE)
+        existing_urls = set()
 
         stop_button = stop_placeholder.button("⛔ 停止する", key="stop_bulk")
 
+        # 新規カードはジャーナルへ追記する (全体の書き直しはしない)
+        journal = JournalWriter(SAVE_FILE)
+
         try:
             # APIエラーカウンター初期化
             api_error_count = 0
@@ -732,8 +757,11 @@ with tab3:
                 while True:  # ページループ
                     # 進捗保存
                     try:
-                        with open(bulk_progress_file, "w", encoding="utf-8") as f:
-                            json.dump({"subject": subject_id, "page": page}, f)
+                        atomic_write_json(
+                            bulk_progress_file,
+                            {"subject": subject_id, "page": page},
+                            indent=None,
+                        )
                     except Exception:
                         pass
 
@@ -743,7 +771,7 @@ with tab3:
                     status_text.text(f"巡回中... 科目ID: {subject_id}, ページ: {page}")
 
                     # リストページ取得
-                    resp = session.get(list_url)
+                    resp = crawler.get(list_url)
                     if resp.status_code != 200:
                         st.error(f"ページ取得エラー: {list_url}")
                         break
@@ -767,7 +795,9 @@ with tab3:
                             if link_tag:
                                 href = link_tag.get("href")
                                 full_url = urljoin(list_url, href)
-                                if full_url not in existing_urls:
+                                if full_url not in existing_urls and not (
+                                    card_store.has_source(store, full_url)
+                                ):
                                     page_items.append(
                                         {
                                             "url": full_url,
@@ -783,78 +813,28 @@ with tab3:
                         )
                         break
 
-                    # 各問題をスクレイピング
-                    for i, item in enumerate(page_items):
-                        # ランダム待機 (Bot対策)
-                        sleep_time = random.uniform(wait_min, wait_max)
-                        status_text.info(f"待機中... {sleep_time:.1f}秒 (Bot回避用)")
-                        time.sleep(sleep_time)
-
-                        full_link = item["url"]
+                    # 各問題を並行にスクレイピングし、一覧の順に保存する
+                    results = crawler.map(
+                        lambda item: scrape_card(crawler, item, direct_api),
+                        page_items,
+                        ordered=True,
+                    )
+                    for i, (item, new_card, error) in enumerate(results):
                         status_text.write(
-                            f"[{subject_name}] P.{page} ({i + 1}/{len(page_items)}) 取得中"
+                            f"[{subject_name}] P.{page} "
+                            f"({i + 1}/{len(page_items)}) 取得中 "
+                            f"(実際の速さ {crawler.stats()['rate']:.2f} 件/秒)"
                         )
+                        if error is not None:
+                            st.write(f"エラースキップ: {error}")
+                            continue
 
-                        # 詳細ページ
+                        # 保存 (ジャーナルへ追記)
                         try:
-                            q_resp = session.get(full_link)
-                            q_soup = BeautifulSoup(q_resp.text, "html.parser")
-
-                            q_div = q_soup.find("div", class_="q_body")
-                            question_text = (
-                                q_div.get_text(strip=True) if q_div else "取得失敗"
-                            )
-
-                            q_id = None
-                            inputs = q_soup.find_all("input", onclick=True)
-                            for inp in inputs:
-                                match = re.search(r"answer\((\d+),", inp["onclick"])
-                                if match:
-                                    q_id = match.group(1)
-                                    break
-
-                            explanation_text = "解説取得失敗"
-                            article_text = ""
-                            point_text = ""
-
-                            if q_id:
-                                explanation_text, article_text, point_text = (
-                                    get_explanation(session, q_id, full_link)
-                                )
-
-                            # AIなし、直接結合
-                            front, _ = generate_rewrite(
-                                question_text,
-                                explanation_text,
-                                article_text,
-                                point_text,
-                            )
-                            # 裏面はソースURL
-                            back = full_link
-
-                            new_card = {
-                                "front": front,
-                                "back": back,
-                                "source": full_link,
-                                "subject": item["subject"],
-                                "level": item["level"],
-                            }
-                            # 保存 (他プロセスでの変更を反映するため、都度読み込んで保存)
-                            try:
-                                current_data = load_data_with_retry(SAVE_FILE)
-                                current_data.append(new_card)
-                                with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                                    json.dump(
-                                        current_data, f, ensure_ascii=False, indent=2
-                                    )
-                                # メモリ上のリストも更新(念のため)
-                                all_cards = current_data
-                            except Exception as e:
-                                st.error(f"保存エラー: {e}")
-
+                            journal.append(new_card)
+                            existing_urls.add(item["url"])
                         except Exception as e:
-                            st.write(f"エラースキップ: {e}")
-                            continue
+                            st.error(f"保存エラー: {e}")
 
                     # 次のページへ
                     next_link = soup.find("a", string=re.compile("次へ"))
@@ -865,7 +845,6 @@ with tab3:
                         break
 
                     page += 1
-                    time.sleep(random.uniform(2.0, 4.0))
 
                 # 科目ループ終わり
                 if stop_every_subject:
@@ -878,14 +857,26 @@ with tab3:
 
         except Exception as e:
             st.error(f"予期せぬエラーで停止しました: {e}")
+        finally:
+            crawler.close()
+            # ジャーナルをスナップショットへ畳み込む
+            journal.close()
+            store.close()
+            try:
+                card_store.compact(SAVE_FILE)
+            except Exception as e:
+                st.error(f"ジャーナルの畳み込みに失敗しました: {e}")
 
 with tab1:
     if st.button("作成開始", key="start_btn"):
-        session = requests.Session()
-        session.headers.update(
-            {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 ... Chrome/91.0.4472.124"
-            }
+        # 取得の間隔と User-Agent はエンジン側で管理する
+        crawler = Crawler(
+            rate=crawl_rate,
+            burst=crawl_burst,
+            jitter=crawl_jitter,
+            concurrency=crawl_concurrency,
+            shared_dir=CRAWL_STATE_DIR,
+            archive=crawl_archive,
         )
 
         # UI Cleanup
@@ -894,18 +885,12 @@ with tab1:
         log_expander = st.expander("詳細ログを表示", expanded=False)
         status_area = log_expander.empty()
 
-        # 既存データを読み込む
-        cards = []
-        if os.path.exists(SAVE_FILE):
-            try:
-                cards = load_data_with_retry(SAVE_FILE)
-            except Exception:
-                pass
+        journal = JournalWriter(SAVE_FILE)
 
         try:
             # 1. リストページからリンクを取得
             status_area.write(f"リストページを取得中: {target_url}")
-            resp = session.get(target_url)
+            resp = crawler.get(target_url)
             soup = BeautifulSoup(resp.text, "html.parser")
 
             page_title = soup.title.get_text(strip=True) if soup.title else "不明な科目"
@@ -941,65 +926,24 @@ with tab1:
             st.write(f"見つかった問題: {len(unique_data)} 件")
             targets_to_scrape = unique_data[:max_count]
 
-            for i, item in enumerate(targets_to_scrape):
-                full_link = item["url"]
-                level = item["level"]
-                subject = item["subject"]
-
-                if i > 0:
-                    wait_time = random.uniform(sleep_min, sleep_max)
-                    status_area.write(f"待機中... ({wait_time:.1f}s)")
-                    time.sleep(wait_time)
-
+            # 2. 詳細ページを並行に取得し、一覧の順に保存する
+            results = crawler.map(
+                lambda item: scrape_card(crawler, item, direct_api),
+                targets_to_scrape,
+                ordered=True,
+            )
+            for i, (item, new_card, error) in enumerate(results):
                 status_area.write(
-                    f"処理中 ({i + 1}/{len(targets_to_scrape)}): {full_link} (ランク: {level})"
+                    f"処理中 ({i + 1}/{len(targets_to_scrape)}): {item['url']} "
+                    f"(ランク: {item['level']}, "
+                    f"実際の速さ {crawler.stats()['rate']:.2f} 件/秒)"
                 )
+                if error is not None:
+                    st.error(f"取得エラー ({item['url']}): {error}")
+                    continue
 
-                # 2. 詳細ページ取得
-                q_resp = session.get(full_link)
-                q_soup = BeautifulSoup(q_resp.text, "html.parser")
-
-                q_div = q_soup.find("div", class_="q_body")
-                question_text = (
-                    q_div.get_text(strip=True) if q_div else "問題文取得失敗"
-                )
-
-                q_id = None
-                inputs = q_soup.find_all("input", onclick=True)
-                for inp in inputs:
-                    match = re.search(r"answer\((\d+),", inp["onclick"])
-                    if match:
-                        q_id = match.group(1)
-                        break
-
-                explanation_text = "解説取得失敗"
-                article_text = ""
-                point_text = ""
-
-                if q_id:
-                    explanation_text, article_text, point_text = get_explanation(
-                        session, q_id, full_link
-                    )
-
-                # 4. 生成 (AIなし)
-                front, _ = generate_rewrite(
-                    question_text, explanation_text, article_text, point_text
-                )
-                back = full_link
-
-                new_card = {
-                    "front": front,
-                    "back": back,
-                    "source": full_link,
-                    "subject": subject,
-                    "level": level,
-                }
                 try:
-                    current_cards = load_data_with_retry(SAVE_FILE)
-                    current_cards.append(new_card)
-                    with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                        json.dump(current_cards, f, ensure_ascii=False, indent=2)
-                    cards = current_cards
+                    journal.append(new_card)
                 except Exception as e:
                     st.error(f"保存エラー: {e}")
 
@@ -1011,173 +955,217 @@ with tab1:
 
         except Exception as e:
             st.error(f"エラーが発生しました: {e}")
+        finally:
+            crawler.close()
+            journal.close()
+            card_store.compact(SAVE_FILE)
 
 with tab2:
     st.header("📂 保存データ確認 (フラッシュカードモード)")
-    if os.path.exists(SAVE_FILE):
+    if os.path.exists(SAVE_FILE) or os.path.exists(card_store.db_path(SAVE_FILE)):
         try:
-            all_data = load_data_with_retry(SAVE_FILE)
+            store = card_store.open_store(SAVE_FILE)
+            query = st.text_input(
+                "🔎 キーワード検索 (表面・裏面の全文)", placeholder="例: 育児休業"
+            )
+            if query != st.session_state.get("search_query", ""):
+                st.session_state.search_query = query
+                st.session_state.card_idx = 0
+                st.session_state.is_flipped = False
+            # 最新の内容を mmap インデックスとして開く (本文は表示する分だけ展開)
+            # インデックスは全セッションで共有し、ストアが更新されるまで開き直さない
+            if query.strip():
+                # 検索索引も追加・修復されたカードの分だけ更新する
+                card_index, search_index = card_store.refresh_search_index(
+                    store, SAVE_FILE
+                )
+            else:
+                card_index = card_store.open_card_index(store, SAVE_FILE)
+            store.close()
+            total_count = len(card_index)
 
-            if not all_data:
+            if not total_count:
                 st.warning("データが空です。")
             else:
                 # --- フィルタリング機能 (メインエリア配置) ---
                 with st.expander("🔍 絞り込み検索 (科目・難易度)", expanded=False):
-                    # 1. 科目フィルタ
-                    available_subjects = sorted(
-                        list(set([d.get("subject", "不明") for d in all_data]))
-                    )
+                    # 1. 科目フィルタ (選択肢の横に枚数を表示)
+                    subject_counts = card_index.facet_counts("subject")
+                    available_subjects = list(subject_counts)
                     selected_subjects = st.multiselect(
                         "科目で絞り込み",
                         options=available_subjects,
                         default=available_subjects,
+                        format_func=lambda s: f"{s} ({subject_counts[s]})",
                     )
 
-                    # 2. 難易度フィルタ
-                    available_levels = sorted(
-                        list(set([d.get("level", "不明") for d in all_data]))
+                    # 2. 難易度フィルタ (枚数は選択中の科目の中での枚数)
+                    available_levels = card_index.values("level")
+                    level_counts = card_index.facet_counts(
+                        "level", subjects=selected_subjects
                     )
                     selected_levels = st.multiselect(
                         "難易度で絞り込み",
                         options=available_levels,
                         default=available_levels,
+                        format_func=lambda lv: f"{lv} ({level_counts.get(lv, 0)})",
                     )
 
-                # フィルタリング実行 (AND条件)
-                saved_data = [
-                    d
-                    for d in all_data
-                    if d.get("level", "不明") in selected_levels
-                    and d.get("subject", "不明") in selected_subjects
-                ]
+                    # 科目 (行) × 難易度 (列) の枚数
+                    st.dataframe(
+                        card_index.cross_counts("level", "subject"),
+                        use_container_width=True,
+                    )
+
+                # フィルタリング実行 (AND条件、インデックスのコード列だけで判定)
+                saved_data = card_index.filter(
+                    subjects=selected_subjects, levels=selected_levels
+                )
+
+                # キーワード検索 (絞り込み結果の中から関連度順に表示)
+                if query.strip():
+                    saved_data, hit_count = search_index.search(
+                        query, card_index, positions=saved_data, limit=SEARCH_LIMIT
+                    )
+                    st.caption(
+                        f"「{query}」: {hit_count} 件中、上位 {len(saved_data)} 件"
+                    )
 
                 # --- Anki用エクスポート (Mobile対応) ---
                 st.sidebar.markdown("---")
                 st.sidebar.markdown("### 📱 スマホ学習用 (Anki)")
                 if saved_data:
                     # CSV作成 (Front, Back, Tag)
-                    csv_lines = []
-                    for d in saved_data:
-                        # 改行を<br>に置換 (Anki仕様)
-                        f_txt = (
-                            d.get("front", "").replace("\n", "<br>").replace('"', '""')
+                    # ボタンが押されたときだけファイルに書き出し、同じ絞り込み結果なら使い回す
+                    csv_path = card_export.cached_csv(
+                        SAVE_FILE, card_index, saved_data, bom=True
+                    )
+                    if csv_path is None and st.sidebar.button("📦 Anki用CSVを作成"):
+                        with st.spinner("CSVを作成しています..."):
+                            csv_path = card_export.build_csv(
+                                SAVE_FILE, card_index, saved_data, bom=True
+                            )
+                    if csv_path is not None:
+                        with open(csv_path, "rb") as f:
+                            st.sidebar.download_button(
+                                label="Anki用CSVをダウンロード",
+                                data=f,  # BOM付きUTF-8
+                                file_name="anki_cards.csv",
+                                mime="text/csv",
+                                help="AnkiDroid(Android)やAnkiMobile(iPhone)にインポートして使えます。文字化け防止のためBOM付きUTF-8で出力します。",
+                            )
+
+                    # Anki デッキ (.apkg): タグ付き、再インポートで重複せず更新される
+                    # バックグラウンドで作成するので、作成中もカードを操作できる
+                    apkg = card_apkg.apkg_job(SAVE_FILE, card_index, saved_data)
+                    if apkg is None and st.sidebar.button("🗂️ Ankiデッキ(.apkg)を作成"):
+                        apkg = card_apkg.start_apkg_export(
+                            SAVE_FILE, card_index, saved_data, DECK_NAME
                         )
-                        b_txt = (
-                            d.get("back", "").replace("\n", "<br>").replace('"', '""')
+                    if apkg is not None:
+                        if apkg.error:
+                            st.sidebar.error(f"デッキの作成に失敗しました: {apkg.error}")
+                        elif not apkg.finished:
+                            st.sidebar.progress(
+                                apkg.done / max(1, apkg.total),
+                                text=f"デッキを作成中... ({apkg.done} / {apkg.total})",
+                            )
+                            st.sidebar.button("🔄 状態を更新")
+                        else:
+                            with open(apkg.path, "rb") as f:
+                                st.sidebar.download_button(
+                                    label="Ankiデッキ(.apkg)をダウンロード",
+                                    data=f,
+                                    file_name="sharousi.apkg",
+                                    mime="application/octet-stream",
+                                )
+
+                # オフライン学習用バンドル (全カード、絞り込みは端末側で行う)
+                # 静的サイトとして置けば、PC やトンネルがなくても学習できる
+                bundle_zip = card_bundle.cached_bundle(SAVE_FILE, card_index)
+                if bundle_zip is None and st.sidebar.button(
+                    "📴 オフライン学習用バンドルを作成"
+                ):
+                    with st.spinner("バンドルを作成しています..."):
+                        bundle = card_bundle.build_bundle(
+                            SAVE_FILE, DECK_NAME, snapshot=card_index
+                        )
+                        bundle_zip = card_bundle.zip_bundle(bundle)
+                if bundle_zip is not None:
+                    with open(bundle_zip, "rb") as f:
+                        st.sidebar.download_button(
+                            label="オフライン学習用バンドル(.zip)をダウンロード",
+                            data=f,
+                            file_name="sharousi_bundle.zip",
+                            mime="application/zip",
+                            help="展開したフォルダを静的サイト (GitHub Pages など) に置いてスマホで一度開くと、以後はオフラインでも学習できます。",
                         )
-                        tag = f"{d.get('subject', '不明')} {d.get('level', '-')}"
-                        # CSV format: "Front","Back","Tag"
-                        line = f'"{f_txt}","{b_txt}","{tag}"'
-                        csv_lines.append(line)
-
-                    csv_data = "\n".join(csv_lines)
-
-                    st.sidebar.download_button(
-                        label="Anki用CSVをダウンロード",
-                        data=csv_data.encode("utf-8-sig"),  # BOM付きUTF-8
-                        file_name="anki_cards.csv",
-                        mime="text/csv",
-                        help="AnkiDroid(Android)やAnkiMobile(iPhone)にインポートして使えます。文字化け防止のためBOM付きUTF-8で出力します。",
-                    )
 
-                st.caption(f"全 {len(all_data)} 件中、{len(saved_data)} 件を表示中")
+                st.caption(f"全 {total_count} 件中、{len(saved_data)} 件を表示中")
 
                 # --- 表示モード切り替え ---
                 view_mode = st.radio(
                     "表示モード",
-                    ["カードモード (1枚ずつ)", "一覧表示モード (リスト)"],
+                    [
+                        "デッキモード (ブラウザで操作)",
+                        "カードモード (1枚ずつ)",
+                        "一覧表示モード (リスト)",
+                    ],
                     horizontal=True,
                 )
 
-                if view_mode == "カードモード (1枚ずつ)":
+                if view_mode == "デッキモード (ブラウザで操作)":
                     if not saved_data:
                         st.warning("条件に一致するカードがありません。")
                     else:
-                        # --- Session State 初期化 ---
-                        if "card_idx" not in st.session_state:
-                            st.session_state.card_idx = 0
-                        if "is_flipped" not in st.session_state:
-                            st.session_state.is_flipped = False
-
-                        # 範囲チェック
-                        if st.session_state.card_idx >= len(saved_data):
-                            st.session_state.card_idx = 0
-
-                        # 現在のカードデータを取得
-                        card = saved_data[st.session_state.card_idx]
-
-                        # メタデータ取得
-                        subject_info = card.get("subject", "不明")
-                        level_info = card.get("level", "-")
-
-                        front_text = card["front"]
-                        back_text = card["back"]
-                        # source_url = card.get("source", "")
-
-                        # エラー時のフォールバック
-                        if (
-                            front_text.startswith("AI生成エラー")
-                            or "AI生成エラー" in front_text
-                        ):
-                            pass
-
-                        # --- 画面レイアウト ---
-                        # ヘッダーに科目とレベルを表示
-                        st.markdown(f"#### 🏷️ {subject_info} / ランク: {level_info}")
-                        st.markdown(
-                            f"**No. {st.session_state.card_idx + 1} / {len(saved_data)}**"
+                        # めくる・移動はブラウザの中だけで行う (1枚ごとの通信がない)
+
+                        def load_page(start, stop):
+                            page = []
+                            for n in range(start, stop):
+                                pos = saved_data[n]
+                                subject, level, _ = card_index.meta(pos)
+                                label = f"🏷️ {subject} / ランク: {level}"
+                                card = card_index.card(pos)
+                                page.append(deck_card(card, n + 1, pos, label))
+                            return page
+
+                        results = card_deck(
+                            load_page,
+                            len(saved_data),
+                            card_export.export_key(card_index, saved_data),
                         )
+                        if results:
+                            right = sum(1 for v in results.values() if v)
+                            st.caption(
+                                f"記録: ○ 覚えた {right} 枚 / "
+                                f"✖ 要復習 {len(results) - right} 枚"
+                            )
 
-                        new_index = st.slider(
-                            "カード移動",
-                            min_value=1,
-                            max_value=len(saved_data),
-                            value=st.session_state.card_idx + 1,
-                            label_visibility="collapsed",
-                        )
-                        # スライダー操作でインデックス変更
-                        if new_index - 1 != st.session_state.card_idx:
-                            st.session_state.card_idx = new_index - 1
-                            st.session_state.is_flipped = False
-                            st.rerun()
-
-                        # カード表示エリア
-                        card_container = st.container(border=True)
-                        with card_container:
-                            if st.session_state.is_flipped:
-                                st.markdown("### 💡 ソースURL (裏面)")
-                                st.code(back_text, language=None)
-                                st.link_button("元サイトを開く", back_text)
-                            else:
-                                st.markdown("### 📝 カード内容 (表面)")
-                                st.markdown(front_text)
-
-                        # 操作ボタン (3カラム)
-                        col_prev, col_flip, col_next = st.columns([1, 2, 1])
-
-                        with col_prev:
-                            if st.button("⬅️ 前へ"):
-                                st.session_state.card_idx = max(
-                                    0, st.session_state.card_idx - 1
-                                )
-                                st.session_state.is_flipped = False
-                                st.rerun()
-
-                        with col_flip:
-                            button_label = "答えを見る / 戻る 🔄"
-                            if st.button(button_label, use_container_width=True):
-                                st.session_state.is_flipped = (
-                                    not st.session_state.is_flipped
-                                )
-                                st.rerun()
+                elif view_mode == "カードモード (1枚ずつ)":
+                    if not saved_data:
+                        st.warning("条件に一致するカードがありません。")
+                    else:
+                        # 前後のカードを描画しておくキャッシュ (セッションごと)
+                        if "render_cache" not in st.session_state:
+                            st.session_state.render_cache = RenderCache()
+                        render_cache = st.session_state.render_cache
+                        with st.sidebar.expander("⚡ 先読み設定"):
+                            cache_size = st.number_input(
+                                "キャッシュする枚数", 4, 512, value=RENDER_CACHE_SIZE
+                            )
+                            radius = st.number_input(
+                                "前後に先読みする枚数", 0, 20, value=PREFETCH_RADIUS
+                            )
+                            render_cache.resize(cache_size, radius)
+                            info = render_cache.stats()
+                            st.caption(
+                                f"描画済み {info['count']} / {info['size']} 枚 "
+                                f"(ヒット {info['hits']} 回 / 描画 {info['misses']} 回)"
+                            )
 
-                        with col_next:
-                            if st.button("次へ ➡️"):
-                                st.session_state.card_idx = min(
-                                    len(saved_data) - 1, st.session_state.card_idx + 1
-                                )
-                                st.session_state.is_flipped = False
-                                st.rerun()
+                        # 操作してもこの部分だけが再実行される (st.fragment)
+                        card_viewer(card_index, saved_data, render_cache)
 
                 else:
                     # --- 一覧表示モード ---
@@ -1210,7 +1198,9 @@ with tab2:
                         start_idx = (st.session_state.list_page - 1) * items_per_page
                         end_idx = min(start_idx + items_per_page, len(saved_data))
 
-                        current_batch = saved_data[start_idx:end_idx]
+                        current_batch = [
+                            card_index.card(i) for i in saved_data[start_idx:end_idx]
+                        ]
 
                         for i, d in enumerate(current_batch):
                             global_idx = start_idx + i + 1
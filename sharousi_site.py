@@ -0,0 +1,394 @@
+import concurrent.futures
+import os
+import re
+import sys
+import time
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup
+
+import card_store
+from card_journal import JournalWriter
+from http_archive import HttpArchive, archive_path
+
+# 社労士過去問サイト (sharousi-kakomon.com) の取得と解析
+# scraper_sharousi_app.py と、保存した応答からの再解析 (reparse) で使う。
+# Streamlit には依存しないので、別プロセス (ProcessPoolExecutor) からも読み込める。
+
+# 問題ページの URL (/q/<年>/0/<問>/<肢>) と解説 API の問題ID の対応
+# 例: /q/2018/0/10/c -> 20181003 (年 + 問の番号2桁 + 肢の番号2桁)
+QUESTION_URL = re.compile(r"^/q/(\d{4})/0/(\d{1,2})/([a-e])/?$")
+
+SITE_HOST = "sharousi-kakomon.com"
+API_URL = "https://sharousi-kakomon.com/q/check_q_a.php"
+
+# 解説APIの応答からカードに保存する要素 (div の class) と、カードの項目名
+FRAGMENT_FIELDS = {
+    "kaisetu": "kaisetu_html",
+    "joubun": "joubun_html",
+    "point": "point_html",
+}
+
+
+def parse_html_text(element):
+    """
+    HTML要素からテキストを抽出し、赤文字・緑文字をStreamlitのMarkdown記法に変換する
+    """
+    if not element:
+        return ""
+
+    text = ""
+    for child in element.contents:
+        if child.name is None:  # Text Node
+            text += child.string if child.string else ""
+        elif child.name == "br":
+            text += "\n"
+        else:
+            # Recursive parse
+            inner_text = parse_html_text(child)
+
+            # Check color
+            color = ""
+            cls = child.get("class", [])
+            if isinstance(cls, str):
+                cls = [cls]
+
+            style = child.get("style", "").lower()
+
+            # 赤・緑の判定 (クラス名やスタイル)
+            # 判明しているクラス: clr2 -> 赤
+            styles_str = style.lower()
+            classes_set = set([c.lower() for c in cls])
+
+            if (
+                "clr2" in classes_set
+                or any("red" in c for c in classes_set)
+                or "color:red" in styles_str
+                or "color: red" in styles_str
+                or "#ff0000" in styles_str
+            ):
+                color = "red"
+            elif (
+                any("green" in c for c in classes_set)
+                or "color:green" in styles_str
+                or "color: green" in styles_str
+            ):
+                color = "green"
+
+            # テーブルが含まれている場合（Markdownのセパレータ等で判定）、色指定で囲むと崩れるのでスキップ
+            if "| --- |" in inner_text or "\n| " in inner_text:
+                color = ""  # 強制的に無効化
+
+            if color:
+                text += f":{color}[{inner_text}]"
+            else:
+                text += inner_text
+
+    return text
+
+
+def get_fragments(session, q_id, referer_url):
+    """
+    APIを叩いて解説・条文・ポイントの要素の HTML を取得する
+    戻り値: ({カードの項目名: HTML}, None)、取得できなければ (None, エラーメッセージ)
+    要素がない項目は空文字列になる
+    """
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
+        "X-Requested-With": "XMLHttpRequest",
+        "Origin": "https://sharousi-kakomon.com",
+        "Referer": referer_url,
+    }
+
+    try:
+        # タイムアウト延長
+        resp = session.post(API_URL, headers=headers, data=api_data(q_id), timeout=15)
+        if resp.status_code != 200:
+            return None, f"APIエラー: {resp.status_code}"
+    except Exception as e:
+        return None, f"通信エラー: {e}"
+    return parse_fragments(resp.text, q_id)
+
+
+def api_data(q_id):
+    """解説APIに送るデータ"""
+    return {"q": q_id, "a": "1"}  # 1=Maru, 0=Batsu (Either returns explanation)
+
+
+def parse_fragments(text, q_id):
+    """解説APIの応答 (HTML) から要素を取り出す (戻り値は get_fragments と同じ)"""
+    soup = BeautifulSoup(text, "html.parser")
+    divs = {name: soup.find("div", class_=name) for name in FRAGMENT_FIELDS}
+
+    # 条文の要素の id には問題IDが入る (別の問題の解説なら不正とする)
+    joubun_id = divs["joubun"].get("id") if divs["joubun"] else None
+    if joubun_id and joubun_id != f"joubun{q_id}":
+        return None, "APIエラー: 問題IDが一致しません"
+
+    # 何も取得できなかった場合は、APIレスポンス不正の可能性がある
+    # (十分な長さがあるなら「解説なし」かもしれないので、そのまま保存する)
+    if not any(divs.values()) and len(text) < 50:
+        return None, "APIエラー: レスポンス不正(Empty)"
+
+    return {
+        field: str(divs[name]) if divs[name] else ""
+        for name, field in FRAGMENT_FIELDS.items()
+    }, None
+
+
+def render_fragments(fragments):
+    """保存した要素の HTML から (解説, 条文, ポイント) のテキストを作る (通信しない)"""
+    texts = {}
+    for name, field in FRAGMENT_FIELDS.items():
+        html_text = fragments.get(field)
+        div = BeautifulSoup(html_text, "html.parser").div if html_text else None
+        texts[name] = parse_html_text(div).strip() if div else None
+    if texts["kaisetu"] is None:
+        texts["kaisetu"] = "解説が見つかりませんでした"
+    return texts["kaisetu"], texts["joubun"] or "", texts["point"] or ""
+
+
+def confirmed_q_id(fragments, q_id):
+    """解説APIの要素が q_id の問題のものと確かめられるか (条文の要素の id で確かめる)"""
+    return f'id="joubun{q_id}"' in (fragments.get("joubun_html") or "")
+
+
+def has_fragments(card):
+    """解説APIの HTML を保存してあるカードか"""
+    return all(field in card for field in FRAGMENT_FIELDS.values())
+
+
+def q_id_from_url(url):
+    """問題ページの URL から解説 API の問題IDを求める (対応しない形なら None)"""
+    match = QUESTION_URL.match(urlsplit(url).path)
+    if not match:
+        return None
+    year, number, choice = match.groups()
+    return f"{year}{int(number):02d}{'abcde'.index(choice) + 1:02d}"
+
+
+def q_id_from_page(soup):
+    """問題ページの回答ボタン (onclick="answer(問題ID, ...)") から問題IDを読み取る"""
+    for inp in soup.find_all("input", onclick=True):
+        match = re.search(r"answer\((\d+),", inp["onclick"])
+        if match:
+            return match.group(1)
+    return None
+
+
+def fetch_question(crawler, url, q_id=None, direct=True):
+    """
+    解説APIから (ステータスコード, カードに保存する項目, 解説, 条文, ポイント) を取得する
+    保存する項目は問題ID (q_id)、問題文 (question, 問題ページを取得した場合のみ) と
+    解説APIの要素の HTML (FRAGMENT_FIELDS)
+    q_id (保存してある問題ID) を渡すか direct=True の場合は、q_id (なければ URL から
+    求めたもの) で API だけを呼び、求められないか応答がその問題のものと確かめられ
+    なければ (条文の id が一致しなければ) 問題ページを取得して問題IDを読み取る
+    保存する問題IDと解説は、確かめられたもの (条文の id が一致したか、問題ページから
+    読み取った問題IDのもの) だけ (別の問題の解説や間違った ID を保存しない)
+    問題IDが見つからなければ解説は "解説取得失敗"、API が失敗すればそのエラーメッセージ
+    (ワーカースレッドから呼ぶので Streamlit の表示はしない)
+    """
+    fragments = error = None
+    if q_id or direct:
+        q_id = q_id or q_id_from_url(url)
+        if q_id:
+            fragments, error = get_fragments(crawler, q_id, url)
+            if fragments is not None and confirmed_q_id(fragments, q_id):
+                fields = {"q_id": q_id, **fragments}
+                return 200, fields, *render_fragments(fragments)
+
+    r = crawler.get(url)
+    if r.status_code != 200:
+        return r.status_code, {}, "解説取得失敗", "", ""
+    soup = BeautifulSoup(r.text, "html.parser")
+    page_q_id = q_id_from_page(soup)
+    if not page_q_id:
+        return r.status_code, {}, "解説取得失敗", "", ""
+    fields = {"q_id": page_q_id}
+    q_div = soup.find("div", class_="q_body")
+    if q_div:
+        fields["question"] = q_div.get_text(strip=True)
+
+    # 先に呼んだ問題IDと同じなら、API の結果 (失敗や条文なし) は問題IDのせいではない
+    # ので呼び直さない (問題ページで問題IDを確かめたので、その解説を保存してよい)
+    if page_q_id != q_id or (fragments is None and error is None):
+        fragments, error = get_fragments(crawler, page_q_id, url)
+    if fragments is None:
+        return r.status_code, fields, error, "", ""
+    fields.update(fragments)
+    return r.status_code, fields, *render_fragments(fragments)
+
+
+def scrape_card(crawler, item, direct=True):
+    """一覧の1行 (url, level, subject) からカードを作る (ワーカースレッドで実行)"""
+    full_link = item["url"]
+    _, fields, explanation_text, article_text, point_text = fetch_question(
+        crawler, full_link, direct=direct
+    )
+
+    # AIなし、直接結合 (表面に問題文は使わない)
+    front, _ = generate_rewrite("", explanation_text, article_text, point_text)
+    # 裏面はソースURL
+    card = {
+        "front": front,
+        "back": full_link,
+        "source": full_link,
+        "subject": item["subject"],
+        "level": item["level"],
+    }
+    # 問題ID・問題文・解説APIの HTML (修復で作り直すときに使う)
+    card.update(fields)
+    return card
+
+
+def generate_rewrite(question, explanation, article="", point=""):
+    """
+    ユーザー要望:
+    表面: ポイント + 解説 + 条文 (要約なし)
+    裏面: ソースURL (呼び出し元で設定)
+    """
+
+    # AIを使用せず、そのまま結合して返す
+    components = []
+
+    # ポイント
+    if point:
+        components.append(f"【ポイント】\n{point}")
+
+    # 解説
+    components.append(f"【解説】\n{explanation}")
+
+    # 条文
+    if article:
+        components.append(f"【条文】\n{article}")
+
+    front_text = "\n\n---\n".join(components)
+
+    return front_text, explanation
+
+
+# 保存した応答 (http_archive) からの再解析
+# 再解析で作り直す項目
+REPARSE_FIELDS = ["front", "q_id", "question"] + list(FRAGMENT_FIELDS.values())
+
+# 各プロセスで一度だけアーカイブの索引を読む
+_archives = {}
+
+
+def _archive(path):
+    archive = _archives.get(path)
+    if archive is None:
+        archive = HttpArchive(path)
+        _archives[path] = archive
+    return archive
+
+
+def reparse_card(task):
+    """
+    保存した応答から1枚分の更新する項目を作る (別プロセスで実行する)
+    task: (アーカイブのパス, source, 保存してある q_id)
+    戻り値: 更新する項目の dict、アーカイブに応答がなければ None
+    """
+    path, url, q_id = task
+    archive = _archive(path)
+    fields = {}
+    q_id = q_id or q_id_from_url(url)
+    fragments = None
+    if q_id:
+        fragments = _archived_fragments(archive, q_id)
+        # 問題IDの確かめ方は fetch_question と同じ
+        if fragments is not None and not confirmed_q_id(fragments, q_id):
+            fragments = None
+    if fragments is None:
+        # 問題ページを保存してあれば、そこから問題IDと問題文を読み取る
+        page = archive.get("GET", url)
+        if page is None or page[0]["status"] != 200:
+            return None
+        soup = BeautifulSoup(page[1], "html.parser")
+        page_q_id = q_id_from_page(soup)
+        if not page_q_id:
+            return None
+        q_div = soup.find("div", class_="q_body")
+        if q_div:
+            fields["question"] = q_div.get_text(strip=True)
+        fragments = _archived_fragments(archive, page_q_id)
+        if fragments is None:
+            return None
+        q_id = page_q_id
+    fields["q_id"] = q_id
+    fields.update(fragments)
+    fields["front"], _ = generate_rewrite("", *render_fragments(fragments))
+    return fields
+
+
+def _archived_fragments(archive, q_id):
+    found = archive.get("POST", API_URL, api_data(q_id))
+    if found is None or found[0]["status"] != 200:
+        return None
+    fragments, _ = parse_fragments(found[1], q_id)
+    return fragments
+
+
+def reparse(json_path, processes=None, progress=None, checkpoint_every=500):
+    """
+    保存した応答から全カードを作り直し、変わった項目をジャーナルへ記録する (通信しない)
+    解析はプロセスプールで並行に行う。progress(処理済み, 全体) は50枚ごとに呼ばれる
+    戻り値: {"cards": 対象の枚数, "updated": 変わった枚数, "missing": 応答のない枚数}
+    """
+    path = archive_path(json_path)
+    conn = card_store.open_store(json_path)
+    try:
+        cards = [
+            (card["source"], {k: card.get(k) for k in REPARSE_FIELDS})
+            for card in card_store.iter_cards(conn)
+            if urlsplit(card.get("source", "")).netloc == SITE_HOST
+        ]
+    finally:
+        conn.close()
+
+    result = {"cards": len(cards), "updated": 0, "missing": 0}
+    if not cards:
+        return result
+    tasks = [(path, source, old.get("q_id")) for source, old in cards]
+    # プロセスとのやり取りの回数を減らすため、まとめて渡す
+    workers = processes or os.cpu_count() or 1
+    chunksize = max(1, min(200, len(tasks) // (4 * workers)))
+    journal = JournalWriter(json_path)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+            results = pool.map(reparse_card, tasks, chunksize=chunksize)
+            for done, ((source, old), fields) in enumerate(zip(cards, results), 1):
+                if fields is None:
+                    result["missing"] += 1
+                else:
+                    changed = {k: v for k, v in fields.items() if old.get(k) != v}
+                    if changed:
+                        journal.update(source, changed)
+                        result["updated"] += 1
+                if done % checkpoint_every == 0:
+                    journal.sync()
+                    card_store.checkpoint(json_path)
+                if progress is not None and (done % 50 == 0 or done == len(cards)):
+                    progress(done, len(cards))
+    finally:
+        journal.close()
+    card_store.compact(json_path)
+    return result
+
+
+if __name__ == "__main__":
+    # python sharousi_site.py [データファイル] [プロセス数]
+    json_path = sys.argv[1] if len(sys.argv) > 1 else "sharousi_data.json"
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    t0 = time.monotonic()
+    result = reparse(
+        json_path,
+        processes,
+        progress=lambda n, total: print(f"\r{n} / {total} 枚", end="", flush=True),
+    )
+    print(
+        f"\n{result['cards']} 枚を {time.monotonic() - t0:.1f} 秒で再解析しました "
+        f"(更新: {result['updated']} 枚, 応答なし: {result['missing']} 枚)"
+    )
@@ -1,7 +1,14 @@
 import streamlit as st
-import json
 import os
 
+from card_apkg import apkg_job, start_apkg_export
+from card_deck import card_deck, deck_card
+from card_export import build_csv, cached_csv, export_key
+from card_render import PREFETCH_RADIUS, RENDER_CACHE_SIZE, RenderCache
+from card_search import open_snapshot_search_index
+from card_snapshot import latest_snapshot, open_shared_snapshot, snapshot_path
+from card_stats import json_stats
+
 # page config
 st.set_page_config(page_title="社労士過去問カードビューアー", page_icon="📝")
 
@@ -10,20 +17,28 @@ st.caption("作成済みのフラッシュカードデータを閲覧・学習
 
 # 定数定義
 SAVE_FILE = "sharousi_data.json"
+# キーワード検索で表示する件数
+SEARCH_LIMIT = 100
+# Anki デッキの名前
+DECK_NAME = "社労士過去問"
 
 # Sidebar
 st.sidebar.markdown("## 📊 データ状況")
-if os.path.exists(SAVE_FILE):
+snapshot = None
+if os.path.exists(SAVE_FILE) or latest_snapshot(snapshot_path(SAVE_FILE)):
     try:
-        with open(SAVE_FILE, "r", encoding="utf-8") as f:
-            d = json.load(f)
-        st.sidebar.metric("総カード数", f"{len(d)} 枚")
+        # バイナリスナップショットを mmap で開く (本文は表示するカードだけ展開)
+        # 全セッションで共有し、ファイルが更新されるまで開き直さない
+        snapshot = open_shared_snapshot(SAVE_FILE)
+        # 集計はサイドカー (*.stats.json) から読む (JSON が更新された時だけ数え直す)
+        if os.path.exists(SAVE_FILE):
+            stats = json_stats(SAVE_FILE)
+        else:
+            stats = {"total": len(snapshot), "subject": snapshot.count_by("subject")}
+        st.sidebar.metric("総カード数", f"{stats['total']} 枚")
 
         # Breakdown
-        subjects = {}
-        for x in d:
-            s = x.get("subject", "不明")
-            subjects[s] = subjects.get(s, 0) + 1
+        subjects = stats["subject"]
 
         if subjects:
             st.sidebar.markdown("### 科目別")
@@ -37,69 +52,125 @@ else:
 st.sidebar.markdown("---")
 
 # Main Viewer Logic
-if os.path.exists(SAVE_FILE):
+if snapshot is not None:
     try:
-        with open(SAVE_FILE, "r", encoding="utf-8") as f:
-            all_data = json.load(f)
+        total_count = len(snapshot)
 
-        if not all_data:
+        if not total_count:
             st.warning("データが空です。")
         else:
             # --- フィルタリング機能 ---
             st.sidebar.markdown("### 🔍 フィルタ")
 
-            # 1. 科目フィルタ
-            available_subjects = sorted(
-                list(set([d.get("subject", "不明") for d in all_data]))
-            )
+            # 1. 科目フィルタ (選択肢の横に枚数を表示)
+            subject_counts = snapshot.facet_counts("subject")
+            available_subjects = list(subject_counts)
             selected_subjects = st.sidebar.multiselect(
                 "科目で絞り込み",
                 options=available_subjects,
                 default=available_subjects,
+                format_func=lambda s: f"{s} ({subject_counts[s]})",
             )
 
-            # 2. 難易度フィルタ
-            available_levels = sorted(
-                list(set([d.get("level", "不明") for d in all_data]))
-            )
+            # 2. 難易度フィルタ (枚数は選択中の科目の中での枚数)
+            available_levels = snapshot.values("level")
+            level_counts = snapshot.facet_counts("level", subjects=selected_subjects)
             selected_levels = st.sidebar.multiselect(
                 "難易度で絞り込み",
                 options=available_levels,
                 default=available_levels,
+                format_func=lambda lv: f"{lv} ({level_counts.get(lv, 0)})",
             )
 
-            # フィルタリング実行 (AND条件)
-            saved_data = [
-                d
-                for d in all_data
-                if d.get("level", "不明") in selected_levels
-                and d.get("subject", "不明") in selected_subjects
-            ]
+            # フィルタリング実行 (AND条件、メタデータだけで判定)
+            saved_data = snapshot.filter(
+                subjects=selected_subjects, levels=selected_levels
+            )
+
+            # 3. キーワード検索 (絞り込み結果の中から関連度順に表示)
+            query = st.sidebar.text_input(
+                "🔎 キーワード検索", placeholder="例: 育児休業"
+            )
+            if query != st.session_state.get("search_query", ""):
+                st.session_state.search_query = query
+                st.session_state.card_idx = 0
+                st.session_state.is_flipped = False
+            if query.strip():
+                search_index = open_snapshot_search_index(SAVE_FILE, snapshot)
+                saved_data, hit_count = search_index.search(
+                    query, snapshot, positions=saved_data, limit=SEARCH_LIMIT
+                )
+                st.sidebar.caption(
+                    f"「{query}」: {hit_count} 件中、上位 {len(saved_data)} 件"
+                )
 
             # --- Anki用エクスポート ---
             st.sidebar.markdown("---")
             if saved_data:
-                csv_lines = []
-                for d in saved_data:
-                    f_txt = d.get("front", "").replace("\n", "<br>").replace('"', '""')
-                    b_txt = d.get("back", "").replace("\n", "<br>").replace('"', '""')
-                    tag = f"{d.get('subject', '不明')} {d.get('level', '-')}"
-                    line = f'"{f_txt}","{b_txt}","{tag}"'
-                    csv_lines.append(line)
-
-                csv_data = "\n".join(csv_lines)
-
-                st.sidebar.download_button(
-                    label="Anki用CSVをダウンロード",
-                    data=csv_data,
-                    file_name="anki_cards.csv",
-                    mime="text/csv",
-                )
+                # CSV はボタンが押されたときだけ作成し、同じ絞り込み結果なら使い回す
+                csv_path = cached_csv(SAVE_FILE, snapshot, saved_data)
+                if csv_path is None and st.sidebar.button("📦 Anki用CSVを作成"):
+                    with st.spinner("CSVを作成しています..."):
+                        csv_path = build_csv(SAVE_FILE, snapshot, saved_data)
+                if csv_path is not None:
+                    with open(csv_path, "rb") as f:
+                        st.sidebar.download_button(
+                            label="Anki用CSVをダウンロード",
+                            data=f,
+                            file_name="anki_cards.csv",
+                            mime="text/csv",
+                        )
 
-            st.caption(f"全 {len(all_data)} 件中、{len(saved_data)} 件を表示中")
+                # Anki デッキ (.apkg) はバックグラウンドで作成する (画面は操作できる)
+                apkg = apkg_job(SAVE_FILE, snapshot, saved_data)
+                if apkg is None and st.sidebar.button("🗂️ Ankiデッキ(.apkg)を作成"):
+                    apkg = start_apkg_export(SAVE_FILE, snapshot, saved_data, DECK_NAME)
+                if apkg is not None:
+                    if apkg.error:
+                        st.sidebar.error(f"デッキの作成に失敗しました: {apkg.error}")
+                    elif not apkg.finished:
+                        st.sidebar.progress(
+                            apkg.done / max(1, apkg.total),
+                            text=f"デッキを作成中... ({apkg.done} / {apkg.total})",
+                        )
+                        st.sidebar.button("🔄 状態を更新")
+                    else:
+                        with open(apkg.path, "rb") as f:
+                            st.sidebar.download_button(
+                                label="Ankiデッキ(.apkg)をダウンロード",
+                                data=f,
+                                file_name="sharousi.apkg",
+                                mime="application/octet-stream",
+                            )
+
+            st.caption(f"全 {total_count} 件中、{len(saved_data)} 件を表示中")
+
+            # デッキ表示はめくる・移動をブラウザの中だけで行う (スマホでも待ち時間がない)
+            view_mode = st.sidebar.radio(
+                "表示モード", ["デッキ (ブラウザで操作)", "1枚ずつ表示"]
+            )
 
             if not saved_data:
                 st.warning("条件に一致するカードがありません。")
+            elif view_mode == "デッキ (ブラウザで操作)":
+
+                def load_page(start, stop):
+                    page = []
+                    for n in range(start, stop):
+                        pos = saved_data[n]
+                        subject_info, level_info, _ = snapshot.meta(pos)
+                        label = f"🏷️ {subject_info} / ランク: {level_info}"
+                        page.append(deck_card(snapshot.card(pos), n + 1, pos, label))
+                    return page
+
+                results = card_deck(
+                    load_page, len(saved_data), export_key(snapshot, saved_data)
+                )
+                if results:
+                    right = sum(1 for v in results.values() if v)
+                    st.caption(
+                        f"記録: ○ 覚えた {right} 枚 / ✖ 要復習 {len(results) - right} 枚"
+                    )
             else:
                 # --- Session State 初期化 ---
                 if "card_idx" not in st.session_state:
@@ -107,17 +178,32 @@ if os.path.exists(SAVE_FILE):
                 if "is_flipped" not in st.session_state:
                     st.session_state.is_flipped = False
 
+                # 前後のカードを描画しておくキャッシュ (セッションごと)
+                if "render_cache" not in st.session_state:
+                    st.session_state.render_cache = RenderCache()
+                render_cache = st.session_state.render_cache
+                with st.sidebar.expander("⚡ 先読み設定"):
+                    cache_size = st.number_input(
+                        "キャッシュする枚数", 4, 512, value=RENDER_CACHE_SIZE
+                    )
+                    radius = st.number_input(
+                        "前後に先読みする枚数", 0, 20, value=PREFETCH_RADIUS
+                    )
+                    render_cache.resize(cache_size, radius)
+                    info = render_cache.stats()
+                    st.caption(
+                        f"描画済み {info['count']} / {info['size']} 枚 "
+                        f"(ヒット {info['hits']} 回 / 描画 {info['misses']} 回)"
+                    )
+
                 # 範囲チェック
                 if st.session_state.card_idx >= len(saved_data):
                     st.session_state.card_idx = 0
 
-                # 現在のカードデータを取得
-                card = saved_data[st.session_state.card_idx]
+                # 現在のカードの位置 (本文は表示する面だけ展開する)
+                card_pos = saved_data[st.session_state.card_idx]
 
-                subject_info = card.get("subject", "不明")
-                level_info = card.get("level", "-")
-                front_text = card.get("front", "")
-                back_text = card.get("back", "")
+                subject_info, level_info, _ = snapshot.meta(card_pos)
 
                 # --- 画面レイアウト ---
                 st.markdown(f"#### 🏷️ {subject_info} / ランク: {level_info}")
@@ -137,16 +223,18 @@ if os.path.exists(SAVE_FILE):
                     st.session_state.is_flipped = False
                     st.rerun()
 
-                # カード表示エリア
+                # カード表示エリア (先読み済みなら描画済みの HTML を出すだけ)
+                rendered = render_cache.get(snapshot, card_pos)
                 card_container = st.container(border=True)
                 with card_container:
                     if st.session_state.is_flipped:
+                        back_text = rendered["source"]
                         st.markdown("### 💡 ソースURL (裏面)")
                         st.code(back_text, language=None)
                         st.link_button("元サイトを開く", back_text)
                     else:
                         st.markdown("### 📝 カード内容 (表面)")
-                        st.markdown(front_text)
+                        st.markdown(rendered["front"], unsafe_allow_html=True)
 
                 # 操作ボタン
                 col_prev, col_flip, col_next = st.columns([1, 2, 1])
@@ -172,6 +260,9 @@ if os.path.exists(SAVE_FILE):
                         st.session_state.is_flipped = False
                         st.rerun()
 
+                # 表示し終わってから前後のカードを描画しておく
+                render_cache.prefetch(snapshot, saved_data, st.session_state.card_idx)
+
     except Exception as e:
         st.error(f"読み込みエラー: {e}")
 else: